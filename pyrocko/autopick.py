@@ -17,6 +17,8 @@ def recursive_stalta(tshort, tlong, kshort, klong, kderivative, energytrace, tem
     
     if not inplace:
         energytrace = energytrace.copy()
+    else:
+        energytrace.make_writeable()
     
     autopick_ext.recursive_stalta(ns, nl, kshort/ns, klong/nl, kderivative, energytrace.ydata, temp, temp is None)
     
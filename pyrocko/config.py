@@ -2,3 +2,4 @@ import os
 
 earthradius = 6371.*1000.
 cache_dir = '/tmp/pyrocko_0.3_cache_%s' % os.environ['USER']
+pile_data_cache_nbytes = 256*1024*1024
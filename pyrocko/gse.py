@@ -1,7 +1,8 @@
 
 import util, model
-import sys, re, calendar, time, logging
+import sys, os, re, calendar, time, logging, mmap
 from pyrocko import gse_ext, trace
+from io_common import FileLoadError
 import numpy as num
 
 unpack_fixed = util.unpack_fixed
@@ -44,11 +45,18 @@ instrument_descriptions = {
 'TSJ-1e': 'TSJ-1e'}
 
 modulus = 100000000
+def _cmod(x, m):
+    # remainder with the sign of x, like C's % operator
+    if x < 0:
+        return -((-x) % m)
+    else:
+        return x % m
+
 def checksum_slow(data):
     checksum = 0
     for x in data:
-        checksum += x % modulus
-        checksum = checksum % modulus
+        checksum += _cmod(int(x), modulus)
+        checksum = _cmod(checksum, modulus)
     return abs(checksum)    
 
 
@@ -82,6 +90,56 @@ def sslashdate(i):
 class Anon:
     pass
 
+class BadGSESection(Exception):
+    pass
+
+def parse_wid2(line):
+    '''Parse GSE2 WID2 line.'''
+
+    wid2 = Anon()
+    if not line[24:28].startswith('.'):
+        raise BadGSESection('Invalid time in WID2 line: %s' % line.rstrip())
+
+    try:
+        wid2.tmin = calendar.timegm((int(line[5:9]), int(line[10:12]), 
+            int(line[13:15]), int(line[16:18]), int(line[19:21]), 
+            int(line[22:24]))) + float(line[24:28])
+    except ValueError:
+        raise BadGSESection('Invalid time in WID2 line: %s' % line.rstrip())
+
+    strtmin, wid2.station, wid2.channel, wid2.auxid, wid2.sub_format, \
+        wid2.samps, wid2.samprate, wid2.calib, wid2.calper, \
+        wid2.instype, wid2.hang, wid2.vang = unpack_fixed( \
+        'x5,a23,x1,a5,x1,a3,x1,a4,x1,a3,x1,i8,x1,f11,x1,f10,x1,f7,x1,a6,x1,f5,x1,f4',
+        line)
+
+    return wid2
+
+def parse_chk2(line):
+    '''Parse GSE2 CHK2 line.'''
+
+    chk2 = Anon()
+    toks = line.split()
+    if len(toks) != 2:
+        raise BadGSESection('Invalid CHK2 line: %s' % line.rstrip())
+
+    chk2.checksum = int(toks[1])
+    return chk2
+
+def decode_data(buf, start, end, wid2, chk2):
+    '''Decode waveform data in buf[start:end] and verify its checksum.'''
+
+    if wid2.sub_format in ('CM6', 'INT'):
+        data = gse_ext.decode_dat2(buf, start, end, wid2.sub_format, wid2.samps)
+    else:
+        data = gse_ext.decode_m6(buf[start:end], wid2.samps)
+    
+    if chk2 is not None and not gse_ext.verify_checksum(data, chk2.checksum):
+        logger.warn('GSE2 checksum mismatch for waveform %s.%s.%s at %s' % (
+            wid2.station, wid2.auxid, wid2.channel, util.time_to_str(wid2.tmin)))
+
+    return data
+
 class GSE:
     def __init__(self):
         self.version = None
@@ -156,8 +214,8 @@ class Waveform:
         self.dat2 = dat2
       
         assert self.wid2.sub_format in 'INT CM6 CM8 AUT AU6 AU8'.split()
-        from pyrocko import gse_ext
-        self.data = gse_ext.decode_m6( ''.join(dat2.rawdata), wid2.samps )
+        rawdata = '\n'.join(dat2.rawdata)
+        self.data = decode_data(rawdata, 0, len(rawdata), wid2, chk2)
 
     def __str__(self):
         return ' '.join([self.wid2.station, self.wid2.channel, self.wid2.auxid, self.wid2.sub_format, util.gmctime(self.wid2.tmin)])
@@ -315,22 +373,7 @@ class DataSection:
                     if wid2: 
                         yield Waveform(wid2, sta2, chk2, dat2)
                         reset()
-                    wid2 = Anon()
-
-                    assert line[24:28].startswith('.')
-                    
-                    
-                    wid2.tmin = ( calendar.timegm( time.strptime( 
-                            line[5:15]+ ' ' + line[16:24], 
-                            '%Y/%m/%d %H:%M:%S') )
-                        + float(line[24:28]))
-                        
-                    strtmin, wid2.station, wid2.channel, wid2.auxid, wid2.sub_format, \
-                        wid2.samps, wid2.samprate, wid2.calib, wid2.calper, \
-                        wid2.instype, wid2.hang, wid2.vang = unpack_fixed( \
-                        'x5,a23,x1,a5,x1,a3,x1,a4,x1,a3,x1,i8,x1,f11,x1,f10,x1,f7,x1,a6,x1,f5,x1,f4',
-                        line)
-                    
+                    wid2 = parse_wid2(line)
                     at = 1
                     continue
                     
@@ -362,10 +405,7 @@ class DataSection:
                 
             if at == 2:
                 if line.startswith('CHK2'):
-                    chk2 = Anon()
-                    toks = line.split()
-                    assert len(toks) == 2
-                    chk2.checksum = int(toks[1])
+                    chk2 = parse_chk2(line)
                     at = 0
                     continue
                 else:
@@ -464,3 +504,89 @@ def readgse(fn):
                 
         yield gse
         
+
+def _find_line(buf, key, pos):
+    '''Find next line starting with key in buf, starting at pos.'''
+
+    i = buf.find(key, pos)
+    while i > 0 and buf[i-1] != '\n':
+        i = buf.find(key, i+1)
+
+    return i
+
+def _line_end(buf, pos):
+    i = buf.find('\n', pos)
+    if i == -1:
+        i = len(buf)
+
+    return i
+
+def iload_waveforms(buf, load_data=True):
+    '''Iterate over the waveforms in a buffer holding GSE2 data.
+
+    Block boundaries are found with string searches on the buffer and the data
+    are decoded in :py:mod:`gse_ext` directly from the buffer, the data lines
+    are not processed in Python. Sections other than waveforms are skipped.
+    '''
+
+    pos = 0
+    while True:
+        iwid = _find_line(buf, 'WID2', pos)
+        if iwid == -1:
+            break
+
+        iwid_end = _line_end(buf, iwid)
+        wid2 = parse_wid2(buf[iwid:iwid_end])
+
+        idat = _find_line(buf, 'DAT2', iwid_end)
+        if idat == -1 or _find_line(buf[iwid_end:idat], 'WID2', 0) != -1:
+            raise BadGSESection('No DAT2 block after WID2 line: %s' % buf[iwid:iwid_end].rstrip())
+
+        idat_end = _line_end(buf, idat)
+        ichk = _find_line(buf, 'CHK2', idat_end)
+        if ichk == -1:
+            raise BadGSESection('No CHK2 line after DAT2 block')
+
+        ichk_end = _line_end(buf, ichk)
+        
+        deltat = 1.0/wid2.samprate
+        if load_data:
+            chk2 = parse_chk2(buf[ichk:ichk_end])
+            data = decode_data(buf, idat_end, ichk, wid2, chk2)
+            tmax = None
+        else:
+            data = None
+            tmax = wid2.tmin + (wid2.samps-1)*deltat
+
+        yield trace.Trace(station=wid2.station, location=wid2.auxid, 
+                channel=wid2.channel, tmin=wid2.tmin, tmax=tmax,
+                deltat=deltat, ydata=data)
+
+        pos = ichk_end
+
+def iload(filename, load_data=True):
+    '''Read waveforms from a GSE2 file.
+
+    This is a fast path for waveform data, the file is memory-mapped and
+    processed with :py:func:`iload_waveforms`. Use :py:func:`readgse` to get
+    the other contents of the file.
+    '''
+
+    try:
+        f = open(filename, 'rb')
+        try:
+            if os.fstat(f.fileno())[6] == 0:
+                return
+
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        try:
+            for tr in iload_waveforms(buf, load_data):
+                yield tr
+        finally:
+            buf.close()
+
+    except (EnvironmentError, gse_ext.GSEError, util.UnpackError, BadGSESection), e:
+        raise FileLoadError(e)
@@ -1,5 +1,6 @@
 #define NPY_NO_DEPRECATED_API
     
+#define PY_SSIZE_T_CLEAN
 #include "Python.h"
 #include "numpy/arrayobject.h"
 
@@ -19,10 +20,21 @@ static char translate[128] =
 
 static int MODULUS = 100000000;
 
+static int checksum_int32(int *data, int length) {
+    int checksum, i;
+
+    checksum = 0;
+    for (i=0; i<length; i++) {
+        checksum += data[i] % MODULUS;
+        checksum %= MODULUS;
+    }
+    return abs(checksum);
+}
+
 
 static PyObject* gse_checksum(PyObject *dummy, PyObject *args) {
         
-    int checksum, length, i;
+    int checksum, length;
     PyObject *array = NULL;
     PyArrayObject *carray = NULL;
     int *data;
@@ -44,66 +56,66 @@ static PyObject* gse_checksum(PyObject *dummy, PyObject *args) {
     length = PyArray_SIZE(carray);
     data = (int*)PyArray_DATA(carray);
     
-    checksum = 0;
-    for (i=0; i<length; i++) {
-        checksum += data[i] % MODULUS;
-        checksum %= MODULUS;
-    }
+    checksum = checksum_int32(data, length);
+    Py_DECREF(carray);
     
-    return Py_BuildValue("i", abs(checksum));
+    return Py_BuildValue("i", checksum);
 }
 
-static PyObject* gse_decode_m6(PyObject *dummy, PyObject *args) {
-    char *in_data;
-    int *out_data = NULL;
-    char *pos;
-    char v;
-    int sample, isample, ibyte, sign;
-    int bufsize, previous1, previous2;
-    char imore = 32, isign = 16;
-    PyObject      *array = NULL;
-    npy_intp      array_dims[1] = {0};
-    
-    
-    if (!PyArg_ParseTuple(args, "si", &in_data, &bufsize)) {
-        PyErr_SetString(GSEError, "invalid arguments in decode_m6(data, sizehint)" );
+static PyObject* gse_verify_checksum(PyObject *dummy, PyObject *args) {
+    int checksum;
+    PyObject *array = NULL;
+    PyArrayObject *carray = NULL;
+    int ok;
+
+    if (!PyArg_ParseTuple(args, "Oi", &array, &checksum)) {
+        PyErr_SetString(GSEError, "usage verify_checksum(array, checksum)" );
+        return NULL;
+    }
+    if (!PyArray_Check(array) || PyArray_TYPE(array) != NPY_INT32) {
+        PyErr_SetString(GSEError, "Data must be given as NumPy array of 32-bit integers.");
         return NULL;
     }
 
-    if (bufsize <= 1) bufsize = 64;
+    carray = PyArray_GETCONTIGUOUS((PyArrayObject*)array);
+    ok = checksum_int32((int*)PyArray_DATA(carray), PyArray_SIZE(carray)) == abs(checksum);
+    Py_DECREF(carray);
 
-    out_data = (int*)malloc(bufsize*sizeof(int));
-    if (out_data == NULL) {
-        PyErr_SetString(GSEError, "cannot allocate memory" );
-        return NULL;
+    return PyBool_FromLong(ok);
+}
+
+/* Append a sample to a growing buffer, returns 0 on success. */
+static int push_sample(int **pdata, int *pn, int *pbufsize, int value) {
+    int *newdata;
+
+    if (*pn >= *pbufsize) {
+        *pbufsize = (*pn)*2 > 64 ? (*pn)*2 : 64;
+        newdata = (int*)realloc(*pdata, sizeof(int) * (*pbufsize));
+        if (newdata == NULL) return -1;
+        *pdata = newdata;
     }
+    (*pdata)[(*pn)++] = value;
+    return 0;
+}
+
+/* Decode CM6 characters in [pos, end), undoing the second differences.
+   Characters outside of the CM6 alphabet (line breaks) are skipped. */
+static int decode_cm6(const char *pos, const char *end, int **pdata, int *pn, int *pbufsize) {
+    char v;
+    int sample = 0, ibyte = 0, sign = 1;
+    int previous1 = 0, previous2 = 0;
+    char imore = 32, isign = 16;
 
-    pos = in_data;
-    sample = 0;
-    isample = 0;
-    ibyte = 0;
-    sign = 1;
-    previous1 = 0;
-    previous2 = 0;
-    while (*pos != '\0') {
+    for (; pos != end && *pos != '\0'; pos++) {
         v = translate[*pos & 0x7F];
         if (v != -1) {
             if (ibyte == 0) sign = (v & isign) ? -1 : 1;
             
             sample += v & ((ibyte == 0) ? 0xf : 0x1f);
             if ( (v & imore) == 0) {
-                if (isample >= bufsize) {
-                    bufsize = isample*2;
-                    out_data = (int*)realloc(out_data, sizeof(int) * bufsize);
-                    if (out_data == NULL) {
-                        free(out_data);
-                        PyErr_SetString(GSEError, "cannot allocate memory" );
-                        return NULL;
-                    }
-                }
                 previous1 = previous1 + sign * sample;
-                out_data[isample] = previous2 = previous2 + previous1;
-                isample++;
+                previous2 = previous2 + previous1;
+                if (push_sample(pdata, pn, pbufsize, previous2) != 0) return -1;
                 sample = 0;
                 ibyte = 0;
             } else {
@@ -111,19 +123,141 @@ static PyObject* gse_decode_m6(PyObject *dummy, PyObject *args) {
                 ibyte++;
             }
         }
-        pos++;
     }
-    array_dims[0] = isample;
+    return 0;
+}
+
+/* Parse whitespace separated integers in [pos, end). */
+static int decode_int(const char *pos, const char *end, int **pdata, int *pn, int *pbufsize) {
+    int value, sign, ndigits;
+
+    while (pos != end) {
+        while (pos != end && (*pos == ' ' || *pos == '\n' || *pos == '\r' || *pos == '\t')) pos++;
+        if (pos == end) break;
+
+        sign = 1;
+        if (*pos == '-' || *pos == '+') {
+            if (*pos == '-') sign = -1;
+            pos++;
+        }
+        value = 0;
+        ndigits = 0;
+        while (pos != end && *pos >= '0' && *pos <= '9') {
+            value = value*10 + (*pos - '0');
+            ndigits++;
+            pos++;
+        }
+        if (ndigits == 0) return -2;
+        if (push_sample(pdata, pn, pbufsize, sign*value) != 0) return -1;
+    }
+    return 0;
+}
+
+static PyObject* gse_decode_dat2(PyObject *dummy, PyObject *args) {
+    const char *buffer;
+    Py_ssize_t buflen, start, end;
+    char *sub_format;
+    int nsamples, n = 0, bufsize, retcode;
+    int *out_data = NULL;
+    PyObject *array = NULL;
+    npy_intp array_dims[1] = {0};
+
+    if (!PyArg_ParseTuple(args, "s#nnsi", &buffer, &buflen, &start, &end, &sub_format, &nsamples)) {
+        PyErr_SetString(GSEError, "usage decode_dat2(buffer, start, end, sub_format, nsamples)" );
+        return NULL;
+    }
+
+    if (start < 0 || end > buflen || start > end) {
+        PyErr_SetString(GSEError, "invalid data range");
+        return NULL;
+    }
+
+    bufsize = nsamples > 1 ? nsamples : 64;
+    out_data = (int*)malloc(bufsize*sizeof(int));
+    if (out_data == NULL) {
+        PyErr_SetString(GSEError, "cannot allocate memory" );
+        return NULL;
+    }
+
+    if (strcmp(sub_format, "CM6") == 0) {
+        retcode = decode_cm6(buffer+start, buffer+end, &out_data, &n, &bufsize);
+    } else if (strcmp(sub_format, "INT") == 0) {
+        retcode = decode_int(buffer+start, buffer+end, &out_data, &n, &bufsize);
+    } else {
+        free(out_data);
+        PyErr_Format(GSEError, "unsupported GSE2 data format: %s", sub_format);
+        return NULL;
+    }
+
+    if (retcode != 0) {
+        free(out_data);
+        PyErr_SetString(GSEError, retcode == -2 ? "invalid character in INT data" : "cannot allocate memory" );
+        return NULL;
+    }
+
+    array_dims[0] = n;
+    array = PyArray_SimpleNewFromData(1, array_dims, NPY_INT32, out_data);
+    if (array == NULL) {
+        free(out_data);
+        return NULL;
+    }
+    PyArray_ENABLEFLAGS((PyArrayObject*)array, NPY_ARRAY_OWNDATA);
+    return array;
+}
+
+static PyObject* gse_decode_m6(PyObject *dummy, PyObject *args) {
+    char *in_data;
+    int *out_data = NULL;
+    int bufsize, n = 0;
+    PyObject      *array = NULL;
+    npy_intp      array_dims[1] = {0};
+    
+    
+    if (!PyArg_ParseTuple(args, "si", &in_data, &bufsize)) {
+        PyErr_SetString(GSEError, "invalid arguments in decode_m6(data, sizehint)" );
+        return NULL;
+    }
+
+    if (bufsize <= 1) bufsize = 64;
+
+    out_data = (int*)malloc(bufsize*sizeof(int));
+    if (out_data == NULL) {
+        PyErr_SetString(GSEError, "cannot allocate memory" );
+        return NULL;
+    }
+
+    if (decode_cm6(in_data, NULL, &out_data, &n, &bufsize) != 0) {
+        free(out_data);
+        PyErr_SetString(GSEError, "cannot allocate memory" );
+        return NULL;
+    }
+
+    array_dims[0] = n;
     array = PyArray_SimpleNewFromData(1, array_dims, NPY_INT32, out_data);
-    return Py_BuildValue("N", array);
+    if (array == NULL) {
+        free(out_data);
+        return NULL;
+    }
+    PyArray_ENABLEFLAGS((PyArrayObject*)array, NPY_ARRAY_OWNDATA);
+    return array;
 }
 
 static PyMethodDef GSEMethods[] = {
     {"decode_m6",  gse_decode_m6, METH_VARARGS, 
         "Decode m6 encoded GSE data." },
         
+    {"decode_dat2",  gse_decode_dat2, METH_VARARGS, 
+        "decode_dat2(buffer, start, end, sub_format, nsamples)\n"
+        "Decode GSE2 waveform data (sub_format 'CM6' or 'INT') found in\n"
+        "buffer[start:end]. `buffer` may be any read buffer, e.g. an mmap.\n"
+        "`nsamples` is used as size hint." },
+
     {"checksum", gse_checksum, METH_VARARGS,
         "Calculate GSE checksum."},
+
+    {"verify_checksum", gse_verify_checksum, METH_VARARGS,
+        "verify_checksum(array, checksum)\n"
+        "Check GSE checksum of int32 data."},
     
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
@@ -57,12 +57,14 @@ class Chain(Processor):
 
     def process(self, trace):
         traces = [ trace ]
-        xtraces = []
         for p in self._processors:
+            xtraces = []
             for tr in traces:
-                xtraces.extend(p.process(traces))
+                xtraces.extend(p.process(tr))
 
-        return xtraces
+            traces = xtraces
+
+        return traces
 
 class Downsampler(Processor):
 
@@ -86,6 +88,39 @@ class Downsampler(Processor):
     def __del__(self):
         self._downsampler.close()
 
+class Filter(Processor):
+    '''Butterworth filter keeping its state across successive traces.
+
+    See :py:class:`pyrocko.trace.ContinuousFilter`.
+    '''
+
+    def __init__(self, order, corner_hp=None, corner_lp=None):
+        Processor.__init__(self)
+        self._filter = tracemod.ContinuousFilter(order, corner_hp, corner_lp)
+
+    def process(self, trace):
+        return [ self._filter.process(trace) ]
+
+class Detector(Processor):
+    '''STA/LTA trigger, passing traces through unchanged.
+
+    Arguments are those of :py:class:`pyrocko.trace.StaLtaDetector`, except
+    *callback*, which is called as ``callback(trace, triggers)`` whenever
+    triggers are found in an incoming trace.
+    '''
+
+    def __init__(self, callback, *args, **kwargs):
+        Processor.__init__(self)
+        self._callback = callback
+        self._detector = tracemod.StaLtaDetector(*args, **kwargs)
+
+    def process(self, trace):
+        cf, triggers = self._detector.process(trace)
+        if triggers:
+            self._callback(trace, triggers)
+
+        return [ trace ]
+
 class Grower(Processor):
 
     def __init__(self, tflush=None):
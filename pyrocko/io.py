@@ -30,7 +30,7 @@ ASCII Table  text                                  yes      [#f5]_
 '''
 
 import os
-import mseed, sac, kan, segy, yaff, file, seisan_waveform, util, logging
+import mseed, sac, kan, segy, yaff, file, seisan_waveform, gse, util, logging
 import trace
 from pyrocko.mseed_ext import MSeedError
 from io_common import FileLoadError
@@ -39,23 +39,35 @@ import numpy as num
 
 logger = logging.getLogger('pyrocko.io')
 
-def load(filename, format='mseed', getdata=True, substitutions=None ):
+def load(filename, format='mseed', getdata=True, substitutions=None, use_memmap=False, native_dtype=False ):
     '''Load traces from file.
 
-    :param format: format of the file (``'mseed'``, ``'sac'``, ``'segy'``, ``'seisan_l'``, ``'seisan_b'``, ``'kan'``, ``'yaff'``, ``'from_extension'``)
+    :param format: format of the file (``'mseed'``, ``'sac'``, ``'segy'``, ``'seisan_l'``, ``'seisan_b'``, ``'kan'``, ``'yaff'``, ``'gse2'``, ``'from_extension'``)
     :param getdata: if ``True`` (the default), read data, otherwise only read traces metadata
     :param substitutions:  dict with substitutions to be applied to the traces metadata
+    :param use_memmap: if ``True``, memory-map the sample data instead of
+        reading it, where the file format allows (SAC, SEG-Y, and SEISAN
+        files without gain factor). The data arrays then have the sample type
+        and byte order found in the file and are paged in from disk on
+        access. Modifications are not written back to the file. Other formats
+        are read as usual.
+    :param native_dtype: if ``True``, keep the sample type found in the file
+        (e.g. 4-byte floats in SAC files) instead of converting to 8-byte
+        floats, where the file format allows (SAC, SEG-Y, and SEISAN). The
+        samples are read directly into the data arrays and are converted to
+        native byte order in place. Processing methods which need a wider
+        type convert on their own.
     
     :returns: list of loaded traces
     
     When *format* is set to ``'detect'``, the file type is guessed from the first 512 bytes of the file. Only Mini-SEED, SAC, and YAFF format are detected.
     When *format* is set to ``'from_extension'``, the filename extension is used to decide what format should be assumed. The filename extensions
-    considered are (matching is case insensitiv): ``'.sac'``, ``'.kan'``, ``'.sgy'``, ``'.segy'``, ``'.yaff'``, everything else is assumed to be in Mini-SEED format.
+    considered are (matching is case insensitiv): ``'.sac'``, ``'.kan'``, ``'.sgy'``, ``'.segy'``, ``'.yaff'``, ``'.gse'``, everything else is assumed to be in Mini-SEED format.
     
     This function calls :py:func:`iload` and aggregates the loaded traces in a list.
     '''
     
-    return list(iload(filename, format=format, getdata=getdata, substitutions=substitutions))
+    return list(iload(filename, format=format, getdata=getdata, substitutions=substitutions, use_memmap=use_memmap, native_dtype=native_dtype))
 
 def detect_format(filename):
     try:
@@ -72,7 +84,7 @@ def detect_format(filename):
 
     raise FileLoadError(UnknownFormat(filename))
 
-def iload(filename, format='mseed', getdata=True, substitutions=None ):
+def iload(filename, format='mseed', getdata=True, substitutions=None, use_memmap=False, native_dtype=False ):
     '''Load traces from file (iterator version).
     
     This function works like :py:func:`load`, but returns an iterator which yields the loaded traces.
@@ -100,7 +112,8 @@ def iload(filename, format='mseed', getdata=True, substitutions=None ):
             '.sac': 'sac',
             '.kan': 'kan',
             '.segy': 'segy',
-            '.sgy': 'segy'}
+            '.sgy': 'segy',
+            '.gse': 'gse2'}
 
     if format == 'from_extension':
         format = 'mseed'
@@ -117,6 +130,7 @@ def iload(filename, format='mseed', getdata=True, substitutions=None ):
             'sac': sac,
             'mseed': mseed,
             'seisan': seisan_waveform,
+            'gse2': gse,
     }
 
     add_args = {
@@ -126,14 +140,23 @@ def iload(filename, format='mseed', getdata=True, substitutions=None ):
     if format not in format_to_module:
         raise UnsupportedFormat(format)
 
+    memmap_formats = ('sac', 'segy', 'seisan')
+    native_dtype_formats = ('sac', 'segy', 'seisan')
+
     mod = format_to_module[format]
     
-    for tr in mod.iload(filename, load_data=load_data,
-            **add_args.get(format, {})):
+    kwargs = dict(add_args.get(format, {}))
+    if use_memmap and format in memmap_formats:
+        kwargs['use_memmap'] = True
+
+    if native_dtype and format in native_dtype_formats:
+        kwargs['native_dtype'] = True
+
+    for tr in mod.iload(filename, load_data=load_data, **kwargs):
         yield subs(tr)
 
     
-def save(traces, filename_template, format='mseed', additional={}, stations=None):
+def save(traces, filename_template, format='mseed', additional={}, stations=None, nworkers=1, record_length=4096, encoding=None, append=False):
     '''Save traces to file(s).
     
     :param traces: a trace or an iterable of traces to store
@@ -146,6 +169,13 @@ def save(traces, filename_template, format='mseed', additional={}, stations=None
             include microseconds.
     :param format: ``mseed``, ``sac``, ``text``, or ``yaff``.
     :param additional: dict with custom template placeholder fillins.
+    :param nworkers: number of threads writing files in parallel
+            (Mini-SEED only)
+    :param record_length: record length in bytes (Mini-SEED only)
+    :param encoding: data encoding, e.g. ``'STEIM2'`` (Mini-SEED only, see
+            :py:func:`pyrocko.mseed.save`)
+    :param append: append to existing files instead of overwriting them
+            (Mini-SEED only)
     :returns: list of generated filenames
 
     .. note:: 
@@ -159,7 +189,9 @@ def save(traces, filename_template, format='mseed', additional={}, stations=None
         format = os.path.splitext(filename_template)[1][1:]
 
     if format == 'mseed':
-        return mseed.save(traces, filename_template, additional)
+        return mseed.save(traces, filename_template, additional, 
+                nworkers=nworkers, record_length=record_length, 
+                encoding=encoding, append=append)
     
     elif format == 'sac':
         fns = []
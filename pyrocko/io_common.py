@@ -3,3 +3,12 @@ class FileLoadError(Exception):
     '''Raised when a problem occurred while loading of a file.'''
     pass
 
+
+def native_byteorder(data):
+    '''Swap array to native byte order in place and return a native view.'''
+
+    if not data.dtype.isnative:
+        data.byteswap(True)
+        data = data.view(data.dtype.newbyteorder('='))
+
+    return data
@@ -1,41 +1,261 @@
 import mseed_ext
 from mseed_ext import HPTMODULUS, MSeedError
 import trace
-import os, re
+import os, re, sys
 from util import reuse, ensuredirs
 from struct import unpack
 from io_common import FileLoadError
 
+def tuple_to_trace(filename, tr):
+    network, station, location, channel = tr[1:5]
+    tmin = float(tr[5])/float(HPTMODULUS)
+    tmax = float(tr[6])/float(HPTMODULUS)
+    try:
+        deltat = reuse(float(1.0)/float(tr[7]))
+    except ZeroDivisionError, e:
+        raise MSeedError('Trace in file %s has a sampling rate of zero.' % filename)
+    ydata = tr[8]
+    
+    return trace.Trace(network, station, location, channel, tmin, tmax, deltat, ydata)
+
+def tuples_to_traces(filename, trtups):
+    return [ tuple_to_trace(filename, tr) for tr in trtups ]
+
 def iload(filename, load_data=True):
+    '''Iterate over the traces of a Mini-SEED file.
+
+    Traces are yielded while the file is decoded, one for each contiguous
+    segment, as soon as the segment is complete. Memory use is bounded by the
+    segments being assembled, not by the size of the file. Records which would
+    continue a segment which has already been yielded start a new segment.
+    '''
 
     try:
-        traces = []
-        for tr in mseed_ext.get_traces( filename, load_data ):
-            network, station, location, channel = tr[1:5]
-            tmin = float(tr[5])/float(HPTMODULUS)
-            tmax = float(tr[6])/float(HPTMODULUS)
-            try:
-                deltat = reuse(float(1.0)/float(tr[7]))
-            except ZeroDivisionError, e:
-                raise MSeedError('Trace in file %s has a sampling rate of zero.' % filename)
-            ydata = tr[8]
-            
-            traces.append(trace.Trace(network, station, location, channel, tmin, tmax, deltat, ydata))
-        
-        for tr in traces:
-            yield tr
+        for trtup in mseed_ext.iter_traces( filename, load_data ):
+            yield tuple_to_trace(filename, trtup)
     
     except (OSError, MSeedError), e:
         raise FileLoadError(e)
+
+def load_record_index(filename):
+    '''Get traces metainformation and record index of a Mini-SEED file.
+
+    :returns: tuple ``(traces, records)``, where ``traces`` is a list of
+        traces without data (like :py:func:`iload` with ``load_data=False``
+        gives) and ``records`` is a list of tuples ``(offset, reclen,
+        network, station, location, channel, tmin, tmax)``, one for each
+        record in the file
+    '''
+
+    try:
+        trtups, rectups = mseed_ext.get_record_index( filename )
+        traces = tuples_to_traces(filename, trtups)
+
+    except (OSError, MSeedError), e:
+        raise FileLoadError(e)
+    
+    records = []
+    for (offset, reclen, network, station, location, channel, 
+            itmin, itmax) in rectups:
+
+        records.append((offset, reclen, network, station, location, channel,
+                        float(itmin)/float(HPTMODULUS), 
+                        float(itmax)/float(HPTMODULUS)))
+
+    return traces, records
+
+def load_records(filename, records):
+    '''Decode selected records of a Mini-SEED file.
+
+    :param records: list of ``(offset, reclen)`` tuples, as given in the first
+        two elements of the entries returned by :py:func:`load_record_index`,
+        in file order
+    :returns: list of traces with data
+    '''
+
+    try:
+        return tuples_to_traces(filename, 
+                mseed_ext.get_traces_from_records( filename, records ))
+
+    except (OSError, MSeedError), e:
+        raise FileLoadError(e)
+
+def _imap_threaded(function, args_list, nthreads, nahead=None):
+    '''Apply function to each argument tuple using a pool of threads.
+
+    Yields the results in the order of *args_list*. Exceptions are re-raised
+    when the result of the affected job is reached. Jobs are taken from
+    *args_list* as needed, such that at most *nahead* (default:
+    ``2*nthreads``) results are computed ahead of the consumer.
+    '''
+
+    import threading, Queue
+
+    if nthreads <= 1:
+        for args in args_list:
+            yield function(*args)
+
+        return
+
+    if nahead is None:
+        nahead = 2*nthreads
+
+    args_iter = iter(args_list)
+    lock = threading.Lock()
+    slots = threading.Semaphore(nahead)
+    njobs = [0]
+    exhausted = []
+    end = object()
+    results = Queue.Queue()
+    stop = threading.Event()
+
+    def work():
+        while True:
+            slots.acquire()
+            if stop.isSet():
+                return
+
+            lock.acquire()
+            try:
+                if exhausted:
+                    return
+
+                ijob = njobs[0]
+                try:
+                    args = args_iter.next()
+                except StopIteration:
+                    exhausted.append(True)
+                    results.put((ijob, end, None))
+                    return
+
+                njobs[0] += 1
+
+            finally:
+                lock.release()
+
+            try:
+                results.put((ijob, function(*args), None))
+            except Exception:
+                results.put((ijob, None, sys.exc_info()))
+
+    threads = []
+    for i in xrange(nthreads):
+        thread = threading.Thread(target=work)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+
+    try:
+        pending = {}
+        ijob = 0
+        while True:
+            while ijob not in pending:
+                iresult, result, exc_info = results.get()
+                pending[iresult] = result, exc_info
+
+            result, exc_info = pending.pop(ijob)
+            if result is end:
+                break
+
+            slots.release()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            yield result
+            ijob += 1
+
+    finally:
+        stop.set()
+        for thread in threads:
+            slots.release()
+
+        for thread in threads:
+            thread.join()
+
+def _load_file(filename, load_data):
+    return filename, list(iload(filename, load_data))
+
+def iload_many(filenames, load_data=True, nthreads=4):
+    '''Decode several Mini-SEED files concurrently.
+
+    The decoding in :py:mod:`mseed_ext` runs without holding the GIL, so that
+    the files are decoded in parallel by a pool of threads within the current
+    process.
+
+    :param filenames: list of paths to the files
+    :param load_data: if ``False``, only read traces metadata
+    :param nthreads: number of decoding threads
+    :returns: iterator yielding tuples ``(filename, traces)`` in the order of
+        *filenames*, where ``traces`` is the list of traces :py:func:`iload`
+        gives for the file
+
+    Errors are raised as :py:exc:`FileLoadError` when the result of the
+    affected file is reached.
+    '''
+
+    return _imap_threaded(_load_file, 
+            [ (filename, load_data) for filename in filenames ], nthreads)
     
 def as_tuple(tr):
     itmin = int(round(tr.tmin*HPTMODULUS))
     itmax = int(round(tr.tmax*HPTMODULUS))
     srate = 1.0/tr.deltat
+    ydata = tr.get_ydata()
+    if not ydata.dtype.isnative:
+        # e.g. memory-mapped samples of a big endian file
+        ydata = ydata.astype(ydata.dtype.newbyteorder('='))
+
     return (tr.network, tr.station, tr.location, tr.channel, 
-            itmin, itmax, srate, tr.get_ydata())
+            itmin, itmax, srate, ydata)
+
+encodings = {
+    'ASCII': mseed_ext.DE_ASCII,
+    'INT32': mseed_ext.DE_INT32,
+    'FLOAT32': mseed_ext.DE_FLOAT32,
+    'FLOAT64': mseed_ext.DE_FLOAT64,
+    'STEIM1': mseed_ext.DE_STEIM1,
+    'STEIM2': mseed_ext.DE_STEIM2,
+}
+
+def _save_file(fn, traces_thisfile, record_length, encoding, append):
+    trtups = []
+    traces_thisfile.sort(lambda a,b: cmp(a.full_id, b.full_id))
+    for tr in traces_thisfile:
+        trtups.append(as_tuple(tr))
+    
+    ensuredirs(fn)
+    try:
+        mseed_ext.store_traces(trtups, fn, record_length, encoding, append)
+    except MSeedError, e:
+        raise MSeedError( str(e) + ' (while storing traces to file \'%s\')' % fn)
+
+def save(traces, filename_template, additional={}, nworkers=1, record_length=4096, encoding=None, append=False):
+    '''Save traces to Mini-SEED file(s).
+
+    :param nworkers: number of threads writing files in parallel
+    :param record_length: record length in bytes, a power of two between 128
+        and 1048576
+    :param encoding: data encoding, ``'STEIM1'``, ``'STEIM2'``, ``'INT32'``
+        (these need int32 data), ``'FLOAT32'``, ``'FLOAT64'``, ``'ASCII'``,
+        or ``None`` to choose by the sample type (Steim-1 for int32 data)
+    :param append: if ``True``, append to existing files instead of
+        overwriting them
+    :returns: list of generated filenames
+
+    See :py:func:`pyrocko.io.save` for the other arguments.
+    '''
+
+    if not (128 <= record_length <= 1048576 and 
+            record_length & (record_length-1) == 0):
+        raise MSeedError('Invalid record length: %s' % record_length)
+
+    if encoding is None:
+        iencoding = -1
+    elif encoding in encodings:
+        iencoding = encodings[encoding]
+    else:
+        raise MSeedError('Unsupported encoding: %s' % encoding)
 
-def save(traces, filename_template, additional={}):
     fn_tr = {}
     for tr in traces:
         fn = tr.fill_template(filename_template, **additional)
@@ -43,18 +263,12 @@ def save(traces, filename_template, additional={}):
             fn_tr[fn] = []
         
         fn_tr[fn].append(tr)
-        
-    for fn, traces_thisfile in fn_tr.items():
-        trtups = []
-        traces_thisfile.sort(lambda a,b: cmp(a.full_id, b.full_id))
-        for tr in traces_thisfile:
-            trtups.append(as_tuple(tr))
-        
-        ensuredirs(fn)
-        try:
-            mseed_ext.store_traces(trtups, fn)
-        except MSeedError, e:
-            raise MSeedError( str(e) + ' (while storing traces to file \'%s\')' % fn)
+    
+    jobs = [ (fn, traces_thisfile, record_length, iencoding, append) 
+            for (fn, traces_thisfile) in fn_tr.items() ]
+
+    for x in _imap_threaded(_save_file, jobs, nworkers):
+        pass
             
     return fn_tr.keys()
 
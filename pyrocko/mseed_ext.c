@@ -17,20 +17,386 @@ static PyObject *MSeedError;
 #define BUFSIZE 1024
 
 
+static void
+free_capsule_data(PyObject *capsule)
+{
+    free(PyCapsule_GetPointer(capsule, NULL));
+}
+
+static PyObject*
+mst_to_tuple(MSTrace *mst, int unpackdata, int steal)
+{
+    npy_intp      array_dims[1] = {0};
+    PyObject      *array = NULL;
+    PyObject      *capsule = NULL;
+    int           numpytype;
+    char          strbuf[BUFSIZE];
+
+    /* convert data to python tuple, if steal is true, the sample buffer is
+       handed over to the numpy array instead of being copied */
+
+    if (unpackdata) {
+        array_dims[0] = mst->numsamples;
+        switch (mst->sampletype) {
+            case 'i':
+                assert( ms_samplesize('i') == 4 );
+                numpytype = NPY_INT32;
+                break;
+            case 'a':
+                assert( ms_samplesize('a') == 1 );
+                numpytype = NPY_INT8;
+                break;
+            case 'f':
+                assert( ms_samplesize('f') == 4 );
+                numpytype = NPY_FLOAT32;
+                break;
+            case 'd':
+                assert( ms_samplesize('d') == 8 );
+                numpytype = NPY_FLOAT64;
+                break;
+            default:
+                snprintf (strbuf, BUFSIZE, "Unknown sampletype %c\n", mst->sampletype);
+                PyErr_SetString(MSeedError, strbuf);
+                return NULL;
+        }
+        if (steal && mst->datasamples != NULL && mst->numsamples > 0) {
+            array = PyArray_SimpleNewFromData(1, array_dims, numpytype, mst->datasamples);
+            if (array == NULL) return NULL;
+            capsule = PyCapsule_New(mst->datasamples, NULL, free_capsule_data);
+            if (capsule == NULL) {
+                Py_DECREF(array);
+                return NULL;
+            }
+            mst->datasamples = NULL;
+            PyArray_SetBaseObject((PyArrayObject*)array, capsule);
+        } else {
+            array = PyArray_SimpleNew(1, array_dims, numpytype);
+            if (array == NULL) return NULL;
+            if (mst->numsamples > 0) {
+                memcpy( PyArray_DATA(array), mst->datasamples, mst->numsamples*ms_samplesize(mst->sampletype) );
+            }
+        }
+    } else {
+        Py_INCREF(Py_None);
+        array = Py_None;
+    }
+
+    return Py_BuildValue( "(c,s,s,s,s,L,L,d,N)",
+                                mst->dataquality,
+                                mst->network,
+                                mst->station,
+                                mst->location,
+                                mst->channel,
+                                mst->starttime,
+                                mst->endtime,
+                                mst->samprate,
+                                array );
+}
+
+static int
+append_trace(PyObject *out_traces, MSTrace *mst, int unpackdata, int steal)
+{
+    PyObject      *out_trace = NULL;
+
+    out_trace = mst_to_tuple(mst, unpackdata, steal);
+    if (out_trace == NULL) return -1;
+
+    PyList_Append(out_traces, out_trace);
+    Py_DECREF(out_trace);
+    return 0;
+}
+
+static PyObject*
+mstg_to_list(MSTraceGroup *mstg, int unpackdata)
+{
+    MSTrace       *mst = NULL;
+    PyObject      *out_traces = NULL;
+    char          strbuf[BUFSIZE];
+
+    /* check that there is data in the traces */
+    if (unpackdata) {
+        mst = mstg->traces;
+        while (mst) {
+            if (mst->datasamples == NULL) {
+                snprintf (strbuf, BUFSIZE, "Error reading file - datasamples is NULL");
+                PyErr_SetString(MSeedError, strbuf);
+                return NULL;
+            }
+            mst = mst->next;
+        }
+    }
+
+    out_traces = Py_BuildValue("[]");
+
+    mst = mstg->traces;
+    while (mst) {
+        if (append_trace(out_traces, mst, unpackdata, 0) != 0) {
+            Py_DECREF(out_traces);
+            return NULL;
+        }
+        mst = mst->next;
+    }
+
+    return out_traces;
+}
+
+/* Segmentation used when streaming through a file: open segments are kept in
+   `mstg`, at most one per channel (and quality code). A segment is complete
+   when a record of its channel follows which does not continue it, or when it
+   has not been continued for a number of records (to allow for multiplexed
+   files, this grows with the number of open segments). Completed segments are
+   moved to the end of `done`. Records merge like in ms_readtraces, but records
+   which would join an already completed segment start a new one. */
+
+#define STREAM_MAXIDLE 256
+
+static void
+stream_append(MSTraceGroup *done, MSTrace *mst)
+{
+    MSTrace       *last = NULL;
+
+    mst->next = NULL;
+    if (done->traces) {
+        for (last = done->traces; last->next; last = last->next);
+        last->next = mst;
+    } else {
+        done->traces = mst;
+    }
+    done->numtraces++;
+}
+
+static void
+stream_unlink(MSTraceGroup *mstg, MSTrace *prev, MSTrace *mst, MSTraceGroup *done)
+{
+    if (prev) {
+        prev->next = mst->next;
+    } else {
+        mstg->traces = mst->next;
+    }
+    mstg->numtraces--;
+
+    stream_append(done, mst);
+}
+
+static void
+stream_add_record(MSTraceGroup *mstg, MSRecord *msr, int64_t irecord, MSTraceGroup *done)
+{
+    MSTrace       *mst = NULL;
+    MSTrace       *prev = NULL;
+    MSTrace       *next = NULL;
+    hptime_t      endtime;
+    flag          whence;
+    int64_t       maxidle;
+
+    endtime = msr_endtime (msr);
+    if ( endtime != HPTERROR ) {
+        mst = mst_findadjacent (mstg, &whence, msr->dataquality,
+                                msr->network, msr->station, msr->location, msr->channel,
+                                msr->samprate, -1.0, msr->starttime, endtime, -1.0);
+    }
+
+    if ( ! mst ) {
+        for (mst = mstg->traces; mst; prev = mst, mst = mst->next) {
+            if (mst->dataquality == msr->dataquality &&
+                    ! strcmp(mst->network, msr->network) &&
+                    ! strcmp(mst->station, msr->station) &&
+                    ! strcmp(mst->location, msr->location) &&
+                    ! strcmp(mst->channel, msr->channel)) {
+
+                stream_unlink(mstg, prev, mst, done);
+                break;
+            }
+        }
+    }
+
+    mst = mst_addmsrtogroup (mstg, msr, 1, -1.0, -1.0);
+    if (mst) {
+        if (mst->prvtptr == NULL) mst->prvtptr = malloc(sizeof(int64_t));
+        if (mst->prvtptr) *(int64_t*)mst->prvtptr = irecord;
+    }
+
+    maxidle = STREAM_MAXIDLE + 2*mstg->numtraces;
+    prev = NULL;
+    for (mst = mstg->traces; mst; mst = next) {
+        next = mst->next;
+        if (mst->prvtptr && irecord - *(int64_t*)mst->prvtptr > maxidle) {
+            stream_unlink(mstg, prev, mst, done);
+        } else {
+            prev = mst;
+        }
+    }
+}
+
+static MSTrace*
+stream_pop_trace(MSTraceGroup *mstg)
+{
+    MSTrace       *mst = mstg->traces;
+
+    if (mst) {
+        mstg->traces = mst->next;
+        mst->next = NULL;
+        mstg->numtraces--;
+    }
+
+    return mst;
+}
+
+typedef struct {
+    PyObject_HEAD
+    char          *filename;
+    int           unpackdata;
+    int           eof;
+    int           busy;
+    int64_t       irecord;
+    MSFileParam   *msfp;
+    MSRecord      *msr;
+    MSTraceGroup  *mstg;
+    MSTraceGroup  *done;
+} TraceIterator;
+
+static void
+trace_iterator_close(TraceIterator *self)
+{
+    /* cleanup memory and close file */
+    if (self->msfp) {
+        ms_readmsr_r (&self->msfp, &self->msr, NULL, 0, NULL, NULL, 0, 0, 0);
+    }
+    self->eof = 1;
+}
+
+static void
+trace_iterator_dealloc(TraceIterator *self)
+{
+    trace_iterator_close(self);
+    mst_freegroup (&self->mstg);
+    mst_freegroup (&self->done);
+    free(self->filename);
+    PyObject_Del(self);
+}
+
+static PyObject*
+trace_iterator_next(TraceIterator *self)
+{
+    MSTrace       *done = NULL;
+    PyObject      *out_trace = NULL;
+    int           retcode = MS_NOERROR;
+    char          strbuf[BUFSIZE];
+
+    if (self->busy) {
+        PyErr_SetString(PyExc_ValueError, "TraceIterator already executing");
+        return NULL;
+    }
+
+    /* decode without holding the GIL, the iterator is not touched by other
+       threads meanwhile because of the busy flag */
+    self->busy = 1;
+    Py_BEGIN_ALLOW_THREADS
+    while (!self->eof && !self->done->traces) {
+        retcode = ms_readmsr_r (&self->msfp, &self->msr, self->filename, 0, NULL, NULL,
+                                1, self->unpackdata, 0);
+
+        if ( retcode == MS_NOERROR ) {
+            stream_add_record(self->mstg, self->msr, self->irecord++, self->done);
+        } else {
+            trace_iterator_close(self);
+        }
+    }
+    Py_END_ALLOW_THREADS
+    self->busy = 0;
+
+    if ( retcode != MS_NOERROR && retcode != MS_ENDOFFILE ) {
+        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", self->filename, ms_errorstr(retcode));
+        PyErr_SetString(MSeedError, strbuf);
+        return NULL;
+    }
+
+    done = stream_pop_trace(self->done);
+    if (!done) done = stream_pop_trace(self->mstg);
+    if (!done) return NULL;  /* no exception set: StopIteration */
+
+    out_trace = mst_to_tuple(done, self->unpackdata, 1);
+    mst_free (&done);
+    return out_trace;
+}
+
+static PyTypeObject TraceIteratorType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "mseed_ext.TraceIterator",            /* tp_name */
+    sizeof(TraceIterator),                /* tp_basicsize */
+    0,                                    /* tp_itemsize */
+    (destructor)trace_iterator_dealloc,   /* tp_dealloc */
+    0,                                    /* tp_print */
+    0,                                    /* tp_getattr */
+    0,                                    /* tp_setattr */
+    0,                                    /* tp_compare */
+    0,                                    /* tp_repr */
+    0,                                    /* tp_as_number */
+    0,                                    /* tp_as_sequence */
+    0,                                    /* tp_as_mapping */
+    0,                                    /* tp_hash */
+    0,                                    /* tp_call */
+    0,                                    /* tp_str */
+    0,                                    /* tp_getattro */
+    0,                                    /* tp_setattro */
+    0,                                    /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,                   /* tp_flags */
+    "Iterator over the traces of an mseed file, see iter_traces().", /* tp_doc */
+    0,                                    /* tp_traverse */
+    0,                                    /* tp_clear */
+    0,                                    /* tp_richcompare */
+    0,                                    /* tp_weaklistoffset */
+    PyObject_SelfIter,                    /* tp_iter */
+    (iternextfunc)trace_iterator_next,    /* tp_iternext */
+};
+
+static PyObject*
+mseed_iter_traces (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    PyObject      *unpackdata = NULL;
+    TraceIterator *it = NULL;
+
+    if (!PyArg_ParseTuple(args, "sO", &filename, &unpackdata)) {
+        PyErr_SetString(MSeedError, "usage iter_traces(filename, dataflag)" );
+        return NULL;
+    }
+
+    if (!PyBool_Check(unpackdata)) {
+        PyErr_SetString(MSeedError, "Second argument must be a boolean" );
+        return NULL;
+    }
+
+    it = PyObject_New(TraceIterator, &TraceIteratorType);
+    if (it == NULL) return NULL;
+
+    it->filename = strdup(filename);
+    it->unpackdata = (unpackdata == Py_True);
+    it->eof = 0;
+    it->busy = 0;
+    it->irecord = 0;
+    it->msfp = NULL;
+    it->msr = NULL;
+    it->mstg = mst_initgroup (NULL);
+    it->done = mst_initgroup (NULL);
+
+    if (it->filename == NULL || it->mstg == NULL || it->done == NULL) {
+        Py_DECREF(it);
+        return PyErr_NoMemory();
+    }
+
+    return (PyObject*)it;
+}
+
 static PyObject*
 mseed_get_traces (PyObject *dummy, PyObject *args)
 {
     char          *filename;
     MSTraceGroup  *mstg = NULL;
-    MSTrace       *mst = NULL;
     int           retcode;
-    npy_intp      array_dims[1] = {0};
-    PyObject      *array = NULL;
     PyObject      *out_traces = NULL;
-    PyObject      *out_trace = NULL;
-    int           numpytype;
     char          strbuf[BUFSIZE];
     PyObject      *unpackdata = NULL;
+    flag          dataflag;
 
     if (!PyArg_ParseTuple(args, "sO", &filename, &unpackdata)) {
         PyErr_SetString(MSeedError, "usage get_traces(filename, dataflag)" );
@@ -43,7 +409,11 @@ mseed_get_traces (PyObject *dummy, PyObject *args)
     }
   
     /* get data from mseed file */
-    retcode = ms_readtraces (&mstg, filename, 0, -1.0, -1.0, 0, 1, (unpackdata == Py_True), 0);
+    dataflag = (unpackdata == Py_True);
+    Py_BEGIN_ALLOW_THREADS
+    retcode = ms_readtraces (&mstg, filename, 0, -1.0, -1.0, 0, 1, dataflag, 0);
+    Py_END_ALLOW_THREADS
+
     if ( retcode < 0 ) {
         snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
         PyErr_SetString(MSeedError, strbuf);
@@ -56,84 +426,256 @@ mseed_get_traces (PyObject *dummy, PyObject *args)
         return NULL;
     }
 
-    /* check that there is data in the traces */
-    if (unpackdata == Py_True) {
-        mst = mstg->traces;
-        while (mst) {
-            if (mst->datasamples == NULL) {
-                snprintf (strbuf, BUFSIZE, "Error reading file - datasamples is NULL");
-                PyErr_SetString(MSeedError, strbuf);
-                return NULL;
+    out_traces = mstg_to_list(mstg, dataflag);
+
+    mst_freegroup (&mstg);
+
+    return out_traces;
+}
+
+typedef struct {
+    off_t         offset;
+    int           reclen;
+    char          network[11];
+    char          station[11];
+    char          location[11];
+    char          channel[11];
+    hptime_t      starttime;
+    hptime_t      endtime;
+} RecordInfo;
+
+static PyObject*
+mseed_get_record_index (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    MSTraceGroup  *mstg = NULL;
+    MSTraceGroup  *done = NULL;
+    MSTrace       *mst = NULL;
+    MSRecord      *msr = NULL;
+    MSFileParam   *msfp = NULL;
+    off_t         fpos = 0;
+    RecordInfo    *recs = NULL;
+    RecordInfo    *newrecs = NULL;
+    RecordInfo    *rec = NULL;
+    int64_t       nrecs = 0;
+    int64_t       nrecs_alloc = 0;
+    int64_t       i;
+    int           retcode;
+    int           nomem = 0;
+    int           failed = 0;
+    PyObject      *out_traces = NULL;
+    PyObject      *out_records = NULL;
+    PyObject      *out_record = NULL;
+    char          strbuf[BUFSIZE];
+
+    if (!PyArg_ParseTuple(args, "s", &filename)) {
+        PyErr_SetString(MSeedError, "usage get_record_index(filename)" );
+        return NULL;
+    }
+
+    mstg = mst_initgroup (NULL);
+    done = mst_initgroup (NULL);
+
+    /* segments as iter_traces gives them, but keep track of the record
+       positions, collected without holding the GIL */
+    Py_BEGIN_ALLOW_THREADS
+    while ( (retcode = ms_readmsr_r (&msfp, &msr, filename, 0, &fpos, NULL,
+                                     1, 0, 0)) == MS_NOERROR ) {
+
+        stream_add_record(mstg, msr, nrecs, done);
+
+        if (nrecs == nrecs_alloc) {
+            nrecs_alloc = nrecs_alloc ? nrecs_alloc*2 : 1024;
+            newrecs = realloc(recs, nrecs_alloc*sizeof(RecordInfo));
+            if (newrecs == NULL) {
+                nomem = 1;
+                break;
             }
-            mst = mst->next;
+            recs = newrecs;
         }
+
+        rec = &recs[nrecs++];
+        rec->offset = fpos;
+        rec->reclen = msr->reclen;
+        strcpy(rec->network, msr->network);
+        strcpy(rec->station, msr->station);
+        strcpy(rec->location, msr->location);
+        strcpy(rec->channel, msr->channel);
+        rec->starttime = msr->starttime;
+        rec->endtime = msr_endtime(msr);
     }
 
-    out_traces = Py_BuildValue("[]");
+    /* cleanup memory and close file */
+    ms_readmsr_r (&msfp, &msr, NULL, 0, NULL, NULL, 0, 0, 0);
 
-    mst = mstg->traces;
+    /* remaining open segments are complete at the end of the file */
+    while ( (mst = stream_pop_trace(mstg)) ) {
+        stream_append(done, mst);
+    }
+    Py_END_ALLOW_THREADS
 
-    /* convert data to python tuple */
+    if (nomem) {
+        PyErr_NoMemory();
+        failed = 1;
 
-    while (mst) {
-        
-        if (unpackdata == Py_True) {
-            array_dims[0] = mst->numsamples;
-            switch (mst->sampletype) {
-                case 'i':
-                    assert( ms_samplesize('i') == 4 );
-                    numpytype = NPY_INT32;
-                    break;
-                case 'a':
-                    assert( ms_samplesize('a') == 1 );
-                    numpytype = NPY_INT8;
-                    break;
-                case 'f':
-                    assert( ms_samplesize('f') == 4 );
-                    numpytype = NPY_FLOAT32;
-                    break;
-                case 'd':
-                    assert( ms_samplesize('d') == 8 );
-                    numpytype = NPY_FLOAT64;
-                    break;
-                default:
-                    snprintf (strbuf, BUFSIZE, "Unknown sampletype %c\n", mst->sampletype);
-                    PyErr_SetString(MSeedError, strbuf);
-                    Py_XDECREF(out_traces);
-                    return NULL;
+    } else if ( retcode != MS_ENDOFFILE ) {
+        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+        PyErr_SetString(MSeedError, strbuf);
+        failed = 1;
+
+    } else {
+        out_traces = mstg_to_list(done, 0);
+        failed = (out_traces == NULL);
+    }
+
+    if (!failed) {
+        out_records = PyList_New(nrecs);
+        for (i=0; i<nrecs && out_records; i++) {
+            rec = &recs[i];
+            out_record = Py_BuildValue( "(L,i,s,s,s,s,L,L)",
+                                        (PY_LONG_LONG)rec->offset,
+                                        rec->reclen,
+                                        rec->network,
+                                        rec->station,
+                                        rec->location,
+                                        rec->channel,
+                                        rec->starttime,
+                                        rec->endtime );
+            if (out_record == NULL) {
+                Py_CLEAR(out_records);
+                break;
             }
-            array = PyArray_SimpleNew(1, array_dims, numpytype);
-            memcpy( PyArray_DATA(array), mst->datasamples, mst->numsamples*ms_samplesize(mst->sampletype) );
-        } else {
-            Py_INCREF(Py_None);
-            array = Py_None;
+            PyList_SET_ITEM(out_records, i, out_record);
         }
+        failed = (out_records == NULL);
+    }
 
-        out_trace = Py_BuildValue( "(c,s,s,s,s,L,L,d,N)",
-                                    mst->dataquality,
-                                    mst->network,
-                                    mst->station,
-                                    mst->location,
-                                    mst->channel,
-                                    mst->starttime,
-                                    mst->endtime,
-                                    mst->samprate,
-                                    array );
+    free(recs);
+    mst_freegroup (&mstg);
+    mst_freegroup (&done);
 
-        
-        PyList_Append(out_traces, out_trace);
-        Py_DECREF(out_trace);
-        mst = mst->next;
+    if (failed) {
+        Py_XDECREF(out_traces);
+        return NULL;
     }
 
-    mst_freegroup (&mstg);
+    return Py_BuildValue("(N,N)", out_traces, out_records);
+}
+
+static PyObject*
+mseed_get_traces_from_records (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    PyObject      *in_records = NULL;
+    PyObject      *in_record = NULL;
+    MSTraceGroup  *mstg = NULL;
+    MSRecord      *msr = NULL;
+    PY_LONG_LONG  *offsets = NULL;
+    int           *reclens = NULL;
+    int           i, n;
+    int           retcode = MS_NOERROR;
+    int           failed = 0;
+    char          *buffer = NULL;
+    int           bufsize = 0;
+    FILE          *infile;
+    PyObject      *out_traces = NULL;
+    char          strbuf[BUFSIZE];
+
+    if (!PyArg_ParseTuple(args, "sO", &filename, &in_records)) {
+        PyErr_SetString(MSeedError, "usage get_traces_from_records(filename, records)" );
+        return NULL;
+    }
+
+    if (!PySequence_Check( in_records )) {
+        PyErr_SetString(MSeedError, "Records is not of sequence type." );
+        return NULL;
+    }
+
+    n = PySequence_Length(in_records);
+    offsets = malloc(sizeof(PY_LONG_LONG)*(n+1));
+    reclens = malloc(sizeof(int)*(n+1));
+    if (offsets == NULL || reclens == NULL) {
+        free(offsets);
+        free(reclens);
+        return PyErr_NoMemory();
+    }
+
+    for (i=0; i<n; i++) {
+        in_record = PySequence_GetItem(in_records, i);
+        if (in_record == NULL || !PyArg_ParseTuple(in_record, "Li", &offsets[i], &reclens[i])) {
+            PyErr_SetString(MSeedError, "Record must be given as a tuple (offset, reclen)." );
+            Py_XDECREF(in_record);
+            free(offsets);
+            free(reclens);
+            return NULL;
+        }
+        Py_DECREF(in_record);
+    }
+
+    mstg = mst_initgroup (NULL);
+    strbuf[0] = '\0';
+
+    /* read and decode without holding the GIL */
+    Py_BEGIN_ALLOW_THREADS
+    infile = fopen(filename, "rb");
+    if (infile == NULL) {
+        snprintf (strbuf, BUFSIZE, "Cannot open file '%s'", filename);
+        failed = 1;
+    }
+
+    for (i=0; i<n && !failed; i++) {
+        if (reclens[i] > bufsize) {
+            free(buffer);
+            buffer = malloc(reclens[i]);
+            bufsize = reclens[i];
+        }
+
+        if ( buffer == NULL ||
+             lmp_fseeko(infile, (off_t)offsets[i], SEEK_SET) != 0 || 
+             fread(buffer, reclens[i], 1, infile) != 1 ) {
+            snprintf (strbuf, BUFSIZE, "Cannot read record at offset %lld from file '%s'", offsets[i], filename);
+            failed = 1;
+            break;
+        }
+
+        retcode = msr_unpack(buffer, reclens[i], &msr, 1, 0);
+        if ( retcode != MS_NOERROR ) {
+            snprintf (strbuf, BUFSIZE, "Cannot unpack record at offset %lld from file '%s': %s", offsets[i], filename, ms_errorstr(retcode));
+            failed = 1;
+            break;
+        }
+
+        mst_addmsrtogroup (mstg, msr, 0, -1.0, -1.0);
+    }
+
+    if (infile != NULL) fclose(infile);
+    Py_END_ALLOW_THREADS
+
+    if (failed) {
+        PyErr_SetString(MSeedError, strbuf);
+    } else {
+        out_traces = mstg_to_list(mstg, 1);
+    }
+
+    free(offsets);
+    free(reclens);
+    free(buffer);
+    msr_free(&msr);
+    mst_freegroup(&mstg);
 
     return out_traces;
 }
 
-static void record_handler (char *record, int reclen, void *outfile) {    
-    if ( fwrite(record, reclen, 1, outfile) != 1 ) {
-      fprintf(stderr, "Error writing mseed record to output file\n");
+typedef struct {
+    FILE          *outfile;
+    int           failed;
+} RecordHandlerState;
+
+static void record_handler (char *record, int reclen, void *state) {
+    RecordHandlerState *hs = (RecordHandlerState*)state;
+
+    if ( fwrite(record, reclen, 1, hs->outfile) != 1 ) {
+        hs->failed = 1;
     }
 }
 
@@ -150,13 +692,17 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
     char          *network, *station, *location, *channel;
     char          mstype;
     int           msdetype;
-    int           psamples, precords;
+    int64_t       psamples;
+    int           precords;
     int           numpytype;
     int           length;
-    FILE          *outfile;
+    int           reclen = 4096;
+    int           encoding = -1;
+    PyObject      *append = NULL;
+    RecordHandlerState hs;
 
-    if (!PyArg_ParseTuple(args, "Os", &in_traces, &filename)) {
-        PyErr_SetString(MSeedError, "usage store_traces(traces, filename)" );
+    if (!PyArg_ParseTuple(args, "Os|iiO", &in_traces, &filename, &reclen, &encoding, &append)) {
+        PyErr_SetString(MSeedError, "usage store_traces(traces, filename, reclen=4096, encoding=-1, append=False)" );
         return NULL;
     }
     if (!PySequence_Check( in_traces )) {
@@ -164,8 +710,9 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
         return NULL;
     }
 
-    outfile = fopen(filename, "w" );
-    if (outfile == NULL) {
+    hs.failed = 0;
+    hs.outfile = fopen(filename, (append != NULL && PyObject_IsTrue(append)) ? "a" : "w" );
+    if (hs.outfile == NULL) {
         PyErr_SetString(MSeedError, "Error opening file.");
         return NULL;
     }
@@ -176,7 +723,7 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
         if (!PyTuple_Check(in_trace)) {
             PyErr_SetString(MSeedError, "Trace record must be a tuple of (network, station, location, channel, starttime, endtime, samprate, data)." );
             Py_DECREF(in_trace);
-            return NULL;
+            goto fail;
         }
         mst = mst_init (NULL);
         
@@ -192,7 +739,7 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
             PyErr_SetString(MSeedError, "Trace record must be a tuple of (network, station, location, channel, starttime, endtime, samprate, data)." );
             mst_free( &mst );  
             Py_DECREF(in_trace);
-            return NULL;
+            goto fail;
         }
 
         strncpy( mst->network, network, 10);
@@ -208,7 +755,13 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
             PyErr_SetString(MSeedError, "Data must be given as NumPy array." );
             mst_free( &mst );  
             Py_DECREF(in_trace);
-            return NULL;
+            goto fail;
+        }
+        if (!PyArray_ISNOTSWAPPED((PyArrayObject*)array)) {
+            PyErr_SetString(MSeedError, "Data must be in native byte order." );
+            mst_free( &mst );  
+            Py_DECREF(in_trace);
+            goto fail;
         }
         numpytype = PyArray_TYPE(array);
         switch (numpytype) {
@@ -236,8 +789,21 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
                     PyErr_SetString(MSeedError, "Data must be of type float64, float32, int32 or int8.");
                     mst_free( &mst );  
                     Py_DECREF(in_trace);
-                    return NULL;
+                    goto fail;
             }
+
+        if (encoding != -1) {
+            if (!((mstype == 'i' && (encoding == DE_INT32 || encoding == DE_STEIM1 || encoding == DE_STEIM2)) ||
+                  (mstype == 'a' && encoding == DE_ASCII) ||
+                  (mstype == 'f' && encoding == DE_FLOAT32) ||
+                  (mstype == 'd' && encoding == DE_FLOAT64))) {
+                PyErr_SetString(MSeedError, "Encoding is not available for the sample type of the data (Steim compression and INT32 need int32 data).");
+                mst_free( &mst );  
+                Py_DECREF(in_trace);
+                goto fail;
+            }
+            msdetype = encoding;
+        }
         mst->sampletype = mstype;
 
         contiguous_array = PyArray_GETCONTIGUOUS((PyArrayObject*)array);
@@ -249,16 +815,32 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
         mst->datasamples = calloc(length,ms_samplesize(mstype));
         memcpy(mst->datasamples, PyArray_DATA(contiguous_array), length*ms_samplesize(mstype));
         Py_DECREF(contiguous_array);
+        Py_DECREF(in_trace);
 
-        precords = mst_pack (mst, &record_handler, outfile, 4096, msdetype,
+        /* encode and write without holding the GIL */
+        Py_BEGIN_ALLOW_THREADS
+        precords = mst_pack (mst, &record_handler, &hs, reclen, msdetype,
                                      1, &psamples, 1, 0, NULL);
         mst_free( &mst );
-        Py_DECREF(in_trace);
+        Py_END_ALLOW_THREADS
+
+        if (precords < 0) {
+            PyErr_SetString(MSeedError, "Error packing mseed records.");
+            goto fail;
+        }
+        if (hs.failed) {
+            PyErr_SetString(MSeedError, "Error writing mseed record to output file.");
+            goto fail;
+        }
     }
-    fclose( outfile );
+    fclose( hs.outfile );
 
     Py_INCREF(Py_None);
     return Py_None;
+
+  fail:
+    fclose( hs.outfile );
+    return NULL;
 }
 
 
@@ -274,8 +856,39 @@ static PyMethodDef MSEEDMethods[] = {
     "in libmseed. If dataflag is True, `data` is a numpy array containing the\n"
     "data. If dataflag is False, the data is not unpacked and `data` is None.\n" },
 
+    {"iter_traces",  mseed_iter_traces, METH_VARARGS, 
+    "iter_traces(filename, dataflag)\n"
+    "Iterate over the traces stored in an mseed file while decoding it.\n\n"
+    "Yields tuples like get_traces returns them, one for each contiguous\n"
+    "segment, as soon as the segment is complete. A segment is complete when\n"
+    "a record of the same channel follows which does not continue it, when it\n"
+    "has not been continued by the last few hundred records, or at the end of\n"
+    "the file. Records are not merged into already completed segments, so\n"
+    "that memory use is bounded by the open segments, not by the size of the\n"
+    "file.\n" },
+
+    {"get_record_index",  mseed_get_record_index, METH_VARARGS, 
+    "get_record_index(filename)\n"
+    "Get trace metainformation and the position of each record in an mseed file.\n\n"
+    "Returns a tuple (traces, records). `traces` is what iter_traces gives with\n"
+    "dataflag=False. `records` is a list with a tuple for each record:\n\n"
+    "  (offset, reclen, network, station, location, channel,\n"
+    "    starttime, endtime)\n" },
+
+    {"get_traces_from_records",  mseed_get_traces_from_records, METH_VARARGS, 
+    "get_traces_from_records(filename, records)\n"
+    "Decode selected records of an mseed file.\n\n"
+    "`records` is a sequence of (offset, reclen) tuples. The decoded records are\n"
+    "merged into traces, which are returned like get_traces does with\n"
+    "dataflag=True.\n" },
+
     {"store_traces",  mseed_store_traces, METH_VARARGS, 
-    "store_traces(traces, filename)\n" },
+    "store_traces(traces, filename, reclen=4096, encoding=-1, append=False)\n"
+    "Store traces, given as tuples like get_traces returns them, but without\n"
+    "the dataquality element, in an mseed file.\n\n"
+    "`encoding` is one of the DE_* constants, -1 selects the encoding from the\n"
+    "sample type of the data. If `append` is True, the records are appended to\n"
+    "an existing file.\n" },
 
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
@@ -291,6 +904,8 @@ initmseed_ext(void)
     if (m == NULL) return;
     import_array();
 
+    if (PyType_Ready(&TraceIteratorType) < 0) return;
+
     MSeedError = PyErr_NewException("mseed_ext.error", NULL, NULL);
     Py_INCREF(MSeedError);  /* required, because other code could remove `error` 
                                from the module, what would create a dangling
@@ -302,4 +917,11 @@ initmseed_ext(void)
                                in the c code and it could be safely removed from
                                the  module. */
     PyModule_AddObject(m, "HPTMODULUS", hptmodulus);
+
+    PyModule_AddIntConstant(m, "DE_ASCII", DE_ASCII);
+    PyModule_AddIntConstant(m, "DE_INT32", DE_INT32);
+    PyModule_AddIntConstant(m, "DE_FLOAT32", DE_FLOAT32);
+    PyModule_AddIntConstant(m, "DE_FLOAT64", DE_FLOAT64);
+    PyModule_AddIntConstant(m, "DE_STEIM1", DE_STEIM1);
+    PyModule_AddIntConstant(m, "DE_STEIM2", DE_STEIM2);
 }
@@ -32,8 +32,8 @@ class States(object):
         if k in self._states:
             tmin, deltat, dtype, value = self._states[k]
             if (near(tmin, tr.tmin, deltat/100.) and
-                near(deltat, tr.deltat, deltat/10000. and
-                dtype == tr.ydata.dtype)):
+                near(deltat, tr.deltat, deltat/10000.) and
+                dtype == tr.ydata.dtype):
                 return value
         
         return None
@@ -137,6 +137,43 @@ def co_dropsamples(target, q, nfir):
     except GeneratorExit:
         target.close()
 
+@coroutine
+def co_decimate_fir(target, q, b, nfir):
+    '''Successively filter and decimate broken continuous trace data (coroutine).
+
+    Does the same as :py:func:`co_lfilter` followed by
+    :py:func:`co_dropsamples` for a FIR filter with coefficients *b*, but
+    only the output samples which are kept are computed (see
+    :py:func:`pyrocko.util.decimate_fir`).
+    '''
+
+    try:
+        states = States()
+        while True:
+            tr = (yield)
+            newdeltat = q * tr.deltat
+            state = states.get(tr)
+            if state is None:
+                zi = num.zeros(len(b)-1, dtype=num.float)
+                # see co_dropsamples
+                newtmin_want = math.ceil((tr.tmin+(nfir+1)*tr.deltat)/newdeltat) * newdeltat - (nfir/2*tr.deltat)
+                ioffset = int(round((newtmin_want - tr.tmin)/tr.deltat))
+                if ioffset < 0:
+                    ioffset = ioffset % q
+            else:
+                zi, ioffset = state
+
+            ydata, zf = util.decimate_fir(tr.get_ydata(), q, b, ioffset=ioffset, zi=zi)
+            newtr = tr.copy(data=False)
+            newtr.deltat = newdeltat
+            newtr.tmin = tr.tmin + ioffset*tr.deltat - (nfir/2*tr.deltat)
+            newtr.set_ydata(ydata)
+            states.set(tr, (zf, (ioffset % q - tr.data_len() % q ) % q))
+            target.send(newtr)
+
+    except GeneratorExit:
+        target.close()
+
 def co_downsample(target, q, n=None, ftype='fir'):
     '''Successively downsample broken continuous trace data (coroutine).
 
@@ -156,6 +193,9 @@ def co_downsample(target, q, n=None, ftype='fir'):
     so that they occur at (or as close as possible) to even multiples of the
     sampling interval of the downsampled trace (based on system time).'''
     b,a,n = util.decimate_coeffs(q,n,ftype)
+    if ftype == 'fir':
+        return co_decimate_fir(target, q, b, n)
+
     return co_antialias(co_dropsamples(target,q,n), q,n,ftype)
         
 @coroutine
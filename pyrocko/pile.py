@@ -1,10 +1,10 @@
 '''A pile contains subpiles which contain tracesfiles which contain traces.'''
 
-import trace, io, util, config
+import trace, io, util, config, mseed
 
 import numpy as num
-import os, logging, time, weakref, copy, re, sys, operator, math
-import cPickle as pickle
+import os, logging, time, weakref, re, sys, operator, math
+import sqlite3
 
         
 def sl(s):
@@ -30,101 +30,257 @@ class Counter(dict):
         if self[k] <= 0:
             del self[k]
 
-import avl
-
 pjoin = os.path.join
 logger = logging.getLogger('pyrocko.pile')
 
 from util import reuse
 from trace import degapper
 
-def avl_remove_exact(avltree, element):
-    ilo, ihi = avltree.span(element)
-    for i in xrange(ilo,ihi):
-        if avltree[i] is element:
-            avltree.remove_at(i)
+def remove_exact(l, element):
+    '''Remove element from list, using identity instead of equality.'''
+
+    for i, x in enumerate(l):
+        if x is element:
+            del l[i]
             return
 
-    raise ValueError('avl_remove_exact(avltree, element): element not in avltree')
+    raise ValueError('remove_exact(l, element): element not in list')
 
-def cmpfunc(key):
-    if isinstance(key, str):
-        # special cases; these run about 50% faster than the generic one on Python 2.5
-        if key == 'tmin':
-            return lambda a,b: cmp(a.tmin, b.tmin)
-        if key == 'tmax':
-            return lambda a,b: cmp(a.tmax, b.tmax)
+_nslc_ids = []
+_nslc_codes = {}
 
-        key = operator.attrgetter(key)
-    
-    return lambda a,b: cmp(key(a), key(b))
+def nslc_code(nslc_id):
+    '''Get integer code for a (network, station, location, channel) tuple.
 
-class Dummy:
-    pass
+    Codes are handed out on first use and are shared by all piles in the
+    process.
+    '''
 
-class Sorted(object):
-    def __init__(self, values=[], key=None):
-        self._set_key(key)
-        self._avl = avl.new(values, self._cmp)
-
-    def _set_key(self, key):
-        self._key = key
-        self._cmp = cmpfunc(key)
-        if isinstance(key, str):
-            class Dummy:
-                def __init__(self, k):
-                    setattr(self, key, k)
-            self._dummy = Dummy
-
-    def __getstate__(self):
-        state = list(self._avl.iter()), self._key
-        return state
-   
-    def __setstate__(self, state):
-        l, key = state
-        self._set_key(key)
-        self._avl = avl.from_iter(iter(l), len(l))
+    try:
+        return _nslc_codes[nslc_id]
+    except KeyError:
+        code = len(_nslc_ids)
+        _nslc_ids.append(nslc_id)
+        _nslc_codes[nslc_id] = code
+        return code
+
+def nslc_id_from_code(code):
+    '''Get (network, station, location, channel) tuple for an integer code.'''
 
-    def insert(self, value):
-        self._avl.insert(value)
+    return _nslc_ids[code]
 
-    def remove(self, value):
-        avl_remove_exact(self._avl, value)
+class IndexChannel(object):
+    '''Rows of a :py:class:`TimeIndex` belonging to a single channel.'''
 
-    def insert_many(self, values):
-        for value in values:
-            self._avl.insert(value)
+    def __init__(self):
+        self.tmins = num.zeros(0)
+        self.tmaxs = num.zeros(0)
+        self.tmaxcum = num.zeros(0)
+        self.ifiles = num.zeros(0, dtype=num.int32)
+        self.isegs = num.zeros(0, dtype=num.int32)
+        self.pending = []
+        self.removed = set()
+        self.n = 0
+
+    def append(self, ifile, tmins, tmaxs, isegs):
+        self.pending.append((ifile, tmins, tmaxs, isegs))
+        self.n += len(isegs)
+
+    def remove(self, ifile, n):
+        self.removed.add(ifile)
+        self.n -= n
+
+    def build(self):
+        if not self.pending and not self.removed:
+            return
+
+        ifiles = [ self.ifiles ]
+        tmins, tmaxs, isegs = [ self.tmins ], [ self.tmaxs ], [ self.isegs ]
+        for ifile, xtmins, xtmaxs, xisegs in self.pending:
+            ifiles.append(num.repeat(num.int32(ifile), len(xisegs)))
+            tmins.append(xtmins)
+            tmaxs.append(xtmaxs)
+            isegs.append(xisegs)
+
+        ifiles = num.concatenate(ifiles)
+        tmins = num.concatenate(tmins)
+        tmaxs = num.concatenate(tmaxs)
+        isegs = num.concatenate(isegs)
+
+        if self.removed:
+            keep = num.logical_not(num.in1d(ifiles, list(self.removed)))
+            ifiles, tmins, tmaxs, isegs = [ 
+                a[keep] for a in (ifiles, tmins, tmaxs, isegs) ]
+
+        order = num.argsort(tmins, kind='mergesort')
+        self.ifiles = ifiles[order]
+        self.tmins = tmins[order]
+        self.tmaxs = tmaxs[order]
+        self.isegs = isegs[order]
+        if order.size:
+            self.tmaxcum = num.maximum.accumulate(self.tmaxs)
+        else:
+            self.tmaxcum = num.zeros(0)
 
-    def remove_many(self, values):
-        for value in values:
-            avl_remove_exact(self._avl, value)
+        self.pending = []
+        self.removed = set()
 
-    def __iter__(self):
-        return iter(self._avl)
+    def query(self, tmin, tmax):
+        self.build()
 
-    def with_key_in(self, kmin, kmax):
-        omin, omax = self._dummy(kmin), self._dummy(kmax)
-        ilo, ihi = self._avl.span(omin,omax)
-        return self._avl[ilo:ihi]
+        # rows before ib end before tmin, rows from ie on start after tmax
+        ib = num.searchsorted(self.tmaxcum, tmin, 'left')
+        ie = num.searchsorted(self.tmins, tmax, 'left')
+        if ib >= ie:
+            return None
 
-    def min(self):
-        return self._avl.min()
+        return ib + num.nonzero(self.tmaxs[ib:ie] >= tmin)[0]
+
+class TimeIndex(object):
+    '''Columnar interval index of the trace segments of a set of files.
     
-    def max(self):
-        return self._avl.max()
+    The time spans of the segments are stored as rows of NumPy arrays, one
+    set of arrays for each (network, station, location, channel) combination.
+    Each row holds start and end time of a segment, the number of the file
+    it belongs to and its position within the file (see
+    :py:meth:`TracesFileBase.get_segments`), so that no trace objects have to
+    be kept. Within a channel, rows are sorted by start time and the running
+    maximum of the end times is kept alongside, so that the rows overlapping
+    with a time window are found with two binary searches and a vectorised
+    comparison. Sorting is deferred until a modified channel is queried.
+    '''
+
+    def __init__(self):
+        self._files = {}
+        self._file_ids = {}
+        self._next_file_id = 0
+        self._channels = {}
+        self._n = 0
+
+    def insert(self, file):
+        '''Add all segments of a file to the index.'''
+
+        codes, tmins, tmaxs = file.get_segments()
+        ifile = self._next_file_id
+        self._next_file_id += 1
+
+        counts = []
+        if codes.size:
+            ucodes, inverse = num.unique(codes, return_inverse=True)
+            for i, code in enumerate(ucodes.tolist()):
+                isegs = num.nonzero(inverse == i)[0].astype(num.int32)
+                if code not in self._channels:
+                    self._channels[code] = IndexChannel()
+
+                self._channels[code].append(
+                    ifile, tmins[isegs], tmaxs[isegs], isegs)
+
+                counts.append((code, isegs.size))
+
+        self._files[ifile] = (file, counts)
+        self._file_ids[id(file)] = ifile
+        self._n += codes.size
+
+    def remove(self, file):
+        '''Remove all segments of a file from the index.'''
+
+        if id(file) not in self._file_ids:
+            raise ValueError('TimeIndex.remove(file): file not in index')
+
+        ifile = self._file_ids.pop(id(file))
+        file, counts = self._files.pop(ifile)
+        for code, n in counts:
+            channel = self._channels[code]
+            channel.remove(ifile, n)
+            if channel.n == 0:
+                del self._channels[code]
+
+            self._n -= n
+
+    def query(self, tmin, tmax, nslc_ids=None):
+        '''Get segments overlapping with a given time span.
+
+        :param tmin,tmax: time span
+        :param nslc_ids: list of (network, station, location, channel) tuples 
+            to restrict the query to or ``None``
+
+        :returns: list of ``(file, isegment)`` tuples sorted by start time
+        '''
+
+        if nslc_ids is None:
+            channels = self._channels.itervalues()
+        else:
+            codes = [ _nslc_codes.get(k) for k in nslc_ids ]
+            channels = [ self._channels[code] for code in codes
+                         if code in self._channels ]
+
+        tmins, ifiles, isegs = [], [], []
+        for channel in channels:
+            rows = channel.query(tmin, tmax)
+            if rows is not None:
+                tmins.append(channel.tmins[rows])
+                ifiles.append(channel.ifiles[rows])
+                isegs.append(channel.isegs[rows])
+
+        if not tmins:
+            return []
+
+        order = num.argsort(num.concatenate(tmins), kind='mergesort')
+        ifiles = num.concatenate(ifiles)[order].tolist()
+        isegs = num.concatenate(isegs)[order].tolist()
+        files = self._files
+        return [ (files[ifile][0], iseg) 
+                 for (ifile, iseg) in zip(ifiles, isegs) ]
+
+    def files(self):
+        '''Get list of the files in the index.'''
+
+        return [ file for (file, counts) in self._files.itervalues() ]
 
     def __len__(self):
-        return len(self._avl)
+        return self._n
+
+    def tmin(self):
+        '''Get earliest start time of the segments in the index.'''
+
+        tmins = []
+        for channel in self._channels.itervalues():
+            channel.build()
+            tmins.append(channel.tmins[0])
+
+        if not tmins:
+            return None
+
+        return min(tmins).item()
+
+    def tmax(self):
+        '''Get latest end time of the segments in the index.'''
+
+        tmaxs = []
+        for channel in self._channels.itervalues():
+            channel.build()
+            tmaxs.append(channel.tmaxcum[-1])
+
+        if not tmaxs:
+            return None
+
+        return max(tmaxs).item()
 
 class TracesFileCache(object):
     '''Manages trace metainformation cache.
     
-    For each directory with files containing traces, one cache file is 
-    maintained to hold the trace metainformation of all files which are 
-    contained in the directory.
+    The trace metainformation of all files is kept in a single SQLite
+    database within the cache directory. For each file, its modification time
+    and size are stored along with the codes, time span and sampling interval
+    of the traces it contains. Entries are indexed by absolute path, by time
+    and by network, station, location and channel codes, so that single
+    entries can be retrieved and updated without having to load the complete
+    cache. For Mini-SEED files, the position and time span of every record is
+    stored additionally, so that parts of the files can be read selectively.
     '''
 
     caches = {}
+    db_filename = 'traces.sqlite'
 
     def __init__(self, cachedir):
         '''Create new cache.
@@ -134,10 +290,95 @@ class TracesFileCache(object):
         '''
         
         self.cachedir = cachedir
-        self.dircaches = {}
-        self.modified = set()
+        self.modified = False
         util.ensuredir(self.cachedir)
-        
+        self._connect()
+        self._create_tables()
+
+    def _connect(self):
+        # may be accessed from the prefetching thread of Pile.chopper
+        self._connection = sqlite3.connect(
+                pjoin(self.cachedir, self.db_filename), timeout=60., 
+                check_same_thread=False)
+
+        self._connection.text_factory = str
+        self._connection_pid = os.getpid()
+
+    def _get_conn(self):
+        # connections must not be shared with forked processes
+        # (Pile.map_windows), these get their own
+        if self._connection_pid != os.getpid():
+            self._connect()
+
+        return self._connection
+
+    _conn = property(_get_conn)
+
+    def _create_tables(self):
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                file_id INTEGER PRIMARY KEY,
+                abspath TEXT UNIQUE NOT NULL,
+                format TEXT,
+                mtime REAL,
+                size INTEGER,
+                nrecords INTEGER);
+
+            CREATE TABLE IF NOT EXISTS traces (
+                file_id INTEGER NOT NULL,
+                itrace INTEGER NOT NULL,
+                network TEXT,
+                station TEXT,
+                location TEXT,
+                channel TEXT,
+                tmin REAL,
+                tmin_offset REAL,
+                tmax REAL,
+                tmax_offset REAL,
+                deltat REAL,
+                mtime REAL);
+
+            CREATE INDEX IF NOT EXISTS traces_file 
+                ON traces (file_id, itrace);
+
+            CREATE INDEX IF NOT EXISTS traces_tmin
+                ON traces (tmin);
+
+            CREATE INDEX IF NOT EXISTS traces_nslc 
+                ON traces (network, station, location, channel);
+
+            CREATE TABLE IF NOT EXISTS records (
+                file_id INTEGER NOT NULL,
+                offset INTEGER,
+                reclen INTEGER,
+                network TEXT,
+                station TEXT,
+                location TEXT,
+                channel TEXT,
+                tmin REAL,
+                tmax REAL);
+
+            CREATE INDEX IF NOT EXISTS records_file_tmin
+                ON records (file_id, tmin);
+
+            CREATE TABLE IF NOT EXISTS dirs (
+                dirpath TEXT PRIMARY KEY,
+                mtime REAL);
+
+            CREATE TABLE IF NOT EXISTS listings (
+                dirpath TEXT PRIMARY KEY,
+                mtime REAL);
+
+            CREATE TABLE IF NOT EXISTS listing_entries (
+                dirpath TEXT NOT NULL,
+                name TEXT NOT NULL,
+                kind INTEGER);
+
+            CREATE INDEX IF NOT EXISTS listing_entries_dirpath
+                ON listing_entries (dirpath);
+            ''')
+        self._conn.commit()
+
     def get(self, abspath):
         '''Try to get an item from the cache.
         
@@ -147,10 +388,34 @@ class TracesFileCache(object):
           
         '''
         
-        dircache = self._get_dircache_for(abspath)
-        if abspath in dircache:
-            return dircache[abspath]
-        return None
+        row = self._conn.execute(
+            '''SELECT file_id, format, mtime, size, nrecords FROM files 
+               WHERE abspath = ?''', (abspath,)).fetchone()
+
+        if row is None:
+            return None
+
+        file_id, format, mtime, size, nrecords = row
+        traces = []
+        for (network, station, location, channel, tmin, tmin_offset, tmax, 
+                tmax_offset, deltat, tr_mtime) in self._conn.execute(
+                '''SELECT network, station, location, channel, 
+                          tmin, tmin_offset, tmax, tmax_offset, deltat, mtime
+                   FROM traces WHERE file_id = ? ORDER BY itrace''',
+                (file_id,)):
+
+            tmin = _from_offset_pair(tmin, tmin_offset)
+            tmax = _from_offset_pair(tmax, tmax_offset)
+            traces.append(trace.Trace(network, station, location, channel, 
+                tmin, tmax, deltat, mtime=tr_mtime))
+
+        tfile = TracesFile(None, abspath, format, mtime=mtime, size=size, 
+                           traces=traces)
+
+        if nrecords is not None:
+            tfile.records_cache = self
+
+        return tfile
 
     def put(self, abspath, tfile):
         '''Put an item into the cache.
@@ -158,102 +423,235 @@ class TracesFileCache(object):
         :param abspath: absolute path of the object to be stored
         :param tfile: object to be stored
         '''
-        
-        cachepath = self._dircachepath(abspath)
-        # get lock on cachepath here
-        dircache = self._get_dircache(cachepath)
-        dircache[abspath] = tfile
-        self.modified.add(cachepath)
+
+        self._delete(abspath)
+        nrecords = None
+        if tfile.records is not None:
+            nrecords = len(tfile.records)
+
+        cursor = self._conn.execute(
+            '''INSERT INTO files (abspath, format, mtime, size, nrecords) 
+               VALUES (?,?,?,?,?)''',
+            (abspath, tfile.format, tfile.mtime, tfile.size, nrecords))
+
+        file_id = cursor.lastrowid
+        rows = []
+        for itrace, tr in enumerate(tfile.traces):
+            rows.append((file_id, itrace) + tr.nslc_id + 
+                    _to_offset_pair(tr.tmin) + _to_offset_pair(tr.tmax) + 
+                    (tr.deltat, tr.mtime))
+
+        self._conn.executemany(
+            'INSERT INTO traces VALUES (?,?,?,?,?,?,?,?,?,?,?,?)', rows)
+
+        if tfile.records is not None:
+            self._conn.executemany(
+                'INSERT INTO records VALUES (?,?,?,?,?,?,?,?,?)', 
+                [ (file_id,) + tuple(rec) for rec in tfile.records ])
+
+        self.modified = True
+
+    def get_records(self, abspath, tmin, tmax, nslc_ids=None):
+        '''Get positions of Mini-SEED records overlapping a given time span.
+
+        :param abspath: absolute path of the file
+        :param tmin,tmax: time span
+        :param nslc_ids: list of (network, station, location, channel) tuples
+            to restrict the query to or ``None``
+
+        :returns: list of ``(offset, reclen)`` tuples in file order
+        '''
+
+        records = []
+        for (offset, reclen, network, station, location, 
+                channel) in self._conn.execute(
+                '''SELECT offset, reclen, network, station, location, channel
+                   FROM records WHERE file_id = (
+                        SELECT file_id FROM files WHERE abspath = ?)
+                   AND tmin <= ? AND tmax >= ? ORDER BY offset''', 
+                (abspath, float(tmax), float(tmin))):
+
+            if nslc_ids is None or \
+                    (network, station, location, channel) in nslc_ids:
+
+                records.append((offset, reclen))
+
+        return records
+
+    def get_dir_mtime(self, dirpath):
+        '''Get modification time of a directory as recorded at last scan.
+
+        :returns: modification time or ``None`` if the directory is unknown
+        '''
+
+        row = self._conn.execute('SELECT mtime FROM dirs WHERE dirpath = ?',
+                                 (dirpath,)).fetchone()
+        if row is None:
+            return None
+
+        return row[0]
+
+    def put_dir_mtime(self, dirpath, mtime):
+        '''Record modification time of a directory.'''
+
+        self._conn.execute(
+                'INSERT OR REPLACE INTO dirs (dirpath, mtime) VALUES (?,?)',
+                (dirpath, mtime))
+
+        self.modified = True
+
+    def walk(self, top):
+        '''Directory tree generator using cached directory listings.
+
+        Works like :py:func:`os.walk` (top-down, not following symbolic links
+        to directories), but the listing of a directory is taken from the
+        cache if the modification time of the directory has not changed since
+        it was recorded. Only one stat per directory is needed then, instead
+        of one per directory entry.
+        '''
+
+        dirpath = os.path.abspath(top)
+        try:
+            mtime = os.stat(top).st_mtime
+        except OSError:
+            return
+
+        row = self._conn.execute('SELECT mtime FROM listings WHERE dirpath = ?',
+                                 (dirpath,)).fetchone()
+
+        dirnames, filenames, linknames = [], [], []
+        if row is not None and row[0] == mtime:
+            for (name, kind) in self._conn.execute(
+                    '''SELECT name, kind FROM listing_entries 
+                       WHERE dirpath = ?''', (dirpath,)):
+
+                (filenames, dirnames, linknames)[kind].append(name)
+
+        else:
+            try:
+                names = os.listdir(top)
+            except OSError:
+                return
+
+            for name in names:
+                path = pjoin(top, name)
+                if not os.path.isdir(path):
+                    filenames.append(name)
+                elif os.path.islink(path):
+                    linknames.append(name)
+                else:
+                    dirnames.append(name)
+
+            self._conn.execute('DELETE FROM listing_entries WHERE dirpath = ?',
+                               (dirpath,))
+            self._conn.executemany(
+                'INSERT INTO listing_entries VALUES (?,?,?)',
+                [ (dirpath, name, kind) for (kind, names) in 
+                  enumerate((filenames, dirnames, linknames)) 
+                  for name in names ])
+
+            self._conn.execute(
+                'INSERT OR REPLACE INTO listings (dirpath, mtime) VALUES (?,?)',
+                (dirpath, mtime))
+
+            self.modified = True
+
+        yield top, dirnames + linknames, filenames
+
+        for name in dirnames:
+            for x in self.walk(pjoin(top, name)):
+                yield x
+
+    def remove(self, abspath):
+        '''Remove an item from the cache.
+
+        :param abspath: absolute path of the object to be removed
+        '''
+
+        self._delete(abspath)
+        self.modified = True
 
     def dump_modified(self):
         '''Save any modifications to disk.'''
 
-        for cachepath in self.modified:
-            self._dump_dircache(self.dircaches[cachepath], cachepath)
-            # unlock 
-            
-        self.modified = set()
+        if self.modified:
+            self._conn.commit()
+
+        self.modified = False
 
     def clean(self):
-        '''Weed out missing files from the disk caches.'''
+        '''Weed out missing files from the disk cache.'''
         
         self.dump_modified()
         
-        for fn in os.listdir(self.cachedir):
-            try:
-                i = int(fn) # valid filenames are integers
-                cache = self._load_dircache(pjoin(self.cachedir, fn))
-                self._dump_dircache(cache, pjoin(self.cachedir, fn))
-                
-            except ValueError:
-                pass
+        abspaths = [ row[0] for row in 
+                     self._conn.execute('SELECT abspath FROM files') ]
 
-    def _get_dircache_for(self, abspath):
-        return self._get_dircache(self._dircachepath(abspath))
-    
-    def _get_dircache(self, cachepath):
-        if cachepath not in self.dircaches:
-            if os.path.isfile(cachepath):
-                self.dircaches[cachepath] = self._load_dircache(cachepath)
-            else:
-                self.dircaches[cachepath] = {}
-                
-        return self.dircaches[cachepath]
-       
-    def _dircachepath(self, abspath):
-        cachefn = "%i" % abs(hash(os.path.dirname(abspath)))
-        return  pjoin(self.cachedir, cachefn)
-            
-    def _load_dircache(self, cachefilename):
-        
-        f = open(cachefilename,'r')
-        cache = pickle.load(f)
-        f.close()
-       
-        # weed out files which no longer exist
-        for fn in cache.keys():
-            if not os.path.isfile(fn):
-                del cache[fn]
-        
-        for v in cache.values():
-            v.trees_from_content(v.traces)
-            for tr in v.traces:
-                tr.file = v
-
-            v.data_use_count = 0
-            v.data_loaded = False
-        return cache
-        
-    def _dump_dircache(self, cache, cachefilename):
-        
-        if not cache:
-            if os.path.exists(cachefilename):
-                os.remove(cachefilename)
-            return
-        
-        # make a copy without the parents and the binsearch trees
-        cache_copy = {}
-        for fn in cache.keys():
-            trf = copy.copy(cache[fn])
-            trf.parent = None
-            trf.by_tmin = None
-            trf.by_tmax = None
-            trf.by_tlen = None
-            trf.by_mtime = None
-            trf.data_use_count = 0
-            trf.data_loaded = False
-            trf.traces = [ tr.copy(data=False) for tr in trf.traces ]
-            for tr in trf.traces:
-                tr.file = trf
-            cache_copy[fn] = trf
-        
-        tmpfn = cachefilename+'.%i.tmp' % os.getpid()
-        f = open(tmpfn, 'w')
-        
-        pickle.dump(cache_copy, f)
-        f.close()
-        os.rename(tmpfn, cachefilename)
+        for abspath in abspaths:
+            if not os.path.isfile(abspath):
+                self.remove(abspath)
+
+        self.dump_modified()
+
+    def query(self, tmin=None, tmax=None, nslc_ids=None):
+        '''Get paths of cached files with traces matching given constraints.
 
+        :param tmin,tmax: time span which the traces must overlap with or
+            ``None``
+        :param nslc_ids: list of (network, station, location, channel) tuples
+            to restrict the query to or ``None``
+
+        :returns: sorted list of absolute paths
+        '''
+
+        conditions = []
+        args = []
+        if tmin is not None:
+            conditions.append('traces.tmax >= ?')
+            args.append(float(tmin))
+
+        if tmax is not None:
+            conditions.append('traces.tmin <= ?')
+            args.append(float(tmax))
+        
+        sql = '''SELECT DISTINCT files.abspath FROM traces 
+                   JOIN files ON traces.file_id = files.file_id'''
+
+        abspaths = set()
+        for nslc_id in (nslc_ids or [ None ]):
+            xconditions, xargs = list(conditions), list(args)
+            if nslc_id is not None:
+                xconditions.append('traces.network = ? AND traces.station = ? '
+                                   'AND traces.location = ? '
+                                   'AND traces.channel = ?')
+                xargs.extend(nslc_id)
+
+            xsql = sql
+            if xconditions:
+                xsql += ' WHERE ' + ' AND '.join(xconditions)
+
+            for (abspath,) in self._conn.execute(xsql, xargs):
+                abspaths.add(abspath)
+
+        return sorted(abspaths)
+
+    def _delete(self, abspath):
+        row = self._conn.execute('SELECT file_id FROM files WHERE abspath = ?',
+                                 (abspath,)).fetchone()
+        if row is not None:
+            self._conn.execute('DELETE FROM traces WHERE file_id = ?', row)
+            self._conn.execute('DELETE FROM records WHERE file_id = ?', row)
+            self._conn.execute('DELETE FROM files WHERE file_id = ?', row)
+
+def _to_offset_pair(t):
+    '''Split (possibly high precision) time into float and residual.'''
+    ft = float(t)
+    return ft, float(t-ft)
+
+def _from_offset_pair(t, offset):
+    if offset:
+        return util.hpfloat(t) + offset
+    return t
 
 def get_cache(cachedir):
     '''Get global TracesFileCache object for given directory.'''
@@ -262,7 +660,105 @@ def get_cache(cachedir):
         
     return TracesFileCache.caches[cachedir]
     
-def loader(filenames, fileformat, cache, filename_attributes, show_progress=True, update_progress=None):
+def _load_headers(abspath, fileformat, substitutions):
+    '''Read trace headers of a file and, for Mini-SEED, its record index.'''
+
+    if fileformat == 'mseed':
+        mtime = os.stat(abspath)[8]
+        traces, records = mseed.load_record_index(abspath)
+        for tr in traces:
+            io.make_substitutions(tr, substitutions)
+            tr.set_mtime(mtime)
+
+        return traces, records
+
+    else:
+        return io.load(abspath, format=fileformat, getdata=False, 
+                       substitutions=substitutions), None
+
+def _scan_file(args):
+    '''Read trace headers of a file (runs in worker processes).'''
+
+    abspath, fileformat, substitutions = args
+    try:
+        return _load_headers(abspath, fileformat, substitutions)
+
+    except (io.FileLoadError, OSError), e:
+        return io.FileLoadError(str(e))
+
+def _iter_scanned(jobs, nworkers):
+    '''Scan headers of files in a process pool, yielding results in order.'''
+
+    import multiprocessing
+    pool = multiprocessing.Pool(nworkers)
+    try:
+        chunksize = max(1, min(100, len(jobs) / (nworkers*4)))
+        for result in pool.imap(_scan_file, jobs, chunksize):
+            yield result
+
+        pool.close()
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _prefetch(iterator, n):
+    '''Run an iterator in a background thread, keeping up to n items ahead.
+
+    Items are yielded in the original order. Exceptions raised by the
+    iterator are re-raised in the consuming thread. When the consumer stops
+    early, the background thread is stopped and the iterator is closed.
+    '''
+
+    import threading, Queue
+
+    queue = Queue.Queue(n)
+    stop = threading.Event()
+
+    def put(x):
+        while not stop.isSet():
+            try:
+                queue.put(x, True, 0.1)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def work():
+        try:
+            try:
+                for item in iterator:
+                    if not put(('item', item)):
+                        break
+                else:
+                    put(('end', None))
+
+            except Exception:
+                put(('error', sys.exc_info()))
+
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    thread = threading.Thread(target=work)
+    thread.setDaemon(True)
+    thread.start()
+    try:
+        while True:
+            what, x = queue.get()
+            if what == 'item':
+                yield x
+            elif what == 'end':
+                break
+            else:
+                raise x[0], x[1], x[2]
+
+    finally:
+        stop.set()
+        thread.join()
+
+def loader(filenames, fileformat, cache, filename_attributes, show_progress=True, update_progress=None, nworkers=1, use_memmap=False, validation='stat', native_dtype=False):
 
     class Progress:
         def __init__(self, label, n):
@@ -290,6 +786,19 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
         logger.warn('No files to load from')
         return
     
+    if validation not in ('stat', 'dirmtime', 'trusted'):
+        raise ValueError('invalid validation mode: %s' % validation)
+
+    dir_unchanged = {}
+    def is_dir_unchanged(dirpath):
+        if dirpath not in dir_unchanged:
+            mtime = os.stat(dirpath).st_mtime
+            dir_unchanged[dirpath] = cache.get_dir_mtime(dirpath) == mtime
+            if not dir_unchanged[dirpath]:
+                cache.put_dir_mtime(dirpath, mtime)
+        
+        return dir_unchanged[dirpath]
+
     regex = None
     if filename_attributes:
         regex = re.compile(filename_attributes)
@@ -314,11 +823,24 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
                         substitutions[k] = m.groupdict()[k]
                 
             
-            mtime = os.stat(filename)[8]
             tfile = None
             if cache:
                 tfile = cache.get(abspath)
-            to_load.append(((not tfile or tfile.mtime != mtime or substitutions), mtime, abspath, substitutions, tfile))
+
+            dir_ok = False
+            if cache and validation == 'dirmtime':
+                dir_ok = is_dir_unchanged(os.path.dirname(abspath))
+
+            if tfile and (validation == 'trusted' or dir_ok):
+
+                mtime, size = tfile.mtime, tfile.size
+            else:
+                stat = os.stat(filename)
+                mtime, size = stat[8], stat[6]
+
+            mustload = (not tfile or tfile.mtime != mtime or tfile.size != size 
+                        or substitutions)
+            to_load.append((mustload, mtime, size, abspath, substitutions, tfile))
     
         except (OSError, FilenameAttributeError), xerror:
             failures.append(abspath)
@@ -340,12 +862,32 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
     if to_load:
         progress = Progress('Scanning files', nload)
 
-        for (mustload, mtime, abspath, substitutions, tfile) in to_load:
+        scanned = None
+        if nworkers > 1:
+            jobs = [ (abspath, fileformat, substitutions) for 
+                     (mustload, _, _, abspath, substitutions, _) in to_load if mustload ]
+            if len(jobs) > 1:
+                scanned = _iter_scanned(jobs, nworkers)
+
+        for (mustload, mtime, size, abspath, substitutions, tfile) in to_load:
             try:
                 if mustload:
-                    tfile = TracesFile(None, abspath, fileformat, substitutions=substitutions, mtime=mtime)
+                    if scanned is not None:
+                        result = scanned.next()
+                        if isinstance(result, io.FileLoadError):
+                            raise result
+
+                        traces, records = result
+                        tfile = TracesFile(None, abspath, fileformat, substitutions=substitutions, mtime=mtime, size=size, traces=traces, records=records)
+                    else:
+                        tfile = TracesFile(None, abspath, fileformat, substitutions=substitutions, mtime=mtime, size=size)
+
                     if cache and not substitutions:
                         cache.put(abspath, tfile)
+                        if tfile.records is not None:
+                            # keep record index only in the cache
+                            tfile.records = None
+                            tfile.records_cache = cache
                     
                     if not count_all:
                         iload += 1
@@ -356,7 +898,14 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
             except (io.FileLoadError, OSError), xerror:
                 failures.append(abspath)
                 logger.warn(xerror)
+                if cache:
+                    cache.remove(abspath)
             else:
+                tfile.use_memmap = use_memmap
+                tfile.native_dtype = native_dtype
+                if cache and not substitutions:
+                    tfile.cache = cache
+
                 yield tfile
             
             progress.update(iload+1)
@@ -369,17 +918,15 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
     if cache:
         cache.dump_modified()
 
-def tlen(x):
-    return x.tmax-x.tmin
-
 class TracesGroup(object):
     
     '''Trace container base class.
     
     Base class for Pile, SubPile, and TracesFile, i.e. anything containing 
     a collection of several traces. A TracesGroup object maintains lookup sets
-    of some of the traces meta-information, as well as a combined time-range
-    of its contents.
+    of some of the traces meta-information, a :py:class:`TimeIndex` of the
+    segments of the files it contains, as well as a combined time-range of
+    its contents.
     '''
     
     def __init__(self, parent):
@@ -396,54 +943,43 @@ class TracesGroup(object):
     
     def empty(self):
         self.networks, self.stations, self.locations, self.channels, self.nslc_ids, self.deltats = [ Counter() for x in range(6) ]
-        self.by_tmin = Sorted([], 'tmin')
-        self.by_tmax = Sorted([], 'tmax')
-        self.by_tlen = Sorted([], tlen)
-        self.by_mtime = Sorted([], 'mtime')
+        self.index = TimeIndex()
         self.tmin, self.tmax = None, None
+        self.mtime = None
         self.deltatmin, self.deltatmax = None, None
     
-    def trees_from_content(self, content):
-        self.by_tmin = Sorted(content, 'tmin')
-        self.by_tmax = Sorted(content, 'tmax')
-        self.by_tlen = Sorted(content, tlen)
-        self.by_mtime = Sorted(content, 'mtime')
-        self.adjust_minmax()
-
     def add(self, content):
         
-        if isinstance(content, trace.Trace) or isinstance(content, TracesGroup):
+        if isinstance(content, TracesGroup):
             content = [ content ]
 
+        tmins, tmaxs, mtimes = [], [], []
         for c in content:
-        
-            if isinstance(c, TracesGroup):
-                self.networks.update( c.networks )
-                self.stations.update( c.stations )
-                self.locations.update( c.locations )
-                self.channels.update( c.channels )
-                self.nslc_ids.update( c.nslc_ids )
-                self.deltats.update( c.deltats )
-                
-                self.by_tmin.insert_many(c.by_tmin)
-                self.by_tmax.insert_many(c.by_tmax)
-                self.by_tlen.insert_many(c.by_tlen)
-                self.by_mtime.insert_many(c.by_mtime)
+            self.networks.update( c.networks )
+            self.stations.update( c.stations )
+            self.locations.update( c.locations )
+            self.channels.update( c.channels )
+            self.nslc_ids.update( c.nslc_ids )
+            self.deltats.update( c.deltats )
             
-            elif isinstance(c, trace.Trace):
-                self.networks[c.network] += 1
-                self.stations[c.station] += 1
-                self.locations[c.location] += 1
-                self.channels[c.channel] += 1
-                self.nslc_ids[c.nslc_id] += 1
-                self.deltats[c.deltat] += 1
-    
-                self.by_tmin.insert(c)
-                self.by_tmax.insert(c)
-                self.by_tlen.insert(c)
-                self.by_mtime.insert(c)
+            self.index.insert(c)
+
+            if c.tmin is not None:
+                tmins.append(c.tmin)
+                tmaxs.append(c.tmax)
+                mtimes.append(c.mtime)
+            
+        if self.tmin is not None:
+            tmins.append(self.tmin)
+            tmaxs.append(self.tmax)
+            mtimes.append(self.mtime)
 
-        self.adjust_minmax()
+        if tmins:
+            self.tmin = min(tmins)
+            self.tmax = max(tmaxs)
+            self.mtime = max(mtimes)
+
+        self.adjust_deltat_minmax()
 
         self.nupdates += 1
         self.notify_listeners('add')
@@ -453,38 +989,28 @@ class TracesGroup(object):
             
     def remove(self, content):
 
-        if isinstance(content, trace.Trace) or isinstance(content, TracesGroup):
+        if isinstance(content, TracesGroup):
             content = [ content ]
 
+        extreme_removed = False
         for c in content:
-        
-            if isinstance(c, TracesGroup):
-                self.networks.subtract( c.networks )
-                self.stations.subtract( c.stations )
-                self.locations.subtract( c.locations )
-                self.channels.subtract( c.channels )
-                self.nslc_ids.subtract( c.nslc_ids )
-                self.deltats.subtract( c.deltats )
-
-                self.by_tmin.remove_many( c.by_tmin )
-                self.by_tmax.remove_many( c.by_tmax )
-                self.by_tlen.remove_many( c.by_tlen )
-                self.by_mtime.remove_many( c.by_mtime )
-
-            elif isinstance(c, trace.Trace):
-                self.networks.subtract1(c.network)
-                self.stations.subtract1(c.station)
-                self.locations.subtract1(c.location)
-                self.channels.subtract1(c.channel)
-                self.nslc_ids.subtract1(c.nslc_id)
-                self.deltats.subtract1(c.deltat)
-    
-                self.by_tmin.remove(c)
-                self.by_tmax.remove(c)
-                self.by_tlen.remove(c)
-                self.by_mtime.remove(c)
+            self.networks.subtract( c.networks )
+            self.stations.subtract( c.stations )
+            self.locations.subtract( c.locations )
+            self.channels.subtract( c.channels )
+            self.nslc_ids.subtract( c.nslc_ids )
+            self.deltats.subtract( c.deltats )
 
-        self.adjust_minmax()
+            self.index.remove(c)
+
+            if c.tmin is not None and (c.tmin <= self.tmin or 
+                    c.tmax >= self.tmax or c.mtime >= self.mtime):
+                extreme_removed = True
+
+        if extreme_removed or not self.index:
+            self.adjust_minmax()
+        else:
+            self.adjust_deltat_minmax()
 
         self.nupdates += 1
         self.notify_listeners('remove')
@@ -492,29 +1018,49 @@ class TracesGroup(object):
         if self.parent is not None:
             self.parent.remove(content)
 
-    def relevant(self, tmin, tmax, group_selector=None, trace_selector=None):
+    def relevant(self, tmin, tmax, group_selector=None, trace_selector=None, nslc_ids=None):
+        '''Get traces overlapping with a given time span.
+
+        Trace objects are only created for the segments found.
+
+        :param tmin,tmax: time span
+        :param group_selector: callback for conditional inclusion, called with
+            the group as argument
+        :param trace_selector: callback for conditional inclusion, called with
+            each trace as argument
+        :param nslc_ids: list of (network, station, location, channel) tuples
+            to restrict the query to or ``None``
+        '''
 
-        if not self.by_tmin or not self.is_relevant(tmin, tmax, group_selector):
+        if not self.index or not self.is_relevant(tmin, tmax, group_selector):
             return []
-        
-        return [ tr for tr in self.by_tmin.with_key_in(tmin-self.tlenmax, tmax) 
-                    if tr.is_relevant(tmin, tmax, trace_selector) ]
+
+        traces = []
+        for file, iseg in self.index.query(tmin, tmax, nslc_ids):
+            tr = file.get_trace(iseg)
+            if tr.is_relevant(tmin, tmax, trace_selector):
+                traces.append(tr)
+
+        return traces
 
     def adjust_minmax(self):
-        if self.by_tmin:
-            self.tmin = self.by_tmin.min().tmin
-            self.tmax = self.by_tmax.max().tmax
-            t = self.by_tlen.max()
-            self.tlenmax = t.tmax - t.tmin
-            self.mtime = self.by_mtime.max().mtime
-            deltats = self.deltats.keys()
-            self.deltatmin = min(deltats)
-            self.deltatmax = max(deltats)
+        if self.index:
+            self.tmin = self.index.tmin()
+            self.tmax = self.index.tmax()
+            self.mtime = max(file.mtime for file in self.index.files())
         else:
             self.tmin = None
             self.tmax = None
-            self.tlenmax = None
             self.mtime = None
+
+        self.adjust_deltat_minmax()
+
+    def adjust_deltat_minmax(self):
+        if self.deltats:
+            deltats = self.deltats.keys()
+            self.deltatmin = min(deltats)
+            self.deltatmax = max(deltats)
+        else:
             self.deltatmin = None
             self.deltatmax = None
 
@@ -531,16 +1077,149 @@ class TracesGroup(object):
     def is_relevant(self, tmin, tmax, group_selector=None):
         #return  not (tmax <= self.tmin or self.tmax < tmin) and (selector is None or selector(self))
         return  tmax >= self.tmin and self.tmax >= tmin and (group_selector is None or group_selector(self))
+
+class TracesFileBase(TracesGroup):
+
+    '''Base class for MemTracesFile and TracesFile.
+
+    The meta-information of the traces in a file is kept in compact arrays:
+    start and end times, sampling intervals and integer codes of the
+    (network, station, location, channel) combinations (see
+    :py:func:`nslc_code`). Trace objects are created on demand by
+    :py:meth:`get_trace`.
+    '''
+
+    def empty(self):
+        TracesGroup.empty(self)
+        self.index = None
+        self._codes = num.zeros(0, dtype=num.int32)
+        self._tmins = num.zeros(0)
+        self._tmaxs = num.zeros(0)
+        self._deltats = num.zeros(0)
+
+    def set_segments(self, traces):
+        '''Set meta-information of the traces in the file.
+
+        The codes, time spans and sampling intervals of the given traces are
+        copied into the arrays of the file. The file is removed from and
+        re-added to its parent, so that the parent's index is kept in sync.
+        '''
+
+        parent = self.parent
+        if parent is not None:
+            parent.remove(self)
+
+        n = len(traces)
+        if any(tr.deltat < 0.001 for tr in traces):
+            tdtype = util.hpfloat
+        else:
+            tdtype = num.float64
+
+        self._codes = num.fromiter((nslc_code(tr.nslc_id) for tr in traces),
+                                   dtype=num.int32, count=n)
+        self._tmins = num.array([ tr.tmin for tr in traces ], dtype=tdtype)
+        self._tmaxs = num.array([ tr.tmax for tr in traces ], dtype=tdtype)
+        self._deltats = num.array([ tr.deltat for tr in traces ], 
+                                  dtype=num.float64)
+
+        self.networks, self.stations, self.locations, self.channels, self.nslc_ids, self.deltats = [ Counter() for x in range(6) ]
+        if n:
+            codes, inverse = num.unique(self._codes, return_inverse=True)
+            for code, count in zip(codes.tolist(), 
+                                   num.bincount(inverse).tolist()):
+
+                nslc_id = _nslc_ids[code]
+                network, station, location, channel = nslc_id
+                self.networks[network] += count
+                self.stations[station] += count
+                self.locations[location] += count
+                self.channels[channel] += count
+                self.nslc_ids[nslc_id] += count
+
+            deltats, inverse = num.unique(self._deltats, return_inverse=True)
+            for deltat, count in zip(deltats.tolist(), 
+                                     num.bincount(inverse).tolist()):
+                self.deltats[deltat] += count
+
+            self.tmin = self._tmins.min().item()
+            self.tmax = self._tmaxs.max().item()
+        else:
+            self.tmin = None
+            self.tmax = None
+
+        self.adjust_deltat_minmax()
+        self.nupdates += 1
+
+        if parent is not None:
+            parent.add(self)
+
+    def get_segments(self):
+        '''Get codes, start and end times of the traces as arrays.'''
+
+        return (self._codes, 
+                num.asarray(self._tmins, dtype=num.float64), 
+                num.asarray(self._tmaxs, dtype=num.float64))
+
+    def get_nsegments(self):
+        return self._codes.size
+
+    def make_trace(self, iseg):
+        '''Create a trace without data from the stored meta-information.'''
+
+        network, station, location, channel = _nslc_ids[self._codes[iseg]]
+        tr = trace.Trace(network, station, location, channel, 
+                         tmin=self._tmins[iseg].item(), 
+                         tmax=self._tmaxs[iseg].item(),
+                         deltat=self._deltats[iseg].item(), 
+                         mtime=self.mtime)
+        tr.file = self
+        return tr
+
+    def get_trace(self, iseg):
+        return self.make_trace(iseg)
+
+    def relevant(self, tmin, tmax, group_selector=None, trace_selector=None, nslc_ids=None):
+        if self.tmin is None or not self.is_relevant(tmin, tmax, group_selector):
+            return []
+
+        mask = num.logical_and(self._tmins < tmax, self._tmaxs >= tmin)
+        if nslc_ids is not None:
+            codes = [ _nslc_codes[k] for k in nslc_ids if k in _nslc_codes ]
+            mask = num.logical_and(mask, num.in1d(self._codes, codes))
+
+        isegs = num.nonzero(mask)[0]
+        isegs = isegs[num.argsort(self._tmins[isegs], kind='mergesort')]
+        traces = [ self.get_trace(iseg) for iseg in isegs.tolist() ]
+        return [ tr for tr in traces 
+                 if trace_selector is None or trace_selector(tr) ]
+
+    def iter_traces(self):
+        for iseg in xrange(self.get_nsegments()):
+            yield self.get_trace(iseg)
+    
+    def get_traces(self):
+        return list(self.iter_traces())
+
+    traces = property(get_traces)
+
+    def gather_keys(self, gather, selector=None):
+        keys = set()
+        for trace in self.iter_traces():
+            if selector is None or selector(trace):
+                keys.add(gather(trace))
             
-class MemTracesFile(TracesGroup):
+        return keys
+    
+class MemTracesFile(TracesFileBase):
     
     '''This is needed to make traces without an actual disc file to be inserted
     into a Pile.'''
     
     def __init__(self, parent, traces):
-        TracesGroup.__init__(self, parent)
-        self.add(traces)
+        TracesFileBase.__init__(self, parent)
         self.mtime = time.time()
+        self._traces = []
+        self.add(traces)
         
     def add(self, traces):
         if isinstance( traces, trace.Trace):
@@ -549,7 +1228,20 @@ class MemTracesFile(TracesGroup):
         for tr in traces:
             tr.file = self
 
-        TracesGroup.add(self, traces)
+        self._traces.extend(traces)
+        self.set_segments(self._traces)
+
+    def remove(self, traces):
+        if isinstance( traces, trace.Trace):
+            traces = [ traces ]
+
+        for tr in traces:
+            remove_exact(self._traces, tr)
+
+        self.set_segments(self._traces)
+
+    def get_trace(self, iseg):
+        return self._traces[iseg]
 
     def load_headers(self, mtime=None):
         pass
@@ -557,6 +1249,9 @@ class MemTracesFile(TracesGroup):
     def load_data(self):
         pass
         
+    def load_records(self, tmin, tmax, nslc_ids=None):
+        return None
+
     def use_data(self):
         pass
         
@@ -566,26 +1261,14 @@ class MemTracesFile(TracesGroup):
     def reload_if_modified(self):
         return False
             
-    def iter_traces(self):
-        for trace in self.by_tmin:
-            yield trace
-    
     def get_traces(self):
-        return list(self.by_tmin)
-    
-    def gather_keys(self, gather, selector=None):
-        keys = set()
-        for trace in self.by_tmin:
-            if selector is None or selector(trace):
-                keys.add(gather(trace))
-            
-        return keys
+        return sorted(self._traces, key=operator.attrgetter('tmin'))
     
     def __str__(self):
         
         s = 'MemTracesFile\n'
         s += 'file mtime: %s\n' % util.time_to_str(self.mtime)
-        s += 'number of traces: %i\n' % len(self.by_tmin)
+        s += 'number of traces: %i\n' % self.get_nsegments()
         s += 'timerange: %s - %s\n' % (util.time_to_str(self.tmin), util.time_to_str(self.tmax))
         s += 'networks: %s\n' % ', '.join(sl(self.networks.keys()))
         s += 'stations: %s\n' % ', '.join(sl(self.stations.keys()))
@@ -594,109 +1277,257 @@ class MemTracesFile(TracesGroup):
         s += 'deltats: %s\n' % ', '.join(sl(self.deltats.keys()))
         return s
 
-class TracesFile(TracesGroup):
-    def __init__(self, parent, abspath, format, substitutions=None, mtime=None):
-        TracesGroup.__init__(self, parent)
+class TracesFile(TracesFileBase):
+    def __init__(self, parent, abspath, format, substitutions=None, mtime=None, size=None, traces=None, records=None, use_memmap=False, native_dtype=False):
+        TracesFileBase.__init__(self, parent)
         self.abspath = abspath
         self.format = format
-        self.traces = []
+        self.use_memmap = use_memmap
+        self.native_dtype = native_dtype
+        self.data_traces = None
+        self.records = None
+        self.records_cache = None
+        self.record_chunks = []
         self.data_loaded = False
         self.data_use_count = 0
+        self.data_cache = None
+        self.cache = None
         self.substitutions = substitutions
-        self.load_headers(mtime=mtime)
-        self.mtime = mtime
-        
-    def load_headers(self, mtime=None):
-        logger.debug('loading headers from file: %s' % self.abspath)
-        if mtime is None:
-            self.mtime = os.stat(self.abspath)[8]
+        if traces is None:
+            self.load_headers(mtime=mtime, size=size)
+        else:
+            self.mtime = mtime
+            self.size = size
+            self.set_traces(traces)
+            self.records = records
         
-        self.remove(self.traces)
-        for tr in io.load(self.abspath, format=self.format, getdata=False, substitutions=self.substitutions):
-            self.traces.append(tr)
-            tr.file = self
+    def set_traces(self, traces):
+        '''Set trace metainformation without reading the file.'''
 
-        self.add(self.traces)
+        self.set_segments(traces)
 
+    def load_headers(self, mtime=None, size=None):
+        logger.debug('loading headers from file: %s' % self.abspath)
+        if mtime is None or size is None:
+            stat = os.stat(self.abspath)
+            mtime, size = stat[8], stat[6]
+
+        traces, self.records = _load_headers(self.abspath, self.format, self.substitutions)
+        self.records_cache = None
+        self.mtime = mtime
+        self.size = size
+        self.data_traces = None
+        self.record_chunks = []
         self.data_loaded = False
         self.data_use_count = 0
+        self.set_segments(traces)
+        if self.data_cache is not None:
+            self.data_cache.forget(self)
+
+    def _segments_match(self, traces):
+        if len(traces) != self.get_nsegments():
+            return False
+
+        for iseg, tr in enumerate(traces):
+            if (tr.mtime != self.mtime or 
+                    nslc_code(tr.nslc_id) != self._codes[iseg] or
+                    tr.tmin != self._tmins[iseg] or 
+                    tr.tmax != self._tmaxs[iseg]):
+                return False
+
+        return True
         
     def load_data(self, force=False):
         file_changed = False
-        if not self.data_loaded or force:
+        hit = self.data_loaded and not force
+        if not hit:
             logger.debug('loading data from file: %s' % self.abspath)
             
-            for itr, tr in enumerate(io.load(self.abspath, format=self.format, getdata=True, substitutions=self.substitutions)):
-                if itr < len(self.traces):
-                    xtr = self.traces[itr]
-                    if xtr.mtime != tr.mtime or xtr.tmin != tr.tmin or xtr.tmax != tr.tmax:
-                        logger.warn('file may have changed since last access (trace number %i has changed): %s' % (itr, self.abspath))
-                        self.remove(xtr)
-                        self.traces.remove(xtr)
-                        xtr.file = None
-                        self.traces.append(tr)
-                        self.add(tr)
-                        tr.file = self
-                        file_changed = True
-                    else:
-                        xtr.ydata = tr.ydata
-                    
-                else:
-                    self.traces.add(tr)
-                    self.add(tr)
-                    logger.warn('file may have changed since last access (new trace found): %s' % self.abspath)
-                    file_changed = True
+            traces = io.load(self.abspath, format=self.format, getdata=True, substitutions=self.substitutions, use_memmap=self.use_memmap, native_dtype=self.native_dtype)
+            for tr in traces:
+                tr.file = self
+
+            if not self._segments_match(traces):
+                logger.warn('file may have changed since last access: %s' % self.abspath)
+                self.set_segments(traces)
+                file_changed = True
+
+            self.data_traces = traces
+            self.record_chunks = []
             self.data_loaded = True
+
+        if file_changed:
+            self.forget_records()
+
+        if self.data_cache is not None:
+            self.data_cache.touch(self, hit)
+
         return file_changed
+
+    def get_trace(self, iseg):
+        if self.data_traces is not None:
+            return self.data_traces[iseg]
+        else:
+            return self.make_trace(iseg)
     
+    def get_records(self, tmin, tmax, nslc_ids=None):
+        '''Get positions of the records overlapping with a given time span.
+
+        :returns: list of ``(offset, reclen)`` tuples or ``None`` if no record
+            index is available for the file
+        '''
+
+        if self.records is not None:
+            return [ rec[:2] for rec in self.records 
+                     if rec[6] <= tmax and tmin <= rec[7] and 
+                     (nslc_ids is None or tuple(rec[2:6]) in nslc_ids) ]
+
+        elif self.records_cache is not None:
+            return self.records_cache.get_records(self.abspath, tmin, tmax, 
+                                                  nslc_ids)
+
+        else:
+            return None
+
+    def load_records(self, tmin, tmax, nslc_ids=None):
+        '''Read only the data needed for a given time span.
+
+        If the data of the file is not already loaded and a record index is
+        available, only the records overlapping with the time span (plus one
+        sample on either side) are decoded. The decoded ranges are kept and
+        accounted for in the data cache like completely loaded files, so that
+        reading a time span which is covered by a previously decoded range
+        does not go to disk.
+
+        :returns: list of traces holding the decoded data or ``None`` if this
+            is not possible
+        '''
+
+        if self.data_loaded or self.deltatmax is None:
+            return None
+
+        rtmin = tmin - self.deltatmax
+        rtmax = tmax + self.deltatmax
+        if nslc_ids is not None:
+            nslc_ids = frozenset(nslc_ids)
+
+        for chunk in self.record_chunks:
+            ctmin, ctmax, cnslc_ids, traces = chunk
+            if ctmin <= rtmin and rtmax <= ctmax and (cnslc_ids is None or 
+                    (nslc_ids is not None and nslc_ids <= cnslc_ids)):
+
+                if self.data_cache is not None:
+                    self.data_cache.touch(self, True)
+
+                return traces
+
+        records = self.get_records(rtmin, rtmax, nslc_ids)
+        if records is None:
+            return None
+
+        logger.debug('loading %i records from file: %s' % 
+                     (len(records), self.abspath))
+
+        traces = mseed.load_records(self.abspath, records)
+        for tr in traces:
+            io.make_substitutions(tr, self.substitutions)
+            tr.set_mtime(self.mtime)
+
+        # ranges covered by the new one are not needed anymore
+        self.record_chunks = [ 
+            (ctmin, ctmax, cnslc_ids, ctraces) 
+            for (ctmin, ctmax, cnslc_ids, ctraces) in self.record_chunks
+            if not (rtmin <= ctmin and ctmax <= rtmax and (nslc_ids is None or
+                    (cnslc_ids is not None and cnslc_ids <= nslc_ids))) ]
+
+        self.record_chunks.append((rtmin, rtmax, nslc_ids, traces))
+
+        if self.data_cache is not None:
+            self.data_cache.touch(self, False)
+
+        return traces
+
+    def forget_records(self):
+        self.records = None
+        self.records_cache = None
+        self.record_chunks = []
+
     def use_data(self):
         if not self.data_loaded: raise Exception('Data not loaded')
         self.data_use_count += 1
         
     def drop_data(self):
         if self.data_loaded:
-            if self.data_use_count == 1:
-                logger.debug('forgetting data of file: %s' % self.abspath)
-                for tr in self.traces:
-                    tr.drop_data()
-                    
-                self.data_loaded = False
+            if self.data_use_count == 1 and self.data_cache is None:
+                self.unload_data()
                     
             self.data_use_count -= 1    
         else:
             self.data_use_count = 0
+
+        if self.data_cache is not None:
+            # data of unused files is kept until evicted from the cache
+            self.data_cache.cleanup()
+
+    def unload_data(self):
+        if self.data_loaded:
+            logger.debug('forgetting data of file: %s' % self.abspath)
+            for tr in self.data_traces:
+                tr.drop_data()
+            
+            self.data_traces = None
+            self.data_loaded = False
+
+        if self.record_chunks:
+            logger.debug('forgetting decoded records of file: %s' % 
+                         self.abspath)
+            self.record_chunks = []
+
+        if self.data_cache is not None:
+            self.data_cache.forget(self)
+
+    def get_data_nbytes(self):
+        '''Get number of bytes occupied by the loaded sample arrays.
+
+        Includes the data of ranges decoded with :py:meth:`load_records`.
+        '''
+
+        traces = []
+        if self.data_traces is not None:
+            traces.extend(self.data_traces)
+
+        for (ctmin, ctmax, cnslc_ids, ctraces) in self.record_chunks:
+            traces.extend(ctraces)
+
+        return sum( tr.ydata.nbytes for tr in traces
+                    if tr.ydata is not None )
             
     def reload_if_modified(self):
-        mtime = os.stat(self.abspath)[8]
-        if mtime != self.mtime:
+        stat = os.stat(self.abspath)
+        mtime, size = stat[8], stat[6]
+        if mtime != self.mtime or size != self.size:
             logger.debug('mtime=%i, reloading file: %s' % (mtime, self.abspath))
             self.mtime = mtime
+            self.size = size
             if self.data_loaded:
+                self.forget_records()
                 self.load_data(force=True)
             else:
-                self.load_headers()
+                self.load_headers(mtime=mtime, size=size)
             
+            if self.cache is not None:
+                self.cache.put(self.abspath, self)
+                self.cache.dump_modified()
+
             return True
             
         return False
        
-    def iter_traces(self):
-        for trace in self.traces:
-            yield trace
-    
-    def gather_keys(self, gather, selector=None):
-        keys = set()
-        for trace in self.by_tmin:
-            if selector is None or selector(trace):
-                keys.add(gather(trace))
-            
-        return keys
-    
     def __str__(self):
         s = 'TracesFile\n'
         s += 'abspath: %s\n' % self.abspath
         s += 'file mtime: %s\n' % util.time_to_str(self.mtime)
-        s += 'number of traces: %i\n' % len(self.traces)
+        s += 'number of traces: %i\n' % self.get_nsegments()
         s += 'timerange: %s - %s\n' % (util.time_to_str(self.tmin), util.time_to_str(self.tmax))
         s += 'networks: %s\n' % ', '.join(sl(self.networks.keys()))
         s += 'stations: %s\n' % ', '.join(sl(self.stations.keys()))
@@ -707,6 +1538,81 @@ class TracesFile(TracesGroup):
 
 
     
+class DataCache(object):
+    '''Pile-wide LRU cache of loaded trace data.
+
+    Keeps track of the files whose data is loaded, completely or in record
+    ranges decoded with :py:meth:`TracesFile.load_records`, and unloads the
+    least recently used ones, as long as they are not in use, whenever the
+    total size of the loaded sample arrays exceeds a given budget. Files
+    released with :py:meth:`TracesFile.drop_data` keep their data until it is
+    evicted here, so that reading the same time span again does not go to
+    disk.
+
+    :param nbytes_max: byte budget for the loaded sample arrays
+    '''
+
+    def __init__(self, nbytes_max):
+        self.nbytes_max = nbytes_max
+        self.nbytes = 0
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+        self._files = {}
+        self._tick = 0
+
+    def touch(self, file, hit):
+        '''Register access to the data of a file.
+
+        :param file: :py:class:`TracesFile` object with loaded data
+        :param hit: whether the data was already loaded
+        '''
+
+        if hit:
+            self.nhits += 1
+        else:
+            self.nmisses += 1
+
+        self._tick += 1
+        self.forget(file)
+        nbytes = file.get_data_nbytes()
+        self._files[file] = (self._tick, nbytes)
+        self.nbytes += nbytes
+
+    def forget(self, file):
+        '''Stop accounting for the data of a file.'''
+
+        if file in self._files:
+            self.nbytes -= self._files.pop(file)[1]
+
+    def cleanup(self, keep=()):
+        '''Unload least recently used data until the budget is met.
+
+        :param keep: files which must not be unloaded, in addition to those
+            which are currently in use
+        '''
+
+        if self.nbytes <= self.nbytes_max:
+            return
+
+        candidates = sorted( (tick, file) for (file, (tick, nbytes)) 
+                             in self._files.iteritems() 
+                             if file.data_use_count <= 0 and file not in keep )
+
+        for tick, file in candidates:
+            if self.nbytes <= self.nbytes_max:
+                break
+            
+            file.unload_data()
+            self.nevictions += 1
+
+    def get_stats(self):
+        '''Get dict with size and hit/miss/eviction counters of the cache.'''
+
+        return dict(nbytes=self.nbytes, nbytes_max=self.nbytes_max,
+                    nfiles=len(self._files), nhits=self.nhits, 
+                    nmisses=self.nmisses, nevictions=self.nevictions)
+
 class FilenameAttributeError(Exception):
     pass
 
@@ -787,8 +1693,19 @@ class SubPile(TracesGroup):
 
              
 class Pile(TracesGroup):
-    def __init__(self):
+    def __init__(self, data_cache_nbytes=None):
+        '''Create empty pile.
+
+        :param data_cache_nbytes: byte budget for trace data kept loaded
+            after use (see :py:class:`DataCache`), default is
+            ``config.pile_data_cache_nbytes``
+        '''
+
         TracesGroup.__init__(self, None)
+        if data_cache_nbytes is None:
+            data_cache_nbytes = config.pile_data_cache_nbytes
+
+        self.data_cache = DataCache(data_cache_nbytes)
         self.subpiles = {}
         self.open_files = {}
         self.listeners = []
@@ -803,8 +1720,36 @@ class Pile(TracesGroup):
             if obj:
                 obj.pile_changed(what)
     
-    def load_files(self, filenames, filename_attributes=None, fileformat='mseed', cache=None, show_progress=True, update_progress=None):
-        l = loader(filenames, fileformat, cache, filename_attributes, show_progress=show_progress, update_progress=update_progress)
+    def load_files(self, filenames, filename_attributes=None, fileformat='mseed', cache=None, show_progress=True, update_progress=None, nworkers=1, use_memmap=False, validation='stat', native_dtype=False):
+        '''Load files into the pile.
+
+        :param filenames: list of paths to the files to be added
+        :param filename_attributes: regular expression with named groups
+            ``network``, ``station``, ``location``, and ``channel`` used to
+            override the codes found in the files
+        :param fileformat: format of the files (see :py:func:`pyrocko.io.load`)
+        :param cache: :py:class:`TracesFileCache` object or ``None``
+        :param show_progress: show progress bar and other progress information
+        :param update_progress: callback function for progress information
+        :param nworkers: number of worker processes used to scan the headers
+            of new or modified files
+        :param use_memmap: memory-map the sample data of the files instead of
+            reading it when it is needed (see :py:func:`pyrocko.io.load`)
+        :param validation: how to check whether cached entries are still
+            valid: ``'stat'`` compares modification time and size of every
+            file, ``'dirmtime'`` only does so for files in directories whose
+            modification time has changed since the last scan, and
+            ``'trusted'`` uses cached entries without any check (for
+            immutable archives)
+        :param native_dtype: keep the sample type found in the files instead
+            of converting to 8-byte floats (see :py:func:`pyrocko.io.load`)
+
+        With ``'dirmtime'`` or ``'trusted'`` validation, files modified in
+        place are not noticed. Use :py:meth:`reload_modified` to check them
+        explicitly.
+        '''
+
+        l = loader(filenames, fileformat, cache, filename_attributes, show_progress=show_progress, update_progress=update_progress, nworkers=nworkers, use_memmap=use_memmap, validation=validation, native_dtype=native_dtype)
         self.add_files(l)
         
     def add_files(self, files):
@@ -818,12 +1763,15 @@ class Pile(TracesGroup):
 
         subpile = self.dispatch(file)
         subpile.add_file(file)
+        file.data_cache = self.data_cache
         if file.abspath is not None:
             self.abspaths.add(file.abspath)
     
     def remove_file(self, file):
         subpile = file.get_parent()
         subpile.remove_file(file)
+        self.data_cache.forget(file)
+        file.data_cache = None
         if file.abspath is not None:
             self.abspaths.remove(file.abspath)
         
@@ -839,6 +1787,8 @@ class Pile(TracesGroup):
         for subpile, files in subpile_files.iteritems():
             subpile.remove_files(files)
             for file in files:
+                self.data_cache.forget(file)
+                file.data_cache = None
                 if file.abspath is not None:
                     self.abspaths.remove(file.abspath)
         
@@ -856,29 +1806,55 @@ class Pile(TracesGroup):
     def get_deltats(self):
         return self.deltats.keys()
 
-    def chop(self, tmin, tmax, group_selector=None, trace_selector=None, snap=(round,round), include_last=False, load_data=True):
+    def chop(self, tmin, tmax, group_selector=None, trace_selector=None, snap=(round,round), include_last=False, load_data=True, nslc_ids=None, share=False):
+        '''Cut traces of the pile to given time span.
+
+        :param share: if ``True``, the returned traces hold read-only views
+            into the loaded data instead of copies (see
+            :py:meth:`pyrocko.trace.Trace.chop`)
+        :returns: tuple ``(chopped, used_files)``
+        '''
+
         chopped = []
         used_files = set()
         
-        traces = self.relevant(tmin, tmax, group_selector, trace_selector)
+        traces = self.relevant(tmin, tmax, group_selector, trace_selector, nslc_ids)
         if load_data:
-            files_changed = False
+            file_nslc_ids = {}
             for tr in traces:
-                if tr.file not in used_files:
-                    if tr.file.load_data():
-                        files_changed = True
+                file_nslc_ids.setdefault(tr.file, set()).add(tr.nslc_id)
+
+            # try to read only the needed parts of the files first
+            partial_files = set()
+            partial_traces = []
+            for file, xnslc_ids in file_nslc_ids.iteritems():
+                xtraces = file.load_records(tmin, tmax, xnslc_ids)
+                if xtraces is not None:
+                    partial_files.add(file)
+                    partial_traces.extend( tr for tr in xtraces 
+                        if trace_selector is None or trace_selector(tr) )
 
+            for tr in traces:
+                if tr.file not in used_files and tr.file not in partial_files:
+                    tr.file.load_data()
                     used_files.add(tr.file)
             
-            if files_changed:
-                traces = self.relevant(tmin, tmax, group_selector, trace_selector)
+            # query again to get the traces holding the loaded data
+            if used_files:
+                traces = self.relevant(tmin, tmax, group_selector, trace_selector, nslc_ids)
+
+            traces = [ tr for tr in traces if tr.file not in partial_files ]
+            traces.extend(partial_traces)
 
         for tr in traces:
             try:
-                chopped.append(tr.chop(tmin,tmax,inplace=False,snap=snap, include_last=include_last))
+                chopped.append(tr.chop(tmin,tmax,inplace=False,snap=snap, include_last=include_last, share=share))
             except trace.NoData:
                 pass
 
+        if load_data:
+            self.data_cache.cleanup(keep=used_files)
+
         return chopped, used_files
 
     def _process_chopped(self, chopped, degap, maxgap, maxlap, want_incomplete, wmax, wmin, tpad):
@@ -910,8 +1886,40 @@ class Pile(TracesGroup):
         return chopped
             
     def chopper(self, tmin=None, tmax=None, tinc=None, tpad=0., group_selector=None, trace_selector=None,
-                      want_incomplete=True, degap=True, maxgap=5, maxlap=None, keep_current_files_open=False, accessor_id=None, snap=(round,round), include_last=False, load_data=True):
-        
+                      want_incomplete=True, degap=True, maxgap=5, maxlap=None, keep_current_files_open=False, accessor_id=None, snap=(round,round), include_last=False, load_data=True, nslc_ids=None, nprefetch=0, trace_filter=None, share=False):
+        '''Iterate over the pile in time windows, yielding lists of traces.
+
+        :param nprefetch: if greater than zero, the following windows are
+            loaded and cut in a background thread, while the caller works on
+            the current window. At most *nprefetch* windows are kept ready in
+            advance. The pile must not be modified while iterating in this
+            mode.
+        :param trace_filter: :py:class:`pyrocko.trace.ContinuousFilter` (or
+            other object with a ``process(trace)`` method returning a new
+            trace) applied to the traces of each window. With ``tpad=0``,
+            successive windows are filtered without edge effects at the
+            window boundaries.
+        :param share: if ``True``, the yielded traces hold read-only views
+            into the loaded data instead of copies (see :py:meth:`chop`)
+        '''
+
+        windows = self._chopper(tmin, tmax, tinc, tpad, group_selector, 
+                trace_selector, want_incomplete, degap, maxgap, maxlap, 
+                keep_current_files_open, accessor_id, snap, include_last, 
+                load_data, nslc_ids, share)
+
+        if nprefetch > 0:
+            windows = _prefetch(windows, nprefetch)
+
+        for processed in windows:
+            if trace_filter is not None:
+                processed = [ trace_filter.process(tr) for tr in processed ]
+
+            yield processed
+
+    def _get_windows(self, tmin, tmax, tinc, tpad, group_selector):
+        '''Get list of (wmin, wmax) tuples of the windows to iterate over.'''
+
         if tmin is None:
             tmin = self.tmin+tpad
                 
@@ -921,20 +1929,32 @@ class Pile(TracesGroup):
         if tinc is None:
             tinc = tmax-tmin
         
-        if not self.is_relevant(tmin-tpad,tmax+tpad,group_selector): return
+        if not self.is_relevant(tmin-tpad,tmax+tpad,group_selector): return []
+
+        windows = []
+        iwin = 0
+        eps = tinc*1e-6
+        while True:
+            wmin, wmax = tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax)
+            if wmin >= tmax-eps: break
+            windows.append((wmin, wmax))
+            iwin += 1
+
+        return windows
+
+    def _chopper(self, tmin, tmax, tinc, tpad, group_selector, trace_selector,
+                       want_incomplete, degap, maxgap, maxlap, keep_current_files_open, accessor_id, snap, include_last, load_data, nslc_ids, share):
+        
+        windows = self._get_windows(tmin, tmax, tinc, tpad, group_selector)
+        if not windows: return
                 
         if accessor_id not in self.open_files:
             self.open_files[accessor_id] = set()
                 
         open_files = self.open_files[accessor_id]
         
-        iwin = 0
-        while True:
-            chopped = []
-            wmin, wmax = tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax)
-            eps = tinc*1e-6
-            if wmin >= tmax-eps: break
-            chopped, used_files = self.chop(wmin-tpad, wmax+tpad, group_selector, trace_selector, snap, include_last, load_data) 
+        for wmin, wmax in windows:
+            chopped, used_files = self.chop(wmin-tpad, wmax+tpad, group_selector, trace_selector, snap, include_last, load_data, nslc_ids, share) 
             for file in used_files - open_files:
                 # increment datause counter on newly opened files
                 file.use_data()
@@ -950,8 +1970,6 @@ class Pile(TracesGroup):
                 file = unused_files.pop()
                 file.drop_data()
                 open_files.remove(file)
-                
-            iwin += 1
         
         if not keep_current_files_open:
             while open_files:
@@ -959,6 +1977,68 @@ class Pile(TracesGroup):
                 file.drop_data()
         
         
+    def map_windows(self, func, tmin=None, tmax=None, tinc=None, tpad=0., 
+                    nworkers=1, ordered=True, group_selector=None, 
+                    trace_selector=None, want_incomplete=True, degap=True, 
+                    maxgap=5, maxlap=None, snap=(round,round), 
+                    include_last=False, nslc_ids=None):
+
+        '''Apply a function to the traces of each time window.
+
+        The windows are the same as those :py:meth:`chopper` iterates over
+        and *func* is called with the list of traces it would yield.
+
+        :param func: function to be applied, called with a list of traces
+        :param nworkers: number of worker processes
+        :param ordered: if ``True``, yield results in window order, otherwise
+            in the order in which they are finished
+        :returns: iterator over the return values of *func*
+
+        With *nworkers* > 1, the windows are distributed over a pool of
+        processes, forked from the current one. The workers read the data
+        from the files themselves, only the results of *func* are sent back,
+        so these must be picklable. Neighbouring windows are preferentially
+        handed to the same worker, so that it can reuse loaded data.
+        '''
+
+        global _map_windows_state
+
+        windows = self._get_windows(tmin, tmax, tinc, tpad, group_selector)
+        state = (self, func, tpad, group_selector, trace_selector, 
+                 want_incomplete, degap, maxgap, maxlap, snap, include_last, 
+                 nslc_ids)
+
+        if nworkers <= 1 or len(windows) <= 1:
+            for wmin, wmax in windows:
+                yield _map_window_with(state, wmin, wmax)
+
+            return
+
+        import multiprocessing
+
+        # workers inherit the state when the pool is forked
+        _map_windows_state = state
+        try:
+            pool = multiprocessing.Pool(nworkers)
+        finally:
+            _map_windows_state = None
+
+        try:
+            chunksize = max(1, min(16, len(windows) / (nworkers*4)))
+            if ordered:
+                results = pool.imap(_map_window, windows, chunksize)
+            else:
+                results = pool.imap_unordered(_map_window, windows, chunksize)
+
+            for result in results:
+                yield result
+
+            pool.close()
+
+        finally:
+            pool.terminate()
+            pool.join()
+
     def all(self, *args, **kwargs):
         alltraces = []
         for traces in self.chopper( *args, **kwargs ):
@@ -1030,9 +2110,25 @@ class Pile(TracesGroup):
                 yield file
    
     def reload_modified(self):
+        '''Reload files which have been modified since they were loaded.
+
+        Files which have vanished are removed from the pile.
+
+        :returns: ``True`` if anything has changed
+        '''
+
         modified = False
-        for subpile in self.subpiles.values():
-            modified |= subpile.reload_modified()
+        vanished = []
+        for file in list(self.iter_files()):
+            try:
+                modified |= file.reload_if_modified()
+            except OSError, e:
+                logger.warn('removing file from pile: %s' % e)
+                vanished.append(file)
+
+        if vanished:
+            self.remove_files(vanished)
+            modified = True
         
         return modified
     
@@ -1074,9 +2170,30 @@ class Pile(TracesGroup):
         from pyrocko.snuffler import snuffle
         snuffle(self, **kwargs)
 
+_map_windows_state = None
+
+def _map_window_with(state, wmin, wmax):
+    (pile, func, tpad, group_selector, trace_selector, want_incomplete, degap, 
+        maxgap, maxlap, snap, include_last, nslc_ids) = state
+
+    chopped, used_files = pile.chop(wmin-tpad, wmax+tpad, group_selector, 
+            trace_selector, snap, include_last, True, nslc_ids)
+
+    processed = pile._process_chopped(chopped, degap, maxgap, maxlap, 
+            want_incomplete, wmax, wmin, tpad)
+
+    return func(processed)
+
+def _map_window(window):
+    '''Process a single window of Pile.map_windows (runs in worker processes).'''
+
+    wmin, wmax = window
+    return _map_window_with(_map_windows_state, wmin, wmax)
+
 def make_pile( paths=None, selector=None, regex=None,
         fileformat = 'mseed',
-        cachedirname=config.cache_dir, show_progress=True ):
+        cachedirname=config.cache_dir, show_progress=True, nworkers=1,
+        use_memmap=False, validation='stat', native_dtype=False ):
     
     '''Create pile from given file and directory names.
     
@@ -1091,6 +2208,17 @@ def make_pile( paths=None, selector=None, regex=None,
     :param cachedirname: loader cache is stored under this directory. It is
         created as neccessary.
     :param show_progress: show progress bar and other progress information
+    :param nworkers: number of worker processes used to scan the headers of
+        new or modified files
+    :param use_memmap: memory-map the sample data of the files instead of
+        reading it (see :py:func:`pyrocko.io.load`)
+    :param validation: how to check cached entries, ``'stat'``, 
+        ``'dirmtime'``, or ``'trusted'`` (see :py:meth:`Pile.load_files`).
+        With ``'dirmtime'`` and ``'trusted'``, directories are scanned with
+        :py:meth:`TracesFileCache.walk`, i.e. the listings of directories
+        which have not changed are taken from the cache.
+    :param native_dtype: keep the sample type found in the files instead of
+        converting to 8-byte floats (see :py:func:`pyrocko.io.load`)
     '''
     if isinstance(paths, str):
         paths = [ paths ]
@@ -1098,11 +2226,15 @@ def make_pile( paths=None, selector=None, regex=None,
     if paths is None:
         paths = sys.argv[1:]
     
-    fns = util.select_files(paths, selector, regex, show_progress=show_progress)
-
     cache = get_cache(cachedirname)
+    walk = None
+    if validation in ('dirmtime', 'trusted'):
+        walk = cache.walk
+
+    fns = util.select_files(paths, selector, regex, show_progress=show_progress, walk=walk)
+
     p = Pile()
-    p.load_files( sorted(fns), cache=cache, fileformat=fileformat, show_progress=show_progress)
+    p.load_files( sorted(fns), cache=cache, fileformat=fileformat, show_progress=show_progress, nworkers=nworkers, use_memmap=use_memmap, validation=validation, native_dtype=native_dtype)
     return p
 
 
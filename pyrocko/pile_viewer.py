@@ -99,8 +99,7 @@ class Integrator(pyrocko.shadow_pile.ShadowPile):
 
     def process(self, iblock, tmin, tmax, traces):
         for trace in traces:
-            trace.ydata -= trace.ydata.mean()
-            trace.ydata = num.cumsum(trace.ydata)
+            trace.set_ydata(num.cumsum(trace.ydata - trace.ydata.mean()))
         
         return traces
         
@@ -2401,7 +2400,8 @@ def MakePileViewerMainClass(base):
                                                     trace_selector=trace_selectorx,
                                                     accessor_id=id(self),
                                                     snap=(math.floor, math.ceil),
-                                                    include_last=True):
+                                                    include_last=True,
+                                                    share=True):
 
                         traces = self.pre_process_hooks(traces)
 
@@ -2468,7 +2468,7 @@ def MakePileViewerMainClass(base):
             chopped_traces = []
             for trace in processed_traces:
                 try:
-                    ctrace = trace.chop(tmin_-trace.deltat*4.,tmax_+trace.deltat*4., inplace=False, )
+                    ctrace = trace.chop(tmin_-trace.deltat*4.,tmax_+trace.deltat*4., inplace=False, share=True)
                 except pyrocko.trace.NoData:
                     continue
                     
@@ -2,12 +2,12 @@
 
 import trace
 
-import struct, sys, logging, math, time
+import struct, sys, os, logging, math, time
 from calendar import timegm
 from time import gmtime
 import numpy as num
 from util import reuse
-from io_common import FileLoadError
+from io_common import FileLoadError, native_byteorder
 
 logger = logging.getLogger('pyrocko.pile')
 
@@ -169,21 +169,25 @@ iqb2 iqbx iqmt ieq ieq1 ieq2 ime iex inu inc io_ il ir it iu
             logging.warn('This module has only been tested with SAC header version 6.'+
                          'This file has header version %i. It might still work though...' % self.nvhdr)
 
-    def read(self, filename, load_data=True, byte_sex='try'):
+    def read(self, filename, load_data=True, byte_sex='try', use_memmap=False, native_dtype=False):
         '''Read SAC file.
         
            filename -- Name of SAC file.
            load_data -- If True, the data is read, otherwise only read headers.
            byte_sex -- Endianness: 'try', 'little' or 'big' 
+           use_memmap -- If True, the data blocks are not read, but mapped
+                         into memory (copy-on-write) with the 4-byte float
+                         type and byte order found in the file.
+           native_dtype -- If True, the data blocks are kept as 4-byte
+                         floats (in native byte order) instead of being
+                         converted to 8-byte floats.
         '''
         nbh = SacFile.nbytes_header
         
-        # read in all data
+        # read header, data blocks are read directly into their arrays below
         f = open(filename,'rb')
-        if load_data:
-            filedata = f.read()
-        else:
-            filedata = f.read(nbh)
+        filedata = f.read(nbh)
+        filesize = os.fstat(f.fileno())[6]
         f.close()
             
         if len(filedata) < nbh:
@@ -233,18 +237,33 @@ iqb2 iqbx iqmt ieq ieq1 ieq2 ime iex inu inc io_ il ir it iu
             nblocks = self.ndatablocks()
             nbb = self.npts*4 # word length is always 4 bytes in sac files
             for iblock in range(nblocks):
-                if len(filedata) < nbh+(iblock+1)*nbb:
+                if filesize < nbh+(iblock+1)*nbb:
                     raise SacError('File is incomplete.')
                     
                 if sex == 'big':
                     dtype=num.dtype('>f4')
                 else:
                     dtype=num.dtype('<f4')
-                    
-                self.data.append(num.array(num.fromstring(filedata[nbh+iblock*nbb:nbh+(iblock+1)*nbb], dtype=dtype),dtype=num.float))
+                
+                if use_memmap and self.npts > 0:
+                    self.data.append(num.memmap(filename, dtype=dtype, mode='c', offset=nbh+iblock*nbb, shape=(self.npts,)))
+                elif use_memmap:
+                    self.data.append(num.zeros(0, dtype=dtype))
+                else:
+                    f = open(filename, 'rb')
+                    try:
+                        f.seek(nbh+iblock*nbb)
+                        data = native_byteorder(num.fromfile(f, dtype=dtype, count=self.npts))
+                    finally:
+                        f.close()
+
+                    if not native_dtype:
+                        data = data.astype(num.float)
+
+                    self.data.append(data)
             
-            if len(filedata) > nbh+nblocks*nbb:
-                logger.warn('Unused data (%i bytes) at end of SAC file: %s (npts=%i)' % (len(filedata) - nbh+nblocks*nbb, filename, self.npts))
+            if filesize > nbh+nblocks*nbb:
+                logger.warn('Unused data (%i bytes) at end of SAC file: %s (npts=%i)' % (filesize - nbh+nblocks*nbb, filename, self.npts))
                 
                 
             
@@ -281,8 +300,9 @@ iqb2 iqbx iqmt ieq ieq1 ieq2 ime iex inu inc io_ il ir it iu
         # dump data to file
         f = open(filename, 'wb')
         f.write(header_data)
+        dtype = num.dtype({'little': '<f4', 'big': '>f4'}[byte_sex])
         for fdata in self.data:
-            f.write(fdata.astype(num.float32).tostring())
+            f.write(fdata.astype(dtype).tostring())
         f.close()
         
     def __str__(self):
@@ -327,10 +347,10 @@ iqb2 iqbx iqmt ieq ieq1 ieq2 ime iex inu inc io_ il ir it iu
                                   data,
                                   meta=meta)
 
-def iload(filename, load_data=True):
+def iload(filename, load_data=True, use_memmap=False, native_dtype=False):
 
     try:
-        sacf = SacFile(filename, load_data=load_data)
+        sacf = SacFile(filename, load_data=load_data, use_memmap=use_memmap, native_dtype=native_dtype)
         tr = sacf.to_trace()
         yield tr
 
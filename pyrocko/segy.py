@@ -3,7 +3,7 @@ import numpy as num
 import util, trace
 import struct
 import calendar
-from io_common import FileLoadError
+from io_common import FileLoadError, native_byteorder
 
 class SEGYError(Exception):
     pass
@@ -33,11 +33,17 @@ class SEGYFile:
         self.b = 0.0
         self.data = [ num.arange(0, dtype=num.int32) ]
         
-    def read(self, filename, load_data=True, endianness='>'):
+    def read(self, filename, load_data=True, endianness='>', use_memmap=False, native_dtype=False):
         '''Read SEGY file.
         
            filename -- Name of SEGY file.
            load_data -- If True, the data is read, otherwise only read headers.
+           use_memmap -- If True, the file is mapped into memory (copy-on-write)
+                         instead of being read and the traces' data arrays 
+                         are views into the mapping.
+           native_dtype -- If True, the traces' data arrays are converted to
+                         native byte order in place, keeping the sample type
+                         (ignored when use_memmap is True).
         '''
         
         order = endianness
@@ -47,13 +53,26 @@ class SEGYFile:
         nbthx = SEGYFile.nbytes_optional_textual_header
         nbtrh = SEGYFile.nbytes_trace_header
         
-        # read in all data
-        f = open(filename,'rb')
-        
-        # XXX should skip volume label
-        
-        filedata = f.read()
-        f.close()
+        # map in all data or read headers and data blocks as needed
+        f = None
+        if use_memmap and load_data:
+            try:
+                filedata = num.memmap(filename, dtype=num.uint8, mode='c')
+            except ValueError, e:
+                raise SEGYError('Cannot map SEG-Y file %s: %s' % (filename, e))
+        else:
+            f = open(filename,'rb')
+            
+            # XXX should skip volume label
+            
+            filedata = f.read(nbth+nbbh)
+
+        def read_block(ipos, nbytes):
+            if f is None:
+                return filedata[ipos:ipos+nbytes]
+            else:
+                f.seek(ipos)
+                return f.read(nbytes)
         
         i = 0
         if True:
@@ -65,9 +84,9 @@ class SEGYFile:
         
             formats = { 1: (None,  4, "4-byte IBM floating-point"),
                     2: (order+'i4', 4, "4-byte, two's complement integer"),
-                    3: (order+'i4', 2, "2-byte, two's complement integer"),
+                    3: (order+'i2', 2, "2-byte, two's complement integer"),
                     4: (None,  4, "4-byte fixed-point with gain (obolete)"),
-                    5: ('f4',  4, "4-byte IEEE floating-point"),
+                    5: (order+'f4',  4, "4-byte IEEE floating-point"),
                     6: (None,  0, "not currently used"),
                     7: (None,  0, "not currently used"),
                     8: ('i1',  1, "1-byte, two's complement integer") }
@@ -88,7 +107,7 @@ class SEGYFile:
             dtype = order+'i4'  
         traces = []
         for itrace in xrange(ntraces+nauxtraces):
-            trace_header = filedata[ipos:ipos+nbtrh]
+            trace_header = read_block(ipos, nbtrh)
             if len(trace_header) != nbtrh:
                 raise SEGYError('SEG-Y file incomplete (file=%s)' % filename)
             
@@ -112,11 +131,18 @@ class SEGYFile:
                     raise SEGYError('Trace of incorrect length or sampling rate found in SEG-Y file (trace=%i, file=%s)' % (itrace+1, filename))
                 
             if load_data:
-                datablock = filedata[ipos+nbtrh:ipos+nbtrh+nsamples_this*sample_size]
-                if len(datablock) != nsamples_this*sample_size:
+                if use_memmap:
+                    datablock = filedata[ipos+nbtrh:ipos+nbtrh+nsamples_this*sample_size]
+                    data = datablock.view(dtype)
+                else:
+                    data = num.fromfile(f, dtype=dtype, count=nsamples_this)
+
+                if data.size != nsamples_this:
                     raise SEGYError('SEG-Y file incomplete (file=%s)' % filename)
-                
-                data = num.fromstring(datablock, dtype=dtype)
+
+                if native_dtype and not use_memmap:
+                    data = native_byteorder(data)
+
                 tmax = None
             else:
                 tmax = tmin + deltat_us_this/1000000.*(nsamples_this-1)
@@ -126,15 +152,18 @@ class SEGYFile:
             traces.append(tr)
             ipos += nbtrh+nsamples_this*sample_size
 
+        if f is not None:
+            f.close()
+
         self.traces = traces
         
     def get_traces(self):
         return self.traces
                            
 
-def iload(filename, load_data):
+def iload(filename, load_data, use_memmap=False, native_dtype=False):
     try:
-        segyf = SEGYFile(filename, load_data=load_data)
+        segyf = SEGYFile(filename, load_data=load_data, use_memmap=use_memmap, native_dtype=native_dtype)
         for tr in segyf.get_traces():
             yield tr
 
@@ -5,7 +5,7 @@ import numpy as num
 from pyrocko.util import unpack_fixed
 
 from pyrocko import util, trace
-from io_common import FileLoadError
+from io_common import FileLoadError, native_byteorder
 
 class SeisanFileError(Exception):
     pass
@@ -71,20 +71,34 @@ def read_channel_header(f, npad=4):
     
     return (net, sta, loc, cha, tmin, tflag, deltat, nsamples, sample_bytes, lat, lon, elevation, gain)
 
-def read_channel_data(f, endianness, sample_bytes, nsamples, gain, load_data=True, npad=4):
+def read_channel_data(f, endianness, sample_bytes, nsamples, gain, load_data=True, npad=4, use_memmap=False, native_dtype=False):
     if not load_data:
         f.seek( sample_bytes*nsamples + 2*npad, 1 )
         return None
 
+    elif use_memmap and gain == 1 and nsamples > 0:
+        # samples can be used as they are on disk, map them (copy-on-write)
+        offset = f.tell() + npad
+        try:
+            data = num.memmap(f, dtype=num.dtype(endianness+'i'+str(sample_bytes)), mode='c', offset=offset, shape=(nsamples,))
+        except ValueError, e:
+            raise SeisanFileError('Cannot map channel data: %s' % e)
+
+        f.seek( offset + sample_bytes*nsamples + npad )
+        return data
+
     else:
         f.read(npad)
         data = num.fromfile(f, dtype=num.dtype(endianness+'i'+str(sample_bytes)), count=nsamples)
         f.read(npad)
+        if native_dtype:
+            data = native_byteorder(data)
+
         data *= gain
         return data
 
 
-def iload(filename, load_data=True, subformat='l4'):
+def iload(filename, load_data=True, subformat='l4', use_memmap=False, native_dtype=False):
    
     try:
         if subformat is not None:
@@ -112,7 +126,7 @@ def iload(filename, load_data=True, subformat='l4'):
                     (net, sta, loc, cha, tmin, tflag, deltat, nsamples,
                             sample_bytes, lat, lon, elevation, gain) = read_channel_header(f, npad=npad)
                     
-                    data = read_channel_data(f, endianness, sample_bytes, nsamples, gain, load_data, npad=npad)
+                    data = read_channel_data(f, endianness, sample_bytes, nsamples, gain, load_data, npad=npad, use_memmap=use_memmap, native_dtype=native_dtype)
                     tmax = None
                     if data is None:
                         tmax = tmin + (nsamples-1)*deltat
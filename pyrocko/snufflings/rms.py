@@ -54,7 +54,7 @@ class RootMeanSquareSnuffling(Snuffling):
                 i = int(round((tr.tmin - tmin)/tinc))
                 if 0 <= i and i < n:
                     tr.ydata = num.asarray(tr.ydata, num.float)
-                    tr.ydata -= num.mean(tr.ydata)
+                    tr.ydata = tr.ydata - num.mean(tr.ydata)
                     value = num.sqrt(num.sum(tr.ydata**2)/tr.ydata.size)
 
                     rms_by_nslc[tr.nslc_id].ydata[i] = value
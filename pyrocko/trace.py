@@ -4,7 +4,7 @@
 '''
 
 import util, evalresp
-import time, math, copy, logging, sys
+import time, math, copy, logging, sys, os, calendar, fnmatch, fractions
 import numpy as num
 from util import reuse, hpfloat
 from scipy import signal
@@ -39,7 +39,7 @@ class Trace(object):
     are silently truncated when the trace is stored
     '''
 
-    cached_frequencies = {}
+    cached_frequencies = util.LRUCache(64, nbytes_max=64*1024*1024)
         
     def __init__(self, network='', station='STA', location='', channel='', 
                  tmin=0., tmax=None, deltat=1., ydata=None, mtime=None, meta=None):
@@ -151,6 +151,7 @@ class Trace(object):
         match.
         '''
         
+        self.make_writeable()
         if interpolate:
             assert self.deltat <= other.deltat or same_sampling_rate(self,other)
             other_xdata = other.get_xdata()
@@ -177,6 +178,7 @@ class Trace(object):
         match.
         '''
 
+        self.make_writeable()
         if interpolate:
             assert self.deltat <= other.deltat or same_sampling_rate(self,other)
             other_xdata = other.get_xdata()
@@ -295,6 +297,21 @@ class Trace(object):
         '''Detach the traces grow buffer.'''
         self._growbuffer = None
 
+    def make_writeable(self):
+        '''Make sure the data array can be modified in place.
+
+        Data of traces returned by :py:meth:`chop` with ``share=True`` is
+        shared with the original trace and read-only. This method replaces
+        the data with a private copy, if needed. Methods of
+        :py:class:`Trace` which modify the data in place call it
+        automatically.
+        '''
+
+        if self.ydata is not None and not self.ydata.flags.writeable:
+            self.drop_growbuffer()
+            self.ydata = num.array(self.ydata, 
+                                   dtype=self.ydata.dtype.newbyteorder('='))
+
     def copy(self, data=True):
         '''Make a deep copy of the trace.'''
         tracecopy = copy.copy(self)
@@ -338,7 +355,7 @@ class Trace(object):
         self.ydata = self._growbuffer[:newlen]
         self.tmax = self.tmin + (newlen-1)*self.deltat
         
-    def chop(self, tmin, tmax, inplace=True, include_last=False, snap=(round,round), want_incomplete=True):
+    def chop(self, tmin, tmax, inplace=True, include_last=False, snap=(round,round), want_incomplete=True, share=False):
         '''Cut the trace to given time span.
 
         If the *inplace* argument is True (the default) the trace is cut in
@@ -355,6 +372,13 @@ class Trace(object):
         :py:exc:`NoData` exception is raised. This exception is always
         raised, when the requested time span does dot overlap with the trace's
         time span.
+
+        With *inplace* set to False and *share* set to True, the data of the
+        new trace is a read-only view into the data of the original trace, no
+        samples are copied. Methods of the new trace modifying the data in
+        place copy it first (see :py:meth:`make_writeable`). The original
+        trace is not affected, but changes to its data show through in the
+        new trace. Data in non-native byte order is always copied.
         '''
         
         if want_incomplete:
@@ -377,7 +401,16 @@ class Trace(object):
        
         self.drop_growbuffer()
         if self.ydata is not None:
-            obj.ydata = self.ydata[ibeg:iend].copy()
+            if not inplace and share and self.ydata.dtype.isnative:
+                # share the samples, protecting them from in-place
+                # modifications through the new trace
+                obj.ydata = self.ydata[ibeg:iend]
+                obj.ydata.flags.writeable = False
+            else:
+                # copy to a plain in-memory array in native byte order, also
+                # when the data is memory-mapped from a file
+                obj.ydata = num.array(self.ydata[ibeg:iend], 
+                                      dtype=self.ydata.dtype.newbyteorder('='))
         else:
             obj.ydata = None
         
@@ -403,11 +436,17 @@ class Trace(object):
         if snap:
             ilag = (math.ceil(self.tmin / newdeltat) * newdeltat - self.tmin)/self.deltat
             
+        # single precision data is filtered in single precision
+        if self.ydata.dtype == num.float32:
+            dtype = num.float32
+        else:
+            dtype = num.float64
+
         if snap and ilag > 0 and ilag < self.ydata.size:
-            data = self.ydata.astype(num.float64)
+            data = self.ydata.astype(dtype)
             self.tmin += ilag*self.deltat
         else:
-            data = self.ydata.astype(num.float64)
+            data = self.ydata.astype(dtype)
         
         if demean:
             data -= num.mean(data)
@@ -493,6 +532,36 @@ class Trace(object):
         self.deltat = deltat2
         self.set_ydata(data2)
 
+    def resample_rational(self, deltat, nmax=1000):
+        '''Resample to a new sampling interval with a polyphase FIR filter.
+
+        :param deltat: new sampling interval
+        :param nmax: maximum up- and downsampling factor
+
+        The ratio of old and new sampling interval must be a fraction with
+        numerator and denominator not larger than *nmax* (e.g. 100 Hz to 128
+        Hz is 32/25), otherwise :py:exc:`ResamplingFailed` is raised. Output
+        samples are placed at even multiples of the new sampling interval,
+        as close as possible. See :py:class:`ContinuousResampler` for
+        resampling of data split into successive traces.
+        '''
+
+        resampler = ContinuousResampler(deltat, nmax=nmax)
+        up, down = resampler.factors(self.deltat)
+        tmax = self.tmax
+
+        # pad with zeros, so that the filter delay is flushed out
+        npad = resampler.coefficients(self.deltat).size // up + 1
+        padded = self.copy(data=False)
+        padded.set_ydata(num.concatenate((self.get_ydata(), 
+            num.zeros(npad, dtype=self.get_ydata().dtype))))
+
+        resampled = resampler.process(padded)
+        self.deltat = resampled.deltat
+        self.tmin = resampled.tmin
+        n = int(math.floor((tmax - resampled.tmin)/deltat + 1e-6)) + 1
+        self.set_ydata(resampled.get_ydata()[:max(0, n)])
+
     def resample_simple(self, deltat):
         tyear = 3600*24*365.
 
@@ -567,16 +636,16 @@ class Trace(object):
 
         Mean is removed before filtering.
         '''
-        self.nyquist_check(corner, 'Corner frequency of lowpass', nyquist_warn, nyquist_exception)
-        (b,a) = _get_cached_filter_coefs(order, [corner*2.0*self.deltat], btype='low')
-        if len(a) != order+1 or len(b) != order+1:
-            logger.warn('Erroneous filter coefficients returned by scipy.signal.butter(). You may need to downsample the signal before filtering.')
 
-        data = self.ydata.astype(num.float64)
-        if demean:
-            data -= num.mean(data)
+        data = self._lowpass(self.ydata.astype(num.float64), order, corner, nyquist_warn, nyquist_exception, demean)
         self.drop_growbuffer()
-        self.ydata = signal.lfilter(b,a, data)
+        self.ydata = data
+
+    def _lowpass(self, data, order, corner, nyquist_warn=True, nyquist_exception=False, demean=True):
+        self.nyquist_check(corner, 'Corner frequency of lowpass', nyquist_warn, nyquist_exception)
+        if demean:
+            _demean(data)
+        return _butter_filter(order, [corner*2.0*self.deltat], 'low', data)
         
     def highpass(self, order, corner, nyquist_warn=True, nyquist_exception=False, demean=True):
         '''Apply butterworth highpass to the trace.
@@ -587,15 +656,15 @@ class Trace(object):
         Mean is removed before filtering.
         '''
 
+        data = self._highpass(self.ydata.astype(num.float64), order, corner, nyquist_warn, nyquist_exception, demean)
+        self.drop_growbuffer()
+        self.ydata = data
+
+    def _highpass(self, data, order, corner, nyquist_warn=True, nyquist_exception=False, demean=True):
         self.nyquist_check(corner, 'Corner frequency of highpass', nyquist_warn, nyquist_exception)
-        (b,a) = _get_cached_filter_coefs(order, [corner*2.0*self.deltat], btype='high')
-        data = self.ydata.astype(num.float64)
-        if len(a) != order+1 or len(b) != order+1:
-            logger.warn('Erroneous filter coefficients returned by scipy.signal.butter(). You may need to downsample the signal before filtering.')
         if demean:
-            data -= num.mean(data)
-        self.drop_growbuffer()
-        self.ydata = signal.lfilter(b,a, data)
+            _demean(data)
+        return _butter_filter(order, [corner*2.0*self.deltat], 'high', data)
         
     def bandpass(self, order, corner_hp, corner_lp, demean=True):
         '''Apply butterworth bandpass to the trace.
@@ -607,14 +676,16 @@ class Trace(object):
         Mean is removed before filtering.
         '''
 
+        data = self._bandpass(self.ydata.astype(num.float64), order, corner_hp, corner_lp, demean)
+        self.drop_growbuffer()
+        self.ydata = data
+
+    def _bandpass(self, data, order, corner_hp, corner_lp, demean=True):
         self.nyquist_check(corner_hp, 'Lower corner frequency of bandpass')
         self.nyquist_check(corner_lp, 'Higher corner frequency of bandpass')
-        (b,a) = _get_cached_filter_coefs(order, [corner*2.0*self.deltat for corner in (corner_hp, corner_lp)], btype='band')
-        data = self.ydata.astype(num.float64)
         if demean:
-            data -= num.mean(data)
-        self.drop_growbuffer()
-        self.ydata = signal.lfilter(b,a, data)
+            _demean(data)
+        return _butter_filter(order, [corner*2.0*self.deltat for corner in (corner_hp, corner_lp)], 'band', data)
     
     def abshilbert(self):
         self.drop_growbuffer()
@@ -625,6 +696,7 @@ class Trace(object):
         self.ydata = num.sqrt(self.ydata**2 + hilbert(self.ydata)**2)
 
     def taper(self, taperer):
+        self.make_writeable()
         taperer(self.ydata, self.tmin, self.deltat)
     
     def whiten(self, order=6):
@@ -716,24 +788,30 @@ class Trace(object):
 
     def _get_cached_freqs(self, nf, deltaf):
         ck = (nf, deltaf)
-        if ck not in Trace.cached_frequencies:
-            Trace.cached_frequencies[ck] = num.arange(nf, dtype=num.float)*deltaf
-        return Trace.cached_frequencies[ck]
+        freqs = Trace.cached_frequencies.get(ck)
+        if freqs is None:
+            freqs = num.arange(nf, dtype=num.float)*deltaf
+            freqs.flags.writeable = False
+            Trace.cached_frequencies.put(ck, freqs)
+
+        return freqs
         
     def bandpass_fft(self, corner_hp, corner_lp):
         '''Apply boxcar bandbpass to trace (in spectral domain).'''
 
-        n = len(self.ydata)
-        n2 = nextpow2(n)
-        data = num.zeros(n2, dtype=num.float64)
-        data[:n] = self.ydata
-        fdata = num.fft.rfft(data)
-        freqs = self._get_cached_freqs(len(fdata), 1./(self.deltat*n2))
-        fdata[0] = 0.0
+        data = self._bandpass_fft(self.ydata.astype(num.float64), corner_hp, corner_lp)
+        self.drop_growbuffer()
+        self.ydata = data
+
+    def _bandpass_fft(self, data, corner_hp, corner_lp):
+        n = data.shape[-1]
+        n2 = nextsmooth(n)
+        fdata = num.fft.rfft(data, n2)
+        freqs = self._get_cached_freqs(fdata.shape[-1], 1./(self.deltat*n2))
+        fdata[...,0] = 0.0
         fdata *= num.logical_and(corner_hp < freqs, freqs < corner_lp)
         data = num.fft.irfft(fdata)
-        self.drop_growbuffer()
-        self.ydata = data[:n]
+        return data[...,:n]
         
     def shift(self, tshift):
         '''Time shift the trace.'''
@@ -817,7 +895,7 @@ class Trace(object):
         
         for itrig_pos in itrig_positions:
             ibeg = itrig_pos
-            iend = min(len(self.ydata), itrig_pos + tsearch/self.deltat)
+            iend = min(len(self.ydata), itrig_pos + int(tsearch/self.deltat))
             ipeak = num.argmax(y[ibeg:iend])
             tpeak = self.tmin + (ipeak+ibeg)*self.deltat
             apeak = y[ibeg+ipeak]
@@ -902,8 +980,8 @@ class Trace(object):
             raise TraceTooShort('Trace %s.%s.%s.%s too short for fading length setting. trace length = %g, fading length = %g' % (self.nslc_id + (self.tmax-self.tmin, tfade)))
 
         ndata = self.ydata.size
-        ntrans = nextpow2(ndata*1.2)
-        coefs = self._get_tapered_coefs(ntrans, freqlimits, transfer_function)
+        ntrans = nextsmooth(int(math.ceil(ndata*1.2)))
+        coefs = self._get_cached_tapered_coefs(ntrans, freqlimits, transfer_function)
         
         data = self.ydata
         data_pad = num.zeros(ntrans, dtype=num.float)
@@ -990,6 +1068,22 @@ class Trace(object):
 
         return centroid_freqs, signal_tf
         
+    cached_tapered_coefs = util.LRUCache(256, nbytes_max=256*1024*1024)
+
+    def _get_cached_tapered_coefs(self, ntrans, freqlimits, transfer_function):
+        key = transfer_function.cache_key()
+        if key is None:
+            return self._get_tapered_coefs(ntrans, freqlimits, transfer_function)
+
+        ck = (ntrans, self.deltat, tuple(freqlimits), key)
+        coefs = Trace.cached_tapered_coefs.get(ck)
+        if coefs is None:
+            coefs = self._get_tapered_coefs(ntrans, freqlimits, transfer_function)
+            coefs.flags.writeable = False
+            Trace.cached_tapered_coefs.put(ck, coefs)
+
+        return coefs
+
     def _get_tapered_coefs(self, ntrans, freqlimits, transfer_function):
     
         deltaf = 1./(self.deltat*ntrans)
@@ -1174,84 +1268,193 @@ def degapper(traces, maxgap=5, fillmethod='interpolate', deoverlap='use_second',
     :param maxlap:      maximum number of samples of overlap which are removed
       
     :returns:           list of traces
+
+    The first trace of each connected run is modified in place and returned;
+    the data of a run is allocated once and filled in a single pass.
     '''
 
-    in_traces = traces 
     out_traces = []
-    if not in_traces: return out_traces
-    out_traces.append(in_traces.pop(0))
-    while in_traces:
-        
-        a = out_traces[-1]
-        b = in_traces.pop(0)
-        
-        avirt, bvirt = a.ydata is None, b.ydata is None
-        assert avirt == bvirt, 'traces given to degapper() must either all have data or have no data.'
-        virtual = avirt and bvirt
+    if not traces: return out_traces
+
+    virtual = traces[0].ydata is None
+    groups = []
+    gkey = None
+    for tr in traces:
+        ydata = tr.ydata
+        assert (ydata is None) == virtual, 'traces given to degapper() must either all have data or have no data.'
+        if virtual:
+            n = tr.data_len()
+            key = (tr.nslc_id, tr.deltat)
+        else:
+            n = ydata.size
+            key = (tr.nslc_id, tr.deltat, ydata.dtype.str)
 
-        if (a.nslc_id == b.nslc_id and a.deltat == b.deltat and 
-            a.data_len() >= 1 and b.data_len() >= 1 and 
-            (virtual or a.ydata.dtype == b.ydata.dtype)):
-            
-            dist = (b.tmin-(a.tmin+(a.data_len()-1)*a.deltat))/a.deltat
-            idist = int(round(dist))
-            if abs(dist - idist) > 0.05 and idist <= maxgap:
-                pass #logger.warn('Cannot degap traces with displaced sampling (%s,%s,%s,%s)' % a.nslc_id)
-            else:
-                if 1 < idist <= maxgap:
-                    if not virtual:
-                        if fillmethod == 'interpolate':
-                            filler = a.ydata[-1] + (((1.+num.arange(idist-1,dtype=num.float))/idist)*(b.ydata[0]-a.ydata[-1])).astype(a.ydata.dtype)
-                        elif fillmethod == 'zeros':
-                            filler = num.zeros(idist-1,dtype=a.ydist.dtype)
-                        a.ydata = num.concatenate((a.ydata,filler,b.ydata))
-                    a.tmax = b.tmax
-                    if a.mtime and b.mtime:
-                        a.mtime = max(a.mtime, b.mtime)
-                    continue
+        if n < 1:
+            if not groups:
+                groups.append(([tr], [n]))
+                gkey = None
 
-                elif idist == 1:
-                    if not virtual:
-                        a.ydata = num.concatenate((a.ydata,b.ydata))
-                    a.tmax = b.tmax
-                    if a.mtime and b.mtime:
-                        a.mtime = max(a.mtime, b.mtime)
-                    continue
-                    
-                elif idist <= 0 and (maxlap is None or -maxlap < idist):
-                    if b.tmax > a.tmax:
-                        if not virtual:
-                            na = a.ydata.size
-                            n = -idist+1
-                            if deoverlap == 'use_second':
-                                a.ydata = num.concatenate((a.ydata[:-n], b.ydata))
-                            elif deoverlap in ('use_first', 'crossfade_cos'):
-                                a.ydata = num.concatenate((a.ydata, b.ydata[n:]))
-                            else:
-                                assert False, 'unknown deoverlap method'
-
-                            if deoverlap == 'crossfade_cos':
-                                n = -idist+1
-                                taper = 0.5-0.5*num.cos((1.+num.arange(n))/(1.+n)*num.pi)
-                                a.ydata[na-n:na] *= 1.-taper
-                                a.ydata[na-n:na] += b.ydata[:n] * taper
-
-                        a.tmax = b.tmax
-                        if a.mtime and b.mtime:
-                            a.mtime = max(a.mtime, b.mtime)
-                        continue
-                    else:
-                        # make short second trace vanish
-                        continue
-                    
-        if b.data_len() >= 1:
-            out_traces.append(b)
+            continue
+
+        if key != gkey:
+            group = ([], [])
+            groups.append(group)
+            gkey = key
+
+        group[0].append(tr)
+        group[1].append(n)
+
+    for group_traces, group_lens in groups:
+        if len(group_traces) == 1:
+            out_traces.append(group_traces[0])
+            continue
+
+        for run in _degapper_runs(group_traces, group_lens, maxgap, maxlap):
+            out_traces.append(_degapper_merge(run, fillmethod, deoverlap))
             
     for tr in out_traces:
         tr._update_ids()
     
     return out_traces
 
+def _degapper_runs(traces, lens, maxgap, maxlap):
+    '''Split compatible traces into runs which can be connected.
+
+    Returns list of runs, each a tuple (traces, isamples, idists), where
+    isamples are the sample offsets of the traces relative to the first trace
+    of the run and idists their distances in samples to the end of the data
+    accumulated so far. Traces completely covered by their predecessors are
+    dropped.
+    '''
+
+    n = len(traces)
+    deltat = traces[0].deltat
+    tmins = num.array([ tr.tmin for tr in traces ], dtype=num.float)
+    tmaxs = num.array([ tr.tmax for tr in traces ], dtype=num.float)
+    lens = num.array(lens, dtype=num.int64)
+
+    runs = []
+    nwin = 16
+    i = 0
+    while i < n:
+        t0 = tmins[i]
+        iend = lens[i] - 1
+        tend = tmaxs[i]
+        members, isamples, idists = [ i ], [ 0 ], [ 0 ]
+        i += 1
+        while i < n:
+            j = min(n, i+nwin)
+            g = (tmins[i:j] - t0)/deltat
+            k = num.round(g).astype(num.int64)
+            e = k + lens[i:j] - 1
+
+            # end of accumulated data before each trace
+            iprev = num.empty(j-i, dtype=num.int64)
+            iprev[0] = iend
+            iprev[1:] = num.maximum.accumulate(e)[:-1]
+            num.maximum(iprev, iend, iprev)
+            tprev = num.empty(j-i, dtype=num.float)
+            tprev[0] = tend
+            tprev[1:] = num.maximum.accumulate(tmaxs[i:j])[:-1]
+            num.maximum(tprev, tend, tprev)
+
+            idist = k - iprev
+            overlap = idist <= 0
+            brk = num.logical_and(num.abs(g-k) > 0.05, idist <= maxgap)
+            brk |= num.logical_and(idist > maxgap, idist != 1)
+            brk |= k < 0
+            if maxlap is not None:
+                brk |= num.logical_and(overlap, idist <= -maxlap)
+
+            vanish = num.logical_and(overlap, tmaxs[i:j] <= tprev)
+
+            ibrk = num.nonzero(brk)[0]
+            if ibrk.size:
+                m = ibrk[0]
+            else:
+                m = j-i
+
+            isel = num.nonzero(~vanish[:m])[0]
+            members.extend((isel + i).tolist())
+            isamples.extend(k[isel].tolist())
+            idists.extend(idist[isel].tolist())
+
+            if m > 0:
+                iend = max(iend, e[:m].max())
+                tend = max(tend, tmaxs[i:i+m].max())
+
+            i += m
+            if ibrk.size:
+                nwin = 16
+                break
+
+            nwin = min(nwin*2, 65536)
+
+        runs.append(([ traces[imember] for imember in members ], isamples, 
+                     idists))
+
+    return runs
+
+def _degapper_merge(run, fillmethod, deoverlap):
+    traces, isamples, idists = run
+    a = traces[0]
+    if len(traces) == 1:
+        return a
+
+    if a.mtime:
+        a.mtime = max([ a.mtime ] + [ tr.mtime for tr in traces if tr.mtime ])
+
+    if a.ydata is not None:
+        if all(idist == 1 for idist in idists[1:]):
+            a.ydata = num.concatenate([ tr.ydata for tr in traces ])
+        else:
+            a.ydata = _degapper_merge_data(run, fillmethod, deoverlap)
+
+    a.tmax = traces[-1].tmax
+    return a
+
+def _degapper_merge_data(run, fillmethod, deoverlap):
+    traces, isamples, idists = run
+    a = traces[0]
+    nmax = max( isample + tr.ydata.size 
+                for (tr, isample) in zip(traces, isamples) )
+
+    ydata = num.empty(nmax, dtype=a.ydata.dtype)
+    n = a.ydata.size
+    ydata[:n] = a.ydata
+
+    for (b, isample, idist) in zip(traces[1:], isamples[1:], idists[1:]):
+        y = b.ydata
+        nb = y.size
+        if idist >= 1:
+            if idist > 1:
+                if fillmethod == 'interpolate':
+                    ydata[n:isample] = ydata[n-1] + (((1.+num.arange(idist-1,dtype=num.float))/idist)*(y[0]-ydata[n-1])).astype(ydata.dtype)
+                elif fillmethod == 'zeros':
+                    ydata[n:isample] = 0
+                else:
+                    assert False, 'unknown fillmethod'
+
+            ydata[isample:isample+nb] = y
+
+        else:
+            nlap = n - isample
+            if deoverlap == 'use_second':
+                ydata[isample:isample+nb] = y
+            elif deoverlap in ('use_first', 'crossfade_cos'):
+                ydata[n:isample+nb] = y[nlap:]
+            else:
+                assert False, 'unknown deoverlap method'
+
+            if deoverlap == 'crossfade_cos':
+                taper = 0.5-0.5*num.cos((1.+num.arange(nlap))/(1.+nlap)*num.pi)
+                ydata[isample:n] *= 1.-taper
+                ydata[isample:n] += y[:nlap] * taper
+
+        n = isample + nb
+
+    return ydata[:n]
+
 def rotate(traces, azimuth, in_channels, out_channels):
     '''2D rotation of traces.
     
@@ -1609,6 +1812,194 @@ def correlate(a, b, mode='valid', normalization=None, use_fft=False):
 
     return c
 
+def correlate_many(templates, traces, normalization=None, stack=False, nworkers=1):
+    '''Cross correlate many templates with many continuous traces.
+
+    :param templates: list of templates, each a list of traces (e.g. the
+        channels of a template event)
+    :param traces: list of continuous traces
+    :param normalization: ``'normal'``, ``'gliding'``, or ``None``
+    :param stack: whether to stack the correlations of each template across 
+        its channels
+    :param nworkers: number of worker processes to use
+
+    :returns: list with one entry per template: a list of traces containing
+        the cross correlation coefficients for each pair of template trace and
+        continuous trace or, if *stack* is ``True``, a single trace with the
+        stacked coefficients or ``None``
+
+    Each template trace is correlated with all continuous traces having the
+    same network, station, location and channel codes and sampling rate. The
+    results are the same as those of ``correlate(template_trace, trace,
+    mode='valid', normalization=normalization)``, but the spectrum of each
+    continuous trace is computed only once for all templates and the gliding
+    normalization uses running sums. Pairs where the template is longer than
+    the continuous trace are skipped.
+
+    When stacking, the correlation traces of a template are summed on the
+    time lag axis and divided by the number of channels of the template, so
+    that missing channels contribute zeros. The codes of the stacked trace
+    are those shared by all channels of the template.
+
+    Example::
+
+        for traces in p.chopper(tinc=3600., tpad=tmax_template):
+            for c in correlate_many(templates, traces, 'gliding', stack=True):
+                if c is not None:
+                    t, coef = c.max()
+    '''
+
+    global _correlate_many_state
+
+    template_traces = []
+    itemplates = []
+    for itemplate, template in enumerate(templates):
+        for tr in template:
+            template_traces.append(tr)
+            itemplates.append(itemplate)
+
+    by_codes = {}
+    for itr, tr in enumerate(template_traces):
+        by_codes.setdefault(tr.nslc_id, []).append(itr)
+
+    jobs = []
+    for itrace, tr in enumerate(traces):
+        itrs = [ itr for itr in by_codes.get(tr.nslc_id, []) 
+                 if same_sampling_rate(tr, template_traces[itr]) and 
+                    template_traces[itr].data_len() <= tr.data_len() ]
+
+        if itrs:
+            jobs.append((itrace, itrs))
+
+    state = (template_traces, traces, normalization)
+    if nworkers <= 1 or len(jobs) <= 1:
+        results = [ _correlate_many_with(state, job) for job in jobs ]
+
+    else:
+        import multiprocessing
+
+        # workers inherit the traces when the pool is forked
+        _correlate_many_state = state
+        try:
+            pool = multiprocessing.Pool(nworkers)
+        finally:
+            _correlate_many_state = None
+
+        try:
+            chunksize = max(1, min(16, len(jobs) / (nworkers*4)))
+            results = pool.map(_correlate_many_job, jobs, chunksize)
+            pool.close()
+
+        finally:
+            pool.terminate()
+            pool.join()
+
+    correlations = [ [] for template in templates ]
+    for (itrace, itrs), ycs in zip(jobs, results):
+        b = traces[itrace]
+        for itr, yc in zip(itrs, ycs):
+            a = template_traces[itr]
+            c = a.copy(data=False)
+            c.set_ydata(yc)
+            c.set_codes(*merge_codes(a,b,'~'))
+            c.shift(-c.tmin + b.tmin-a.tmin)
+            correlations[itemplates[itr]].append(c)
+
+    if stack:
+        return [ _stack_correlations(cs, len(template)) 
+                 for (cs, template) in zip(correlations, templates) ]
+
+    else:
+        return correlations
+
+_correlate_many_state = None
+
+def _correlate_many_job(job):
+    '''Correlate one continuous trace with its templates (runs in worker processes).'''
+
+    return _correlate_many_with(_correlate_many_state, job)
+
+def _correlate_many_with(state, job):
+    template_traces, traces, normalization = state
+    itrace, itrs = job
+
+    yas = [ template_traces[itr].get_ydata().astype(num.float64) 
+            for itr in itrs ]
+    yb = traces[itrace].get_ydata().astype(num.float64)
+    nb = yb.size
+    namax = max( ya.size for ya in yas )
+    namin = min( ya.size for ya in yas )
+
+    # overlap-save: spectra of overlapping blocks of the continuous trace are
+    # computed once and used for all templates
+    nfft = min(nextsmooth(max(8*namax, 256)), nextsmooth(nb))
+    nstep = nfft - namax + 1
+    nblocks = (nb - namin) / nstep + 1
+    ybp = num.zeros((nblocks-1)*nstep + nfft)
+    ybp[:nb] = yb
+    blocks = num.lib.stride_tricks.as_strided(ybp, 
+        shape=(nblocks, nfft), strides=(nstep*ybp.itemsize, ybp.itemsize))
+
+    fb = num.fft.rfft(blocks, nfft, axis=1)
+
+    if normalization == 'gliding':
+        csum = num.zeros(nb+1)
+        num.cumsum(yb**2, out=csum[1:])
+        movsums = {}
+
+    elif normalization == 'normal':
+        normfac_long = num.sqrt(num.sum(yb**2))
+
+    ycs = []
+    for ya in yas:
+        na = ya.size
+        fa = num.conj(num.fft.rfft(ya, nfft))
+        c = num.fft.irfft(fb * fa, nfft, axis=1)
+        yc = c[:,:nstep].ravel()[:nb-na+1]
+        if normalization == 'normal':
+            yc /= num.sqrt(num.sum(ya**2)) * normfac_long
+
+        elif normalization == 'gliding':
+            if na not in movsums:
+                movsums[na] = num.sqrt(num.maximum(
+                    csum[na:] - csum[:-na], 0.0))
+
+            epsilon = 0.00001
+            normfac_short = num.sqrt(num.sum(ya**2))
+            yc /= normfac_short * movsums[na] + normfac_short*epsilon
+
+        ycs.append(yc)
+
+    return ycs
+
+def _stack_correlations(correlations, nchannels):
+    if not correlations:
+        return None
+
+    deltat = correlations[0].deltat
+    tmin = min( c.tmin for c in correlations )
+    ioffs = [ int(round((c.tmin - tmin)/deltat)) for c in correlations ]
+    ydata = num.zeros(max( ioff + c.data_len() 
+                           for (ioff, c) in zip(ioffs, correlations) ))
+
+    for ioff, c in zip(ioffs, correlations):
+        ydata[ioff:ioff+c.data_len()] += c.ydata
+
+    ydata /= nchannels
+
+    codes = []
+    for xs in zip(*[ c.nslc_id for c in correlations ]):
+        if all(x == xs[0] for x in xs):
+            codes.append(xs[0])
+        else:
+            codes.append('')
+
+    stacked = correlations[0].copy(data=False)
+    stacked.set_codes(*codes)
+    stacked.set_ydata(ydata)
+    stacked.shift(tmin - stacked.tmin)
+    return stacked
+
 def deconvolve(a, b, waterlevel, tshift=0., pad=0.5, fd_taper=None, pad_to_pow2=True):
     
     same_sampling_rate(a,b)
@@ -1715,7 +2106,83 @@ class FrequencyResponse(object):
     def evaluate(self, freqs):
         coefs = num.ones(freqs.size, dtype=num.complex)
         return coefs
+
+    def cache_key(self):
+        '''Get hashable key identifying the response or ``None``.
+
+        Responses with equal keys must evaluate to the same values. The key
+        is used to cache evaluated coefficients in :py:meth:`Trace.transfer`.
+        Subclasses which do not override this method are not cached.
+        '''
+
+        if type(self) is FrequencyResponse:
+            return ('FrequencyResponse',)
+
+        return None
    
+def _resp_time(s):
+    '''Convert RESP file date string ``YYYY,DDD[,HH:MM:SS[.FFFF]]``.'''
+
+    if s.lower().startswith('no ending'):
+        return None
+
+    toks = s.split(',')
+    t = calendar.timegm((int(toks[0]), 1, 1, 0, 0, 0)) + (int(toks[1])-1)*86400.
+    if len(toks) > 2 and toks[2]:
+        hms = toks[2].split(':')
+        for fac, x in zip((3600., 60., 1.), hms):
+            t += fac * float(x)
+
+    return t
+
+def _resp_match(pattern, code):
+    # a location given as '??' also matches the empty location code
+    return set(pattern) <= set('?*') or fnmatch.fnmatchcase(code, pattern)
+
+cached_resp_epochs = util.LRUCache(64)
+def get_resp_epochs(respfile):
+    '''Get channel epochs defined in a RESP file.
+
+    :returns: list of tuples ``(network, station, location, channel, tmin,
+        tmax)``, where *tmax* is ``None`` for open epochs; location and
+        channel may contain wildcards ``?`` as given in the file
+    '''
+
+    stat = os.stat(respfile)
+    key = (respfile, stat[8], stat[6])
+    epochs = cached_resp_epochs.get(key)
+    if epochs is not None:
+        return epochs
+
+    epochs = []
+    station = network = location = channel = tmin = None
+    f = open(respfile, 'r')
+    try:
+        for line in f:
+            if not line.startswith('B05'):
+                continue
+
+            blk = line[:7]
+            val = line.split(':', 1)[-1].strip()
+            if blk == 'B050F03':
+                station = val
+            elif blk == 'B050F16':
+                network = val
+            elif blk == 'B052F03':
+                location = val
+            elif blk == 'B052F04':
+                channel = val
+            elif blk == 'B052F22':
+                tmin = _resp_time(val)
+            elif blk == 'B052F23':
+                epochs.append((network, station, location, channel, tmin, 
+                               _resp_time(val)))
+    finally:
+        f.close()
+
+    cached_resp_epochs.put(key, epochs)
+    return epochs
+
 class InverseEvalresp(FrequencyResponse):
     '''Calls evalresp and generates values of the inverse instrument response for 
        deconvolution of instrument response.
@@ -1746,6 +2213,41 @@ class InverseEvalresp(FrequencyResponse):
         transfer = x[0][4]
         return 1./transfer
 
+    def get_epoch(self):
+        '''Get time span of the response epoch containing the instant.
+
+        :returns: tuple ``(tmin, tmax)`` or ``None`` if no unique epoch is
+            found in the response file
+        '''
+
+        try:
+            epochs = get_resp_epochs(self.respfile)
+        except (IOError, OSError, ValueError, IndexError):
+            return None
+
+        matches = []
+        for (net, sta, loc, cha, tmin, tmax) in epochs:
+            if ([ _resp_match(p, c) for (p, c) in 
+                  zip((net, sta, loc, cha), self.nslc_id) ] == [True]*4 and
+                    tmin is not None and tmin <= self.instant and 
+                    (tmax is None or self.instant <= tmax)):
+
+                matches.append((tmin, tmax))
+
+        if len(matches) != 1:
+            return None
+
+        return matches[0]
+
+    def cache_key(self):
+        # all traces within the same response epoch share the response
+        epoch = self.get_epoch()
+        if epoch is None:
+            epoch = self.instant
+
+        return ('InverseEvalresp', os.path.abspath(self.respfile), 
+                self.nslc_id, epoch, self.target)
+
 class PoleZeroResponse(FrequencyResponse):
     '''Evaluates frequency response from pole-zero representation.
 
@@ -1774,6 +2276,10 @@ class PoleZeroResponse(FrequencyResponse):
             a /= jomeg-p
         
         return a
+
+    def cache_key(self):
+        return ('PoleZeroResponse', tuple(self.zeros), tuple(self.poles), 
+                self.constant)
         
 class SampledResponse(FrequencyResponse):
     '''Interpolates frequency response given at a set of sampled frequencies.
@@ -1793,6 +2299,10 @@ class SampledResponse(FrequencyResponse):
         eimag = num.interp(freqs, self.freqs, num.imag(self.vals), left=self.left, right=self.right)
         transfer = ereal + 1.0j*eimag
         return transfer
+
+    def cache_key(self):
+        return ('SampledResponse', self.freqs.tostring(), 
+                self.vals.tostring(), self.left, self.right)
     
     def inverse(self):
         '''Get inverse as a new :py:class:`SampledResponse` object.'''
@@ -1826,6 +2336,9 @@ class IntegrationResponse(FrequencyResponse):
     def evaluate(self, freqs):
         return self._gain / (1.0j * 2. * num.pi*freqs)**self._n
 
+    def cache_key(self):
+        return ('IntegrationResponse', self._n, self._gain)
+
 class DifferentiationResponse(FrequencyResponse):
     '''The differentiation response, optionally multiplied by a constant gain.
 
@@ -1841,6 +2354,9 @@ class DifferentiationResponse(FrequencyResponse):
     def evaluate(self, freqs):
         return self._gain * (1.0j * 2. * num.pi * freqs)**self._n
 
+    def cache_key(self):
+        return ('DifferentiationResponse', self._n, self._gain)
+
 class AnalogFilterResponse(FrequencyResponse):
     '''Frequency response of an analog filter.
     
@@ -1853,6 +2369,9 @@ class AnalogFilterResponse(FrequencyResponse):
     def evaluate(self, freqs):
         return signal.freqs(self._b, self._a, freqs/(2.*pi))[1]
 
+    def cache_key(self):
+        return ('AnalogFilterResponse', tuple(self._b), tuple(self._a))
+
 class MultiplyResponse(FrequencyResponse):
     '''Multiplication of two :py:class:`FrequencyResponse` objects.'''
 
@@ -1863,21 +2382,391 @@ class MultiplyResponse(FrequencyResponse):
     def evaluate(self, freqs):
         return self._a.evaluate(freqs) * self._b.evaluate(freqs)
 
+    def cache_key(self):
+        ka, kb = self._a.cache_key(), self._b.cache_key()
+        if ka is None or kb is None:
+            return None
+
+        return ('MultiplyResponse', ka, kb)
+
 if sys.version_info >= (2,5):
     from need_python_2_5.trace import *
 
-cached_coefficients = {}
-def _get_cached_filter_coefs(order, corners, btype):
-    ck = (order, tuple(corners), btype)
-    if ck not in cached_coefficients:
-        if len(corners) == 0:
-            cached_coefficients[ck] = signal.butter(order, corners[0], btype=btype)
+def filter_many(traces, method, *args, **kwargs):
+    '''Apply the same filter to many traces at once.
+
+    :param traces: list of :py:class:`Trace` objects, which are modified in
+        place
+    :param method: name of the filter method: ``'lowpass'``, ``'highpass'``,
+        ``'bandpass'``, or ``'bandpass_fft'``
+
+    Further arguments are passed on to the filter, as with the corresponding
+    :py:class:`Trace` method. Traces with equal sampling interval and number
+    of samples are stacked into a 2D array which is filtered in a single call
+    to :py:func:`scipy.signal.lfilter` or a single batched FFT. The results
+    are the same as when calling the method on each trace.
+    '''
+
+    if method not in ('lowpass', 'highpass', 'bandpass', 'bandpass_fft'):
+        raise ValueError('unsupported filter method: %s' % method)
+
+    groups = {}
+    for tr in traces:
+        groups.setdefault((tr.deltat, tr.data_len()), []).append(tr)
+
+    for group in groups.itervalues():
+        data = num.array([ tr.ydata for tr in group ], dtype=num.float64)
+        data = getattr(group[0], '_'+method)(data, *args, **kwargs)
+        for tr, ydata in zip(group, data):
+            tr.drop_growbuffer()
+            tr.ydata = ydata
+
+def _demean(data):
+    '''Remove mean along last axis (in place).'''
+
+    data -= num.mean(data, axis=-1)[...,num.newaxis]
+
+# second-order sections are available since scipy 0.16
+have_sos = hasattr(signal, 'sosfilt')
+
+cached_coefficients = util.LRUCache(256)
+def _get_cached_filter_coefs(order, corners, btype, output='ba'):
+    '''Get Butterworth filter coefficients, using a bounded cache.
+
+    :param order: order of the filter
+    :param corners: list of corner frequencies normalised by the Nyquist
+        frequency
+    :param btype: ``'low'``, ``'high'`` or ``'band'``
+    :param output: ``'ba'`` for ``(b, a)`` or ``'sos'`` for second-order
+        sections
+
+    Use ``cached_coefficients.get_stats()`` to get the cache statistics.
+    '''
+
+    ck = (order, tuple(corners), btype, output)
+    coefs = cached_coefficients.get(ck)
+    if coefs is None:
+        if len(corners) == 1:
+            wn = corners[0]
         else:
-            cached_coefficients[ck] = signal.butter(order, corners, btype=btype)
+            wn = corners
+
+        if output == 'sos':
+            coefs = signal.butter(order, wn, btype=btype, output='sos')
+        else:
+            coefs = signal.butter(order, wn, btype=btype)
+            b, a = coefs
+            if btype != 'band' and (len(a) != order+1 or len(b) != order+1):
+                logger.warn('Erroneous filter coefficients returned by scipy.signal.butter(). You may need to downsample the signal before filtering.')
+
+        cached_coefficients.put(ck, coefs)
+
+    return coefs
 
-    return cached_coefficients[ck]
+def _butter_filter(order, corners, btype, data):
+    '''Apply Butterworth filter along the last axis of data.
+
+    Second-order sections are used if available, because high order filters
+    with low normalised corner frequencies are numerically unstable in
+    ``(b, a)`` form.
+    '''
+
+    if have_sos:
+        sos = _get_cached_filter_coefs(order, corners, btype, output='sos')
+        return signal.sosfilt(sos, data)
+    else:
+        b, a = _get_cached_filter_coefs(order, corners, btype)
+        return signal.lfilter(b, a, data)
     
     
+class ContinuousFilter(object):
+    '''Butterworth filter for continuous data split into successive traces.
+
+    :param order: order of the filter
+    :param corner_hp: lower corner frequency or ``None`` for a lowpass
+    :param corner_lp: upper corner frequency or ``None`` for a highpass
+
+    Traces passed to :py:meth:`process` are filtered with the final state of
+    the previous trace of the same channel as initial state, so that
+    successive pieces of a time series (e.g. windows from
+    :py:meth:`pyrocko.pile.Pile.chopper` with ``tpad=0`` or data arriving
+    in real time) are filtered as if they were one trace, without overlaps
+    and edge effects at the trace boundaries.
+
+    Filter states are kept *per channel*, as with :py:func:`co_lfilter`, and
+    are reset when gaps occur. After a reset, the filter is started in the
+    steady state for a constant signal equal to the first sample, so that
+    an offset in the data does not cause a transient. The mean is not
+    removed.
+    '''
+
+    def __init__(self, order, corner_hp=None, corner_lp=None):
+        if corner_hp is None and corner_lp is None:
+            raise ValueError('at least one corner frequency is needed')
+
+        self._order = order
+        self._corner_hp = corner_hp
+        self._corner_lp = corner_lp
+        self._states = States()
+
+    def coefficients(self, deltat):
+        '''Get filter coefficients for a given sampling interval.
+
+        :returns: second-order sections if these are supported by the
+            installed version of SciPy, ``(b, a)`` otherwise
+        '''
+
+        if self._corner_hp is not None and self._corner_lp is not None:
+            corners, btype = [self._corner_hp, self._corner_lp], 'band'
+        elif self._corner_lp is not None:
+            corners, btype = [self._corner_lp], 'low'
+        else:
+            corners, btype = [self._corner_hp], 'high'
+
+        if have_sos:
+            output = 'sos'
+        else:
+            output = 'ba'
+
+        return _get_cached_filter_coefs(self._order, 
+                [ corner*2.0*deltat for corner in corners ], btype, output)
+
+    def process(self, tr):
+        '''Filter a trace.
+
+        :returns: new :py:class:`Trace` object with the filtered data
+        '''
+
+        coefs = self.coefficients(tr.deltat)
+        data = tr.get_ydata().astype(num.float64)
+        out = tr.copy(data=False)
+        if data.size == 0:
+            out.set_ydata(data)
+            return out
+
+        zi = self._states.get(tr)
+        if have_sos:
+            if zi is None:
+                zi = signal.sosfilt_zi(coefs) * data[0]
+
+            ydata, zf = signal.sosfilt(coefs, data, zi=zi)
+        else:
+            b, a = coefs
+            if zi is None:
+                zi = signal.lfilter_zi(b, a) * data[0]
+
+            ydata, zf = signal.lfilter(b, a, data, zi=zi)
+        self._states.set(tr, zf)
+        out.set_ydata(ydata)
+        return out
+
+    def reset(self):
+        '''Forget the filter states of all channels.'''
+
+        self._states = States()
+
+class ContinuousResampler(object):
+    '''Rational polyphase resampler for continuous data split into successive traces.
+
+    :param deltat: sampling interval of the output traces
+    :param nmax: maximum up- and downsampling factor
+
+    Traces passed to :py:meth:`process` are resampled by the rational factor
+    ``up/down`` relating their sampling interval to *deltat*, using a
+    windowed sinc lowpass FIR filter at the upsampled rate. As with
+    :py:class:`ContinuousFilter`, the input history and the phase of the
+    next output sample are kept *per channel*, so that successive traces
+    (e.g. windows from :py:meth:`pyrocko.pile.Pile.chopper` with ``tpad=0``)
+    are resampled as if they were one trace, in bounded memory. State is
+    reset, when gaps occur. 
+
+    After a reset, output samples are placed at even multiples of *deltat*
+    (as close as possible) and the first output sample is not earlier than
+    the first input sample. Output is delayed by half the filter length, so
+    the last samples of each trace are returned with the next trace.
+    '''
+
+    def __init__(self, deltat, nmax=1000):
+        self._deltat = deltat
+        self._nmax = nmax
+        self._states = States()
+
+    def factors(self, deltat_in):
+        '''Get up- and downsampling factors for a given input sampling interval.'''
+
+        ratio = deltat_in / self._deltat
+        frac = fractions.Fraction(ratio).limit_denominator(self._nmax)
+        up, down = frac.numerator, frac.denominator
+        if up > self._nmax or abs(float(up)/down - ratio) > ratio*1e-9:
+            raise ResamplingFailed(
+                'cannot resample from deltat %g to %g with a rational factor' % 
+                (deltat_in, self._deltat))
+
+        return up, down
+
+    def coefficients(self, deltat_in):
+        '''Get FIR filter coefficients for a given input sampling interval.'''
+
+        up, down = self.factors(deltat_in)
+        ck = ('resample', up, down)
+        h = cached_coefficients.get(ck)
+        if h is None:
+            nhalf = 10*max(up, down)
+            h = signal.firwin(2*nhalf+1, 1.0/max(up, down), window=('kaiser', 5.0))
+            cached_coefficients.put(ck, h)
+
+        return h
+
+    def process(self, tr):
+        '''Resample a trace.
+
+        :returns: new :py:class:`Trace` object with the resampled data
+        '''
+
+        up, down = self.factors(tr.deltat)
+        h = self.coefficients(tr.deltat)
+        nhist = h.size // up + 1
+        delay = (h.size - 1) // 2
+        deltat_up = tr.deltat / up
+
+        data = tr.get_ydata()
+        state = self._states.get(tr)
+        if state is None:
+            tfirst = math.ceil(tr.tmin / self._deltat) * self._deltat
+            ioffset = delay + int(math.ceil((tfirst - tr.tmin) / deltat_up - 1e-6))
+            if data.dtype == num.float32:
+                hist = num.zeros(nhist, dtype=num.float32)
+            else:
+                hist = num.zeros(nhist, dtype=num.float64)
+        else:
+            hist, ioffset = state
+
+        x = num.concatenate((hist, data))
+        ydata = util.resample_fir(x, up, down, h, ioffset=ioffset + nhist*up)
+
+        out = tr.copy(data=False)
+        out.deltat = self._deltat
+        out.tmin = tr.tmin + (ioffset - delay) * deltat_up
+        out.set_ydata(ydata)
+
+        ioffset_next = ioffset + nhist*up + ydata.size*down - x.size*up
+        self._states.set(tr, (x[-nhist:].copy(), ioffset_next))
+        return out
+
+    def reset(self):
+        '''Forget the resampler states of all channels.'''
+
+        self._states = States()
+
+class StaLtaDetector(object):
+    '''Recursive STA/LTA trigger for continuous data split into successive traces.
+
+    :param tshort: length of short time window in [s]
+    :param tlong: length of long time window in [s]
+    :param threshold_on: STA/LTA ratio above which a trigger is declared
+    :param threshold_off: STA/LTA ratio below which the detector is re-armed
+        (defaults to *threshold_on*)
+    :param tdeadtime: minimum time between two triggers on the same channel
+        in [s]
+    :param quad: whether to square the data prior to applying the STA/LTA
+        filter
+
+    The short and long term averages are computed with recursive (exponential)
+    averaging, so that only a few numbers per channel have to be kept between
+    successive traces. Traces passed to :py:meth:`process` are treated as
+    continuation of the previous trace of the same channel, as with
+    :py:class:`ContinuousFilter`. On gaps, the state of the channel is reset.
+    No triggers are declared during the first *tlong* seconds after a reset,
+    while the long term average settles.
+    '''
+
+    def __init__(self, tshort, tlong, threshold_on, threshold_off=None, 
+            tdeadtime=0.0, quad=True):
+
+        if not tshort < tlong:
+            raise ValueError('tshort must be smaller than tlong')
+
+        if threshold_off is None:
+            threshold_off = threshold_on
+
+        if threshold_off > threshold_on:
+            raise ValueError('threshold_off must not be larger than threshold_on')
+
+        self._tshort = tshort
+        self._tlong = tlong
+        self._threshold_on = threshold_on
+        self._threshold_off = threshold_off
+        self._tdeadtime = tdeadtime
+        self._quad = quad
+        self._states = States()
+
+    def process(self, tr):
+        '''Feed a trace through the detector.
+
+        :returns: tuple ``(cf, triggers)``, where ``cf`` is a new
+            :py:class:`Trace` object with the STA/LTA ratio and ``triggers``
+            is a list of ``(time, value)`` tuples for each trigger onset
+            found in the trace
+        '''
+
+        data = tr.get_ydata().astype(num.float64)
+        cf = tr.copy(data=False)
+        if data.size == 0:
+            cf.set_ydata(data)
+            return cf, []
+
+        if self._quad:
+            data **= 2
+
+        ns = max(1, int(round(self._tshort/tr.deltat)))
+        nl = max(1, int(round(self._tlong/tr.deltat)))
+        cs, cl = 1.0/ns, 1.0/nl
+
+        state = self._states.get(tr)
+        if state is None:
+            state = ( num.array([(1.0-cs)*data[0]]),
+                      num.array([(1.0-cl)*data[0]]), 
+                      0, False, None )
+
+        zs, zl, nseen, on, tlast = state
+
+        sta, zs = signal.lfilter([cs], [1.0, cs-1.0], data, zi=zs)
+        lta, zl = signal.lfilter([cl], [1.0, cl-1.0], data, zi=zl)
+
+        ratio = num.zeros(data.size)
+        mask = lta > 0.0
+        ratio[mask] = sta[mask] / lta[mask]
+        if nseen < nl:
+            ratio[:nl-nseen] = 0.0
+
+        # hysteresis: on above threshold_on, off below threshold_off
+        event = num.zeros(data.size, dtype=num.int8) - 1
+        event[ratio < self._threshold_off] = 0
+        event[ratio > self._threshold_on] = 1
+        iev = num.where(event >= 0, num.arange(data.size), -1)
+        iev = num.maximum.accumulate(iev)
+        triggered = num.where(iev >= 0, event[num.maximum(iev, 0)], int(on))
+        onsets = num.nonzero(num.diff(
+            num.concatenate(([int(on)], triggered))) == 1)[0]
+
+        triggers = []
+        for ionset in onsets:
+            t = tr.tmin + ionset*tr.deltat
+            if tlast is None or t - tlast >= self._tdeadtime:
+                triggers.append((t, ratio[ionset]))
+                tlast = t
+
+        self._states.set(tr, (zs, zl, nseen + data.size, 
+                              bool(triggered[-1]), tlast))
+
+        cf.set_ydata(ratio)
+        return cf, triggers
+
+    def reset(self):
+        '''Forget the detector states of all channels.'''
+
+        self._states = States()
+
 class _globals:
     _numpy_has_correlate_flip_bug = None
 
@@ -2048,15 +2937,38 @@ def moving_sum(x,n, mode='valid'):
 
 def nextpow2(i):
     return 2**int(math.ceil(math.log(i)/math.log(2.)))
+
+def nextsmooth(i):
+    '''Get smallest number of the form 2**a * 3**b * 5**c not less than i.
+
+    FFTs of such lengths are fast, and the padding needed is smaller than
+    with :py:func:`nextpow2`.
+    '''
+
+    best = nextpow2(i)
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < i:
+                p *= 2
+
+            best = min(best, p)
+            p35 *= 3
+
+        p5 *= 5
+
+    return best
     
 def snapper_w_offset(nmax, offset, delta, snapfun=math.ceil):
     def snap(x):
-        return max(0,min(snapfun((x-offset)/delta),nmax))
+        return int(max(0,min(snapfun((x-offset)/delta),nmax)))
     return snap
 
 def snapper(nmax, delta, snapfun=math.ceil):
     def snap(x):
-        return max(0,min(snapfun(x/delta),nmax))
+        return int(max(0,min(snapfun(x/delta),nmax)))
     return snap
 
 def apply_costaper(a, b, c, d, y, x0, dx):
@@ -245,6 +245,83 @@ def polylinefit(x,y, n_or_xnodes):
 
     return xnodes, ynodes, rms_error
 
+class LRUCache(object):
+    '''Dictionary-like cache holding a limited number of entries.
+
+    When more than *nmax* entries are stored, or when the entries, which
+    must then be NumPy arrays, take more than *nbytes_max* bytes, the least
+    recently used ones are dropped. Hits, misses and evictions are counted.
+
+    :param nmax: maximum number of entries
+    :param nbytes_max: maximum total size of the entries or ``None``
+    '''
+
+    def __init__(self, nmax, nbytes_max=None):
+        self.nmax = nmax
+        self.nbytes_max = nbytes_max
+        self.nbytes = 0
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+        self._entries = {}
+        self._tick = 0
+
+    def get(self, key, default=None):
+        '''Get entry and mark it as recently used.'''
+
+        if key not in self._entries:
+            self.nmisses += 1
+            return default
+
+        self.nhits += 1
+        self._tick += 1
+        tick, value, nbytes = self._entries[key]
+        self._entries[key] = (self._tick, value, nbytes)
+        return value
+
+    def put(self, key, value):
+        '''Insert entry, dropping least recently used ones if needed.'''
+
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[2]
+
+        nbytes = 0
+        if self.nbytes_max is not None:
+            nbytes = value.nbytes
+
+        self._tick += 1
+        self._entries[key] = (self._tick, value, nbytes)
+        self.nbytes += nbytes
+        if len(self._entries) > self.nmax or (
+                self.nbytes_max is not None and self.nbytes > self.nbytes_max):
+
+            for tick, k in sorted( (tick, k) for (k, (tick, v, n)) 
+                                   in self._entries.iteritems() ):
+                if len(self._entries) <= self.nmax and (
+                        self.nbytes_max is None or 
+                        self.nbytes <= self.nbytes_max) or k == key:
+                    break
+
+                self.nbytes -= self._entries.pop(k)[2]
+                self.nevictions += 1
+
+    def clear(self):
+        self._entries = {}
+        self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        '''Get dict with size and hit/miss/eviction counters of the cache.'''
+
+        return dict(n=len(self._entries), nmax=self.nmax, nbytes=self.nbytes,
+                    nbytes_max=self.nbytes_max, nhits=self.nhits,
+                    nmisses=self.nmisses, nevictions=self.nevictions)
+
 class GlobalVars:
     reuse_store = dict()
     decitab_nmax = 0
@@ -304,12 +381,116 @@ def decimate(x, q, n=None, ftype='iir', zi=None):
     else:
         zi_ = zi
     
-    y, zf = signal.lfilter(b, a, x, zi=zi_)
+    if ftype == 'fir':
+        y, zf = decimate_fir(x, q, b, ioffset=n/2, zi=zi_)
+    else:
+        y, zf = signal.lfilter(b, a, x, zi=zi_)
+        y = y[n/2::q].copy()
 
     if zi is not None:
-        return y[n/2::q].copy(), zf
+        return y, zf
+    else:
+        return y
+
+def decimate_fir(x, q, b, ioffset=0, zi=None):
+    '''Apply FIR filter to a signal and keep every q-th output sample.
+
+    Gives the same result as ``signal.lfilter(b, [1.], x, zi=zi)`` sliced
+    with ``[ioffset::q]``, but only the output samples which are kept are
+    computed (polyphase decimation). Single precision input is processed in
+    single precision, other input is converted to double precision.
+
+    :param x: the signal to be filtered (1D NumPy array)
+    :param q: the downsampling factor
+    :param b: FIR filter coefficients
+    :param ioffset: index of the first output sample to keep
+    :param zi: ``None`` or initial filter state of length ``len(b)-1``, as
+        used by :py:func:`scipy.signal.lfilter`
+
+    :returns: the decimated signal (1D NumPy array) or, if *zi* is given, a
+        tuple with the decimated signal and the final filter state
+    '''
+
+    if x.dtype in (num.float32, num.float64):
+        dtype = x.dtype
+    else:
+        dtype = num.float64
+
+    x = num.asarray(x, dtype=dtype)
+    b = num.asarray(b, dtype=dtype)
+    n = b.size - 1
+    nx = x.size
+
+    ny = max(0, (nx - ioffset + q - 1) // q)
+    y = num.zeros(ny, dtype=dtype)
+    if ny:
+        # output sample m is sum(b[j] * xp[ioffset+n+m*q-j]) where xp is the
+        # zero-padded input; the taps with j % q == r only see every q-th
+        # sample of xp, so each group of taps is a short convolution at the
+        # low rate
+        xp = num.concatenate((num.zeros(n, dtype=dtype), x))
+        for r in xrange(min(q, n+1)):
+            br = b[r::q]
+            k = ioffset + n - r
+            xr = xp[k % q::q][k//q-br.size+1:k//q+ny]
+            y += num.convolve(xr, br)[br.size-1:br.size-1+ny]
+
+    if zi is None:
+        return y
+
+    zi = num.asarray(zi)
+    ks = num.arange(ioffset, min(n, nx), q)
+    y[(ks-ioffset)//q] += zi[ks]
+
+    xs = x[max(0, nx-n):]
+    zf = num.convolve(xs, b)[xs.size:xs.size+n]
+    if nx < n:
+        zf[:n-nx] += zi[nx:]
+
+    return y, zf
+
+def resample_fir(x, up, down, h, ioffset=0):
+    '''Resample a signal by a rational factor using a FIR filter.
+
+    The signal is upsampled by inserting ``up-1`` zeros after each sample,
+    filtered with *h* and every *down*-th sample is kept, starting at index
+    *ioffset* of the upsampled signal. Only the output samples which are kept
+    are computed (polyphase resampling, see :py:func:`decimate_fir`), and
+    the result is multiplied by *up* to preserve the amplitude.
+
+    :param x: the signal to be resampled (1D NumPy array)
+    :param up: upsampling factor
+    :param down: downsampling factor
+    :param h: FIR filter coefficients, at the upsampled rate
+    :param ioffset: index of the first output sample in the upsampled signal
+
+    :returns: the resampled signal (1D NumPy array), with one sample for each
+        kept index smaller than ``up*len(x)``
+    '''
+
+    x = num.asarray(x)
+    nx = x.size
+    ny = max(0, (up*nx - ioffset + down - 1) // down)
+    if x.dtype == num.float32:
+        dtype = num.float32
     else:
-        return y[n/2::q].copy()
+        dtype = num.float64
+
+    y = num.zeros(ny, dtype=dtype)
+
+    # output samples m, m+up, m+2*up, ... all use the same phase of the
+    # filter and every down-th input sample, so each group is a decimation
+    for m in xrange(min(up, ny)):
+        n = ioffset + m*down
+        hm = h[n % up::up]
+        if hm.size == 0:
+            continue
+
+        ym = decimate_fir(x, down, hm, ioffset=n // up)
+        y[m::up] = ym[:y[m::up].size]
+
+    y *= up
+    return y
     
 class UnavailableDecimation(Exception):
     '''Exception raised by :py:func:`decitab` for unavailable decimation factors.'''
@@ -609,7 +790,12 @@ def ensuredirs(dst):
     
     for d in dirs:
         if not os.path.exists(d):
-            os.mkdir(d)
+            try:
+                os.mkdir(d)
+            except OSError, e:
+                # may have been created concurrently by another thread
+                if e.errno != errno.EEXIST:
+                    raise
 
 def ensuredir(dst):
     '''Create directory and all intermediate path components to it as needed.
@@ -623,7 +809,11 @@ def ensuredir(dst):
         return
         
     ensuredirs(dst)
-    os.mkdir(dst)
+    try:
+        os.mkdir(dst)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
     
 def reuse(x):
     '''Get unique instance of an object.
@@ -657,13 +847,14 @@ class Anon:
             self.__dict__[k] = dict[k]
 
 
-def select_files( paths, selector=None,  regex=None, show_progress=True ):
+def select_files( paths, selector=None,  regex=None, show_progress=True, walk=None ):
     '''Recursively select files.
     
     :param paths: entry path names
     :param selector: callback for conditional inclusion
     :param regex: pattern for conditional inclusion
     :param show_progress: if True, indicate start and stop of processing
+    :param walk: directory tree generator to use instead of :py:func:`os.walk`
     :returns: list of path names
     
     Recursively finds all files under given entry points *paths*. If
@@ -716,9 +907,12 @@ def select_files( paths, selector=None,  regex=None, show_progress=True ):
     if isinstance(paths, str):
         paths = [ paths ]
 
+    if walk is None:
+        walk = os.walk
+
     for path in paths:
         if os.path.isdir(path):
-            for (dirpath, dirnames, filenames) in os.walk(path):
+            for (dirpath, dirnames, filenames) in walk(path):
                 for filename in filenames:
                     addfile(pjoin(dirpath,filename))
         else:
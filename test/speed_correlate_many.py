@@ -0,0 +1,44 @@
+import time
+from pyrocko import trace
+import numpy as num
+
+def mktraces(nchannels, n, deltat):
+    tmin = 1234567890.
+    return [ trace.Trace(station='S%03i' % i, tmin=tmin, deltat=deltat,
+                         ydata=num.random.normal(size=n)) 
+             for i in xrange(nchannels) ]
+
+def mktemplates(traces, ntemplates, tlen):
+    templates = []
+    for i in xrange(ntemplates):
+        tr0 = traces[0]
+        t = tr0.tmin + num.random.uniform(0., tr0.tmax-tr0.tmin-tlen)
+        templates.append([ tr.chop(t, t+tlen, inplace=False) 
+                           for tr in traces ])
+
+    return templates
+
+def loop(templates, traces):
+    for template in templates:
+        for a, b in zip(template, traces):
+            trace.correlate(a, b, mode='valid', normalization='gliding', 
+                            use_fft=True)
+
+print '%9s %9s %10s %10s %10s %14s' % ('nchannels', 'nsamples', 'ntemplates',
+    'loop', 'many', 'many (4 proc)')
+
+for nchannels, n, ntemplates in [ (3, 72000, 100), (10, 72000, 100), 
+                                  (3, 720000, 20) ]:
+    traces = mktraces(nchannels, n, 0.05)
+    templates = mktemplates(traces, ntemplates, 10.)
+
+    t0 = time.time()
+    loop(templates, traces)
+    t1 = time.time()
+    trace.correlate_many(templates, traces, 'gliding')
+    t2 = time.time()
+    trace.correlate_many(templates, traces, 'gliding', nworkers=4)
+    t3 = time.time()
+
+    print '%9i %9i %10i %10.3g %10.3g %14.3g' % (nchannels, n, ntemplates,
+        t1-t0, t2-t1, t3-t2)
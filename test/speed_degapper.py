@@ -0,0 +1,31 @@
+import time, sys
+from pyrocko import trace
+import numpy as num
+
+def mktraces(nchannels, npackets, nsamples_packet=1, deltat=1.0):
+    tmin = 1234567890.
+    tlen = nsamples_packet*deltat
+    ydata = num.zeros(nsamples_packet, dtype=num.int32)
+    traces = []
+    for ichannel in xrange(nchannels):
+        for ipacket in xrange(npackets):
+            traces.append(trace.Trace('', 'S%03i' % ichannel, '', 'Z',
+                tmin=tmin + ipacket*tlen, deltat=deltat, ydata=ydata))
+
+    traces.sort(lambda a,b: cmp(a.full_id, b.full_id))
+    return traces
+
+if len(sys.argv) > 1:
+    npackets_list = [ int(x) for x in sys.argv[1:] ]
+else:
+    npackets_list = [ 100, 1000, 10000 ]
+
+nchannels = 300
+print '%10s %10s %12s %12s' % ('nchannels', 'npackets', 'ntraces', 'degapper')
+for npackets in npackets_list:
+    traces = mktraces(nchannels, npackets)
+    t0 = time.time()
+    out = trace.degapper(traces)
+    t = time.time() - t0
+    assert len(out) == nchannels
+    print '%10i %10i %12i %12.3g' % (nchannels, npackets, len(traces), t)
@@ -0,0 +1,38 @@
+import time
+from pyrocko import trace
+import numpy as num
+
+def timeit(f, duration=1.0):
+    f()
+    b = time.time()
+    n = 0
+    while (time.time() - b) < duration:
+        f()
+        n += 1
+    return (time.time() - b)/n
+
+def mktraces(ntraces, n):
+    tmin = 1234567890.
+    return [ trace.Trace(tmin=tmin, deltat=0.05, 
+                         ydata=num.random.random(n)) for i in xrange(ntraces) ]
+
+methods = [ 
+    ('lowpass', (4, 5.)),
+    ('highpass', (4, 0.1)),
+    ('bandpass', (4, 0.1, 5.)),
+    ('bandpass_fft', (0.1, 5.)) ]
+
+print '%8s %8s %14s %12s %12s' % ('ntraces', 'nsamples', 'method', 'loop', 'filter_many')
+for ntraces, n in [ (2000, 1000), (200, 10000), (20, 100000) ]:
+    traces = mktraces(ntraces, n)
+    for method, args in methods:
+        def loop():
+            for tr in traces:
+                getattr(tr, method)(*args)
+
+        def many():
+            trace.filter_many(traces, method, *args)
+
+        a = timeit(loop)
+        b = timeit(many)
+        print '%8i %8i %14s %12.3g %12.3g' % (ntraces, n, method, a, b)
@@ -0,0 +1,77 @@
+import time, sys, random, bisect
+from pyrocko import trace, pile
+
+def timeit(f, duration=1.0):
+    f()
+    b = time.time()
+    n = 0
+    while (time.time() - b) < duration:
+        f()
+        n += 1
+    return (time.time() - b)/n
+
+class SortedScan:
+    '''Emulation of the previous lookup: scan traces sorted by tmin in the
+    range [tmin - tlenmax, tmax].'''
+
+    def __init__(self, traces):
+        self.traces = sorted(traces, key=lambda tr: tr.tmin)
+        self.tmins = [ tr.tmin for tr in self.traces ]
+        self.tlenmax = max( tr.tmax - tr.tmin for tr in traces )
+
+    def query(self, tmin, tmax):
+        ib = bisect.bisect_left(self.tmins, tmin - self.tlenmax)
+        ie = bisect.bisect_right(self.tmins, tmax)
+        return [ tr for tr in self.traces[ib:ie] if tr.is_relevant(tmin, tmax) ]
+
+def mktraces(n, nchannels=100, tlen=3600., nlong=10):
+    tmin = 1234567890.
+    deltat = 1.0
+    nsegments = n / nchannels
+    traces = []
+    for ichannel in xrange(nchannels):
+        for isegment in xrange(nsegments):
+            ctmin = tmin + isegment*tlen
+            traces.append(trace.Trace('', 'S%03i' % ichannel, '', 'Z',
+                tmin=ctmin, tmax=ctmin+tlen-deltat, deltat=deltat))
+
+    # a few long segments spoil the tmin-sorted scan
+    for i in xrange(nlong):
+        traces.append(trace.Trace('', 'LONG', '', 'Z',
+            tmin=tmin, tmax=tmin+nsegments*tlen-deltat, deltat=deltat))
+
+    return traces, tmin, tmin + nsegments*tlen
+
+if len(sys.argv) > 1:
+    exponents = [ int(x) for x in sys.argv[1:] ]
+else:
+    exponents = [4, 5, 6]
+
+print '%10s %12s %12s %12s' % ('nsegments', 'build index', 'index', 'sorted scan')
+for e in exponents:
+    traces, tmin, tmax = mktraces(10**e)
+
+    t0 = time.time()
+    index = pile.TimeIndex()
+    for i in xrange(0, len(traces), 24):
+        index.insert(pile.TracesFile(None, 'dummy%i' % i, 'mseed', 
+            mtime=0., size=0, traces=traces[i:i+24]))
+
+    index.tmin()
+    tbuild = time.time() - t0
+
+    scan = SortedScan(traces)
+
+    windows = [ random.uniform(tmin, tmax-600.) for i in xrange(100) ]
+    def query_index():
+        for wmin in windows:
+            index.query(wmin, wmin+600.)
+
+    def query_scan():
+        for wmin in windows:
+            scan.query(wmin, wmin+600.)
+
+    a = timeit(query_index)/len(windows)
+    b = timeit(query_scan)/len(windows)
+    print '%10i %12.3g %12.3g %12.3g' % (len(traces), tbuild, a, b)
+
@@ -1,5 +1,6 @@
-from pyrocko import mseed, trace, util, io
+from pyrocko import mseed, trace, util, io, sac, gse, gse_ext
 from pyrocko.io import FileLoadError
+from pyrocko.mseed import MSeedError
 import unittest
 import numpy as num
 import time
@@ -7,7 +8,7 @@ import tempfile
 import random
 from random import choice as rc
 from os.path import join as pjoin
-import os, sys
+import os, sys, re
 import shutil
 
 abc = 'abcdefghijklmnopqrstuvwxyz' 
@@ -15,6 +16,41 @@ abc = 'abcdefghijklmnopqrstuvwxyz'
 def rn(n):
     return ''.join( [ random.choice(abc) for i in xrange(n) ] )
 
+cm6_alphabet = '+-' + ''.join(map(chr, range(ord('0'), ord('9')+1) + 
+    range(ord('A'), ord('Z')+1) + range(ord('a'), ord('z')+1)))
+
+def encode_cm6(data):
+    diff2 = num.diff(num.concatenate(([0, 0], data)), 2)
+    chars = []
+    for x in diff2:
+        v = abs(int(x))
+        tail = []
+        while v > 0xf:
+            tail.insert(0, v & 0x1f)
+            v >>= 5
+
+        first = v | (16 if x < 0 else 0) | (32 if tail else 0)
+        chars.append(cm6_alphabet[first])
+        for i, c in enumerate(tail):
+            chars.append(cm6_alphabet[c | (32 if i < len(tail)-1 else 0)])
+
+    s = ''.join(chars)
+    return [ s[i:i+80] for i in xrange(0, len(s), 80) ]
+
+def gse2_waveform(sta, cha, tmin, deltat, data, sub_format):
+    if sub_format == 'CM6':
+        lines = encode_cm6(data)
+    else:
+        lines = [ ' '.join('%i' % x for x in data[i:i+10]) 
+                for i in xrange(0, data.size, 10) ]
+
+    stmin = util.time_to_str(tmin, format='%Y/%m/%d %H:%M:%S.3FRAC')
+    return '\n'.join([
+        'WID2 %s %-5s %-3s %-4s %-3s %8i %11.6f %10.4e %7.3f %-6s %5.1f %4.1f' % (
+            stmin, sta, cha, '', sub_format, data.size, 1.0/deltat, 1.0, 1.0, 'STS-2', -1.0, 0.0),
+        'DAT2' ] + lines + [
+        'CHK2 %8i' % gse.checksum_slow(data), '' ])
+
 class IOTestCase( unittest.TestCase ):
 
     def testWriteRead(self):
@@ -58,6 +94,154 @@ class IOTestCase( unittest.TestCase ):
         os.remove(tempfn)
     
     
+    def testReadMSeedStreaming(self):
+        tmin = 1234567890.
+        deltat = 0.01
+        traces1 = []
+        for sta in ('AAA', 'BBB', 'CCC'):
+            for iseg in range(2):
+                ydata = num.random.randint(-1000, 1000, size=5000).astype(num.int32)
+                traces1.append(trace.Trace('', sta, '', 'Z', 
+                    tmin=tmin+iseg*100., deltat=deltat, ydata=ydata))
+
+        tempfn = tempfile.mkstemp()[1]
+        mseed.save(traces1, tempfn)
+
+        it = mseed.iload(tempfn)
+        first = it.next()
+        assert first.station == 'AAA' and first.tmin == tmin
+        traces2 = [ first ] + list(it)
+        
+        traces3 = mseed.tuples_to_traces(tempfn, 
+                mseed.mseed_ext.get_traces(tempfn, True))
+        assert len(traces2) == len(traces3) == 6
+        traces2.sort(key=lambda tr: (tr.station, tr.tmin))
+        for tr1, tr2, tr3 in zip(traces1, traces2, traces3):
+            assert tr1 == tr2 == tr3
+
+        # record index gives the same segments
+        traces4, records = mseed.load_record_index(tempfn)
+        assert [ (tr.nslc_id, tr.tmin, tr.tmax) for tr in traces4 ] == \
+               [ (tr.nslc_id, tr.tmin, tr.tmax) for tr in mseed.iload(tempfn) ]
+
+        os.remove(tempfn)
+
+    def testReadMSeedMany(self):
+        tempdir = tempfile.mkdtemp()
+        traces1 = []
+        for i in range(10):
+            ydata = num.random.randint(-1000, 1000, size=20000).astype(num.int32)
+            traces1.append(trace.Trace('', 'S%02i' % i, '', 'Z', 
+                tmin=1234567890., deltat=0.01, ydata=ydata))
+
+        fns = [ pjoin(tempdir, 'S%02i' % i) for i in range(10) ]
+        for fn, tr in zip(fns, traces1):
+            mseed.save([tr], fn)
+        
+        results = list(mseed.iload_many(fns, nthreads=3))
+        assert [ fn for (fn, traces) in results ] == fns
+        for tr, (fn, traces) in zip(traces1, results):
+            assert traces == [ tr ]
+
+        # errors come in order
+        emptyfn = pjoin(tempdir, 'empty')
+        open(emptyfn, 'w').close()
+        it = mseed.iload_many(fns[:3] + [ emptyfn ] + fns[3:], nthreads=3)
+        for i in range(3):
+            it.next()
+
+        self.assertRaises(FileLoadError, it.next)
+
+        shutil.rmtree(tempdir)
+
+    def testImapThreadedBounded(self):
+        computed = []
+        def work(i):
+            computed.append(i)
+            return i
+
+        nthreads = 3
+        results = []
+        for i in mseed._imap_threaded(work, [ (i,) for i in range(50) ], nthreads):
+            time.sleep(0.005)
+            assert len(computed) - len(results) <= 2*nthreads + 1
+            results.append(i)
+
+        assert results == range(50)
+
+    def testWriteMSeedOptions(self):
+        tempdir = tempfile.mkdtemp()
+        tmin = 1234567890.
+        deltat = 0.01
+        traces1 = []
+        for i in range(6):
+            ydata = num.cumsum(num.random.randint(-10, 10, size=20000)).astype(num.int32)
+            traces1.append(trace.Trace('', 'S%02i' % i, '', 'Z', 
+                tmin=tmin, deltat=deltat, ydata=ydata))
+
+        template = pjoin(tempdir, '%(station)s')
+        fns = io.save(traces1, template, nworkers=3, record_length=512, encoding='STEIM2')
+        assert len(fns) == 6
+        for tr in traces1:
+            fn = tr.fill_template(template)
+            assert io.load(fn) == [ tr ]
+            traces, records = mseed.load_record_index(fn)
+            assert set(rec[1] for rec in records) == set([512])
+
+        # second half of the data appended to the first
+        tr = traces1[0]
+        tr1 = tr.chop(tmin, tmin+10000*deltat, inplace=False)
+        tr2 = tr.chop(tmin+10000*deltat, tmin+20000*deltat, inplace=False)
+        fn = pjoin(tempdir, 'appended')
+        io.save(tr1, fn)
+        io.save(tr2, fn, append=True)
+        assert io.load(fn) == [ tr ]
+
+        traces2 = [ trace.Trace(ydata=num.zeros(10)) ]
+        self.assertRaises(MSeedError, io.save, traces2, fn, encoding='STEIM2')
+        self.assertRaises(MSeedError, io.save, traces2, fn, record_length=1000)
+
+        shutil.rmtree(tempdir)
+
+    def testReadGSE2(self):
+        tmin = 1234567890.
+        deltat = 0.01
+        traces1 = []
+        content = []
+        for i, sub_format in enumerate(['CM6', 'INT', 'CM6']):
+            ydata = num.cumsum(num.random.randint(-100000, 100000, size=1000)).astype(num.int32)
+            tr = trace.Trace('', 'S%02i' % i, '', 'BHZ', 
+                tmin=tmin, deltat=deltat, ydata=ydata)
+            traces1.append(tr)
+            content.append(gse2_waveform(tr.station, tr.channel, tmin, deltat, ydata, sub_format))
+
+        tempfn = tempfile.mkstemp()[1]
+        f = open(tempfn, 'w')
+        f.write('\n'.join(content))
+        f.close()
+
+        traces2 = io.load(tempfn, format='gse2')
+        assert traces2 == traces1
+
+        traces3 = [ waveform.trace() for waveform in list(gse.readgse(tempfn))[0].waveforms ]
+        for tr1, tr3 in zip(traces1, traces3):
+            assert num.all(tr1.ydata == tr3.ydata)
+
+        traces4 = io.load(tempfn, format='gse2', getdata=False)
+        for tr1, tr4 in zip(traces1, traces4):
+            assert tr4.tmax == tr1.tmax
+
+        for tr in traces1:
+            assert gse_ext.checksum(tr.ydata) == gse.checksum_slow(tr.ydata)
+
+        # bad checksum is reported but data is loaded
+        f = open(tempfn, 'w')
+        f.write(re.sub(r'CHK2 +\d+', 'CHK2 1', '\n'.join(content)))
+        f.close()
+        assert io.load(tempfn, format='gse2') == traces1
+
+        os.remove(tempfn)
+
     def testReadSac(self):
         
         fn = os.path.join(sys.path[0], '2010.057.20.30.26.5356.IC.BJT.00.LHZ.R.SAC')
@@ -65,6 +249,70 @@ class IOTestCase( unittest.TestCase ):
         assert tr.meta['cmpaz'] == 0.0
         assert tr.meta['cmpinc'] == 0.0
 
+    def testReadSacMemmap(self):
+        
+        fn = os.path.join(sys.path[0], '2010.057.20.30.26.5356.IC.BJT.00.LHZ.R.SAC')
+        tr1 = io.load(fn, format='sac')[0]
+        tr2 = io.load(fn, format='sac', use_memmap=True)[0]
+        assert isinstance(tr2.ydata, num.memmap)
+        assert num.all(tr1.ydata == tr2.ydata)
+
+        tmin = tr1.tmin + 10.*tr1.deltat
+        tmax = tr1.tmin + 100.*tr1.deltat
+        tr3 = tr2.chop(tmin, tmax, inplace=False)
+        assert not isinstance(tr3.ydata, num.memmap)
+        assert tr3.ydata.dtype.isnative
+        assert num.all(tr1.chop(tmin, tmax, inplace=False).ydata == tr3.ydata)
+
+        # copy-on-write, file must not change
+        tr2.ydata[:] = 0.
+        tr4 = io.load(fn, format='sac')[0]
+        assert num.all(tr1.ydata == tr4.ydata)
+
+    def testSaveMemmapBigEndian(self):
+
+        fn = os.path.join(sys.path[0], '2010.057.20.30.26.5356.IC.BJT.00.LHZ.R.SAC')
+        tr1 = io.load(fn, format='sac')[0]
+        tempdir = tempfile.mkdtemp()
+        fn2 = pjoin(tempdir, 'big.sac')
+        sac.SacFile(fn, load_data=True).write(fn2, byte_sex='big')
+        tr2 = io.load(fn2, format='sac', use_memmap=True)[0]
+        assert not tr2.ydata.dtype.isnative
+
+        fn3 = pjoin(tempdir, 'out.mseed')
+        io.save([tr2], fn3)
+        tr3 = io.load(fn3)[0]
+        assert num.all(tr1.ydata == tr3.ydata)
+
+        # the C extension refuses to write raw swapped bytes
+        self.assertRaises(MSeedError, mseed.mseed_ext.store_traces,
+            [ ('', 'S', '', 'Z', 0, 0, 1.0, tr2.ydata) ], fn3)
+
+        del tr2
+        shutil.rmtree(tempdir)
+
+    def testReadSacNativeDtype(self):
+
+        fn = os.path.join(sys.path[0], '2010.057.20.30.26.5356.IC.BJT.00.LHZ.R.SAC')
+        tr1 = io.load(fn, format='sac')[0]
+        tr2 = io.load(fn, format='sac', native_dtype=True)[0]
+        assert tr1.ydata.dtype == num.float
+        assert tr2.ydata.dtype == num.float32
+        assert num.all(tr1.ydata == tr2.ydata)
+
+        # big endian file is swapped to native byte order
+        fn2 = tempfile.mkstemp()[1]
+        sac.SacFile(fn, load_data=True).write(fn2, byte_sex='big')
+        tr3 = io.load(fn2, format='sac', native_dtype=True)[0]
+        os.unlink(fn2)
+        assert tr3.ydata.dtype.isnative
+        assert tr3.ydata.dtype == num.float32
+        assert num.all(tr1.ydata == tr3.ydata)
+
+        tr3.bandpass(4, 0.01, 0.1)
+        tr1.bandpass(4, 0.01, 0.1)
+        assert num.allclose(tr1.ydata, tr3.ydata, atol=1e-3*num.abs(tr1.ydata).max())
+
 
 if __name__ == "__main__":
     util.setup_logging('test_io', 'warning')
@@ -2,7 +2,7 @@ from pyrocko import trace, pile, io, config, util
 
 import unittest
 import numpy as num
-import tempfile, random, os
+import tempfile, random, os, time
 from random import choice as rc
 from os.path import join as pjoin
     
@@ -82,6 +82,409 @@ class PileTestCase( unittest.TestCase ):
         pile.get_cache(cachedir).clean()
         shutil.rmtree(datadir)
     
+    def testCache(self):
+        import shutil
+        nfiles = 20
+        nsamples = 100
+        tmin = 1234567890
+        datadir = makeManyFiles(nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        cachedir = pjoin(datadir, '_cache_')
+        cache = pile.TracesFileCache(cachedir)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, cache=cache, show_progress=False)
+        
+        cache2 = pile.TracesFileCache(cachedir)
+        for fn in filenames:
+            tf = cache2.get(fn)
+            assert tf is not None
+            xtf = cache.get(fn)
+            assert tf.mtime == xtf.mtime and tf.size == xtf.size
+            assert [ tr.full_id for tr in tf.traces ] == [ tr.full_id for tr in xtf.traces ]
+        
+        fns = cache2.query(tmin+10, tmin+nsamples*2-10)
+        assert len(fns) == 2
+
+        fns = cache2.query(nslc_ids=[('xx', 'aaaa', '', 'zzz')])
+        assert len(fns) == len([ fn for fn in filenames if 'aaaa' in fn ])
+
+        os.unlink(filenames[0])
+        cache2.clean()
+        assert cache2.get(filenames[0]) is None
+        assert len(cache2.query()) == nfiles - 1
+
+        shutil.rmtree(datadir)
+
+    def testParallelScanning(self):
+        import shutil
+        nfiles = 30
+        nsamples = 100
+        tmin = 1234567890
+        datadir = makeManyFiles(nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        broken_fn = pjoin(datadir, 'broken.mseed')
+        f = open(broken_fn, 'w')
+        f.write('this is not a mseed file')
+        f.close()
+        filenames.append(broken_fn)
+
+        p1 = pile.Pile()
+        p1.load_files(filenames=filenames, show_progress=False)
+        p2 = pile.Pile()
+        p2.load_files(filenames=filenames, show_progress=False, nworkers=3)
+        
+        assert p1.abspaths == p2.abspaths
+        assert broken_fn not in p2.abspaths
+        assert sorted(p1.nslc_ids.items()) == sorted(p2.nslc_ids.items())
+        assert (p1.tmin, p1.tmax) == (p2.tmin, p2.tmax)
+        
+        shutil.rmtree(datadir)
+
+    def testTimeIndex(self):
+        
+        def brute(traces, tmin, tmax, nslc_ids=None):
+            return sorted([ tr for tr in traces if tr.is_relevant(tmin, tmax) 
+                            and (nslc_ids is None or tr.nslc_id in nslc_ids) ],
+                          key=lambda tr: tr.tmin)
+
+        tmin = 1234567890.
+        traces = []
+        for i in xrange(2000):
+            deltat = random.choice([0.01, 1.0, 10.])
+            nsamples = random.choice([10, 1000, 100000])
+            ctmin = tmin + random.uniform(-1e6, 1e6)
+            traces.append(trace.Trace('', random.choice(['a', 'b']), '', 'z', 
+                tmin=ctmin, tmax=ctmin+(nsamples-1)*deltat, deltat=deltat))
+
+        files = [ pile.MemTracesFile(None, traces[i:i+10]) 
+                  for i in xrange(0, len(traces), 10) ]
+
+        index = pile.TimeIndex()
+        for file in files:
+            index.insert(file)
+
+        def query(wmin, wmax, nslc_ids=None):
+            return [ file.get_trace(iseg) 
+                     for (file, iseg) in index.query(wmin, wmax, nslc_ids) ]
+        
+        assert len(index) == len(traces)
+        assert index.tmin() == min(tr.tmin for tr in traces)
+        assert index.tmax() == max(tr.tmax for tr in traces)
+
+        for i in xrange(100):
+            if i == 50:
+                for file in files[:100]:
+                    index.remove(file)
+                traces = traces[1000:]
+                assert len(index) == len(traces)
+                assert index.tmin() == min(tr.tmin for tr in traces)
+
+            wmin = tmin + random.uniform(-1.1e6, 1.1e6)
+            wmax = wmin + random.choice([1., 100., 10000., 1e6])
+            assert query(wmin, wmax) == brute(traces, wmin, wmax)
+            nslc_ids = [('', 'a', '', 'z')]
+            assert query(wmin, wmax, nslc_ids) == \
+                    brute(traces, wmin, wmax, nslc_ids)
+
+        for file in files[100:]:
+            index.remove(file)
+
+        assert len(index) == 0 and index.tmin() is None
+
+    def testCompactMetadata(self):
+        tmin = 1234567890.
+        traces = []
+        for i in xrange(100):
+            deltat = random.choice([0.0001, 0.01, 1.0])
+            ctmin = tmin + random.uniform(-1e5, 1e5) + deltat*0.1
+            traces.append(trace.Trace('', 'S%i' % (i%3), '', 'z', 
+                tmin=ctmin, tmax=ctmin+999*deltat, deltat=deltat))
+
+        tf = pile.TracesFile(None, 'dummy.mseed', 'mseed', mtime=0., size=0,
+                             traces=traces)
+
+        p = pile.Pile()
+        p.add_file(tf)
+        assert p.nslc_ids == tf.nslc_ids
+        assert len(p.nslc_ids) == 3 and p.deltatmin == 0.0001
+
+        for i in xrange(10):
+            wmin = tmin + random.uniform(-1.1e5, 1.1e5)
+            wmax = wmin + random.choice([1., 100., 10000.])
+            xtraces = sorted([ tr for tr in traces 
+                               if tr.is_relevant(wmin, wmax) ], 
+                             key=lambda tr: tr.tmin)
+
+            ytraces = p.relevant(wmin, wmax)
+            assert [ tr.full_id for tr in ytraces ] == \
+                    [ tr.full_id for tr in xtraces ]
+            assert all(tr.file is tf and tr.ydata is None for tr in ytraces)
+
+        p.remove_file(tf)
+        assert not p.index and p.tmin is None
+
+    def testPartialReads(self):
+        import shutil
+        datadir = tempfile.mkdtemp()
+        tmin = 1234567890.
+        deltat = 0.01
+        traces = []
+        for i in xrange(3):
+            for cha in ('BHZ', 'BHN'):
+                data = num.random.randint(-1000, 1000, size=30000).astype(num.int32)
+                traces.append(trace.Trace('xx', 'aaaa', '', cha, 
+                    tmin=tmin+i*30000*deltat, deltat=deltat, ydata=data))
+        
+        io.save(traces, pjoin(datadir, '%(channel)s-%(tmin)s.mseed'))
+        filenames = util.select_files([datadir], show_progress=False)
+        cachedir = pjoin(datadir,'_cache_')
+
+        p1 = pile.Pile()
+        p1.load_files(filenames, show_progress=False)
+        for file in p1.iter_files():
+            file.forget_records()
+
+        for cache in (None, pile.get_cache(cachedir)):
+            p2 = pile.Pile()
+            p2.load_files(filenames, cache=cache, show_progress=False)
+            for wmin, wmax in ((tmin+10., tmin+20.), (tmin+295., tmin+305.),
+                    (tmin-1., tmin+1000.)):
+
+                trs1, used_files1 = p1.chop(wmin, wmax, include_last=True)
+                trs2, used_files2 = p2.chop(wmin, wmax, include_last=True)
+                assert used_files1 and not used_files2
+                trs1 = trace.degapper(sorted(trs1, key=lambda tr: tr.full_id))
+                trs2 = trace.degapper(sorted(trs2, key=lambda tr: tr.full_id))
+                assert len(trs1) == len(trs2)
+                for tr1, tr2 in zip(trs1, trs2):
+                    assert tr1.nslc_id == tr2.nslc_id
+                    assert (tr1.tmin, tr1.tmax) == (tr2.tmin, tr2.tmax)
+                    assert num.all(tr1.ydata == tr2.ydata)
+
+        shutil.rmtree(datadir)
+
+    def testDataCache(self):
+        import shutil
+        nfiles = 10
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(nfiles, nsamples, ['xx'], ['aaaa'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        
+        nbytes_file = nsamples*8
+        p = pile.Pile(data_cache_nbytes=3*nbytes_file)
+        p.load_files(filenames, show_progress=False)
+        for file in p.iter_files():
+            file.forget_records()   # force loading of complete files
+
+        for i in xrange(2):
+            for traces in p.chopper(tinc=nsamples/2.):
+                for tr in traces:
+                    assert num.all(tr.ydata == 1.0)
+
+            stats = p.data_cache.get_stats()
+            assert stats['nbytes'] <= 3*nbytes_file
+            assert stats['nevictions'] == stats['nmisses'] - stats['nfiles']
+
+        assert stats['nmisses'] == 2*nfiles
+
+        nhits = stats['nhits']
+        for i in xrange(3):
+            p.chop(tmin, tmin+10.)
+            
+        stats = p.data_cache.get_stats()
+        assert stats['nhits'] == nhits + 2
+
+        shutil.rmtree(datadir)
+
+    def testDataCachePartialReads(self):
+        import shutil
+        nfiles = 3
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(nfiles, nsamples, ['xx'], ['aaaa'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        
+        p = pile.Pile()
+        p.load_files(filenames, show_progress=False)
+        assert all( file.records is not None for file in p.iter_files() )
+
+        for i in xrange(3):
+            traces, used_files = p.chop(tmin+100., tmin+200.)
+            assert traces and not used_files
+            for tr in traces:
+                assert num.all(tr.ydata == 1.0)
+
+        stats = p.data_cache.get_stats()
+        assert stats['nmisses'] == len(traces) and stats['nhits'] == 2*len(traces)
+        assert stats['nbytes'] > 0
+
+        # a range inside of one already decoded is not read again
+        p.chop(tmin+120., tmin+180.)
+        assert p.data_cache.get_stats()['nmisses'] == stats['nmisses']
+
+        for i in xrange(3):
+            for traces in p.chopper(tinc=100.):
+                for tr in traces:
+                    assert num.all(tr.ydata == 1.0)
+
+            if i == 0:
+                nmisses = p.data_cache.get_stats()['nmisses']
+
+        stats = p.data_cache.get_stats()
+        assert stats['nmisses'] == nmisses and stats['nhits'] > 0
+
+        shutil.rmtree(datadir)
+
+    def testChopperPrefetch(self):
+        import shutil, threading
+        nfiles = 20
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames, show_progress=False)
+        
+        def key(tr):
+            return (tr.nslc_id, tr.tmin, tr.tmax, tuple(tr.ydata))
+
+        windows1 = [ map(key, trs) for trs in p.chopper(tinc=333., tpad=10.) ]
+        windows2 = [ map(key, trs) for trs in 
+                     p.chopper(tinc=333., tpad=10., nprefetch=3) ]
+        assert windows1 == windows2
+
+        nthreads = threading.activeCount()
+        for trs in p.chopper(tinc=333., nprefetch=2):
+            break
+
+        assert threading.activeCount() == nthreads
+
+        shutil.rmtree(datadir)
+
+    def testChopperFilter(self):
+        tmin = 1234567890.
+        tr = trace.Trace('', 'aaaa', '', 'z', tmin=tmin, deltat=0.1, 
+                         ydata=num.random.random(3000))
+        p = pile.Pile()
+        p.add_file(pile.MemTracesFile(None, [tr]))
+        
+        whole = trace.ContinuousFilter(4, 0.1, 1.).process(tr)
+        pieces = []
+        for trs in p.chopper(tinc=33., trace_filter=trace.ContinuousFilter(4, 0.1, 1.)):
+            assert len(trs) == 1
+            pieces.append(trs[0].ydata)
+
+        y = num.concatenate(pieces)
+        assert y.size >= 2990
+        assert num.all(num.abs(y - whole.ydata[:y.size]) < 1e-9)
+
+    def testMapWindows(self):
+        import shutil
+        nfiles = 20
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        cachedir = pjoin(datadir,'_cache_')
+        p = pile.Pile()
+        p.load_files(filenames, cache=pile.get_cache(cachedir), show_progress=False)
+        
+        def summary(traces):
+            return [ (tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata)) 
+                     for tr in traces ]
+
+        expect = [ summary(trs) for trs in p.chopper(tinc=333., tpad=10.) ]
+        for nworkers in (1, 3):
+            results = list(p.map_windows(summary, tinc=333., tpad=10., nworkers=nworkers))
+            assert results == expect
+
+        results = list(p.map_windows(summary, tinc=333., tpad=10., nworkers=3, ordered=False))
+        assert sorted(results) == sorted(expect)
+        
+        shutil.rmtree(datadir)
+
+    def testCacheValidation(self):
+        import shutil
+        nfiles = 10
+        nsamples = 100
+        tmin = 1234567890
+        datadir = makeManyFiles(nfiles, nsamples, ['xx'], ['aaaa'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        cachedir = pjoin(datadir,'_cache_')
+        cache = pile.get_cache(cachedir)
+        
+        def load(validation):
+            p = pile.Pile()
+            p.load_files(filenames, cache=cache, show_progress=False, validation=validation)
+            return p
+
+        p = load('dirmtime')
+        tmax = p.tmax
+        
+        # modify last file in place, directory mtime stays the same
+        fn = sorted(filenames)[-1]
+        tr = io.load(fn)[0]
+        tr.append(num.ones(1000))
+        io.save([tr], fn)
+        
+        p = load('dirmtime')
+        assert p.tmax == tmax
+        assert p.reload_modified()
+        assert p.tmax == tmax + 1000.
+        assert not p.reload_modified()
+
+        p = load('trusted')
+        assert p.tmax == tmax + 1000.
+        
+        # removal of a file changes the directory mtime
+        os.remove(filenames[0])
+        p = load('trusted')
+        assert filenames[0] in p.abspaths
+        assert p.reload_modified()
+        assert filenames[0] not in p.abspaths
+        p = load('dirmtime')
+        assert filenames[0] not in p.abspaths
+
+        shutil.rmtree(datadir)
+
+    def testCachedWalk(self):
+        import shutil
+        datadir = makeManyFiles(5, 100, ['xx'], ['aaaa'], ['zzz'], 1234567890)
+        subdir = pjoin(datadir, 'sub')
+        os.mkdir(subdir)
+        io.save(io.load(util.select_files([datadir], show_progress=False)[0]), 
+                pjoin(subdir, 'x.mseed'))
+
+        # whole seconds, to be restorable with os.utime
+        tdir = int(time.time()) - 100
+        os.utime(subdir, (tdir, tdir))
+        cache = pile.get_cache(tempfile.mkdtemp())
+
+        def select():
+            return sorted(util.select_files([datadir], show_progress=False, 
+                                            walk=cache.walk))
+
+        filenames = sorted(util.select_files([datadir], show_progress=False))
+        assert len(filenames) == 6
+        assert select() == filenames
+        assert select() == filenames
+
+        # listing of a directory with unchanged mtime is taken from the cache
+        open(pjoin(subdir, 'y.mseed'), 'w').close()
+        os.utime(subdir, (tdir, tdir))
+        assert select() == filenames
+
+        os.utime(subdir, (tdir+10, tdir+10))
+        assert select() == sorted(filenames + [ pjoin(subdir, 'y.mseed') ])
+
+        p = pile.make_pile([datadir], cachedirname=cache.cachedir, 
+                           show_progress=False, validation='dirmtime')
+        assert len(p.abspaths) == 6
+
+        shutil.rmtree(cache.cachedir)
+        shutil.rmtree(datadir)
+
     def testMemTracesFile(self):
         tr = trace.Trace(ydata=num.arange(100,dtype=num.float))
         
@@ -1,5 +1,5 @@
 from pyrocko import trace, io, util, model
-import unittest, math, time
+import unittest, math, time, os, sys
 import numpy as num
 
 sometime = 1234567890.
@@ -46,6 +46,28 @@ class TraceTestCase(unittest.TestCase):
         assert num.amax(num.abs(ydata-ydata_shouldbe)) < eps, \
             'differentiation failed'
         
+    def testChopShared(self):
+        ydata = num.arange(100, dtype=num.float)
+        tr = trace.Trace(tmin=sometime, deltat=1.0, ydata=ydata)
+        copied = tr.chop(sometime+10., sometime+20., inplace=False)
+        assert not num.may_share_memory(copied.ydata, tr.ydata)
+        copied.ydata -= 1.
+
+        chopped = tr.chop(sometime+10., sometime+20., inplace=False, share=True)
+        assert num.may_share_memory(chopped.ydata, tr.ydata)
+        assert num.all(chopped.ydata == ydata[10:20])
+
+        # only the new trace is read-only
+        self.assertRaises(ValueError, chopped.ydata.__setitem__, 0, 1.)
+        tr.ydata[0] = 5.
+        tr.ydata[0] = 0.
+
+        chopped.taper(trace.CosTaper(sometime+10., sometime+12., 
+                                     sometime+17., sometime+19.))
+        assert chopped.ydata[0] == 0.
+        assert tr.ydata[10] == 10.
+        assert not num.may_share_memory(chopped.ydata, tr.ydata)
+
     def testDegapping(self):
         dt = 1.0
         atmin = 100.
@@ -83,6 +105,35 @@ class TraceTestCase(unittest.TestCase):
             for x in xs:
                 assert x.ydata.size == 18
                 assert numeq(x.ydata[8:10], res, 1e-6)
+
+    def testDegappingMany(self):
+        dt = 1.0
+        traces = []
+        for ichan in range(3):
+            for i in range(100):
+                traces.append(trace.Trace(station='S%i' % ichan, deltat=dt,
+                    ydata=num.arange(10, dtype=num.float) + i*10, 
+                    tmin=100. + i*10.))
+
+        # filled gap, covered duplicate, overlap and large gap
+        del traces[150]
+        traces.append(trace.Trace(station='S0', deltat=dt, 
+            ydata=num.arange(5, 10, dtype=num.float) + 500, tmin=605.))
+        traces.append(trace.Trace(station='S2', deltat=dt, 
+            ydata=num.arange(10, dtype=num.float) + 995, tmin=1095.))
+        traces.append(trace.Trace(station='S2', deltat=dt, 
+            ydata=num.arange(10, dtype=num.float), tmin=2000.))
+
+        traces.sort(lambda a,b: cmp(a.full_id, b.full_id))
+        xs = trace.degapper(traces, maxgap=30)
+        assert len(xs) == 4
+        assert [ x.station for x in xs ] == ['S0', 'S1', 'S2', 'S2']
+        assert num.all(xs[0].ydata == num.arange(1000))
+        assert numeq(xs[1].ydata, num.arange(1000), 1e-6)
+        assert xs[1].tmax == 100. + 999.
+        assert num.all(xs[2].ydata == num.arange(1005))
+        assert xs[2].tmax == 1104.
+        assert xs[3].tmin == 2000.
                 
 
 
@@ -300,6 +351,36 @@ class TraceTestCase(unittest.TestCase):
         assert numeq( c_ab.ydata, c_ba.ydata[::-1], 0.001 )
         assert numeq( c_ab2.ydata, c_ba2.ydata[::-1], 0.001 )
 
+    def testCorrelateMany(self):
+        deltat = 0.01
+        traces = [ trace.Trace(station='S%i' % i, tmin=sometime+0.3*i, 
+                               deltat=deltat, 
+                               ydata=num.random.normal(size=5000))
+                   for i in range(3) ]
+
+        templates = []
+        for i in range(3):
+            t = sometime + 5. + i*10.
+            templates.append([ tr.chop(t, t+1.+i, inplace=False) 
+                               for tr in traces ])
+
+        for normalization in (None, 'normal', 'gliding'):
+            cs = trace.correlate_many(templates, traces, normalization)
+            for template, ctemplate in zip(templates, cs):
+                assert len(ctemplate) == len(traces)
+                for a, b, c in zip(template, traces, ctemplate):
+                    c2 = trace.correlate(a, b, normalization=normalization)
+                    assert c.nslc_id == c2.nslc_id
+                    assert abs(c.tmin - c2.tmin) < deltat*0.01
+                    assert numeq(c.ydata, c2.ydata, 
+                                 1e-6 * num.abs(c2.ydata).max())
+
+        stacked = trace.correlate_many(templates, traces, 'gliding', 
+                                       stack=True)
+        for c in stacked:
+            t, v = c.max()
+            assert abs(t) < deltat*0.01 and abs(v - 1.0) < 1e-3
+
     def testNumpyCorrelate(self):
         primes = num.array([1,2,3,5,7,11,13,17,19,23,29,31], dtype=num.int)
         n = 6
@@ -403,6 +484,241 @@ class TraceTestCase(unittest.TestCase):
                 downsampler.close()
                 assert  (round(c2s[0].tmin / dt2) * dt2 - c2s[0].tmin )/dt1 < 0.5001
 
+    def testDecimateFIR(self):
+        from scipy import signal
+
+        b, a, n = util.decimate_coeffs(5, ftype='fir')
+        for nx in (3, 30, 1000):
+            x = num.random.random(nx)
+            zi = num.random.random(n)
+            for ioffset in (0, 2, n/2):
+                y, zf = util.decimate_fir(x, 5, b, ioffset=ioffset, zi=zi)
+                yref, zfref = signal.lfilter(b, [1.], x, zi=zi)
+                assert numeq(y, yref[ioffset::5], 1e-9)
+                assert numeq(zf, zfref, 1e-9)
+
+        # state carried across blocks
+        x = num.random.random(1000)
+        y1, zf = util.decimate_fir(x[:500], 5, b, zi=num.zeros(n))
+        y2, zf = util.decimate_fir(x[500:], 5, b, zi=zf)
+        assert numeq(num.concatenate((y1, y2)), util.decimate_fir(x, 5, b), 1e-9)
+
+        y = util.decimate_fir(x.astype(num.float32), 5, b)
+        assert y.dtype == num.float32
+        assert numeq(y, util.decimate_fir(x, 5, b), 1e-5)
+
+        # polyphase coroutine against filter-then-drop chain
+        tr = trace.Trace(tmin=sometime, deltat=0.1, ydata=x)
+        for pipe_new, pipe_old in [ 
+                (lambda target: trace.co_downsample(target, 5),
+                 lambda target: trace.co_antialias(
+                     trace.co_dropsamples(target, 5, n), 5, n)) ]:
+
+            results = []
+            for pipe in (pipe_new, pipe_old):
+                out = []
+                p = pipe(trace.co_list_append(out))
+                for i in xrange(4):
+                    p.send(tr.chop(sometime+i*25., sometime+(i+1)*25., 
+                                   inplace=False))
+                p.close()
+                results.append(out)
+
+            for a, b_ in zip(*results):
+                assert abs(a.tmin - b_.tmin) < 1e-6
+                assert numeq(a.ydata, b_.ydata, 1e-9)
+
+    def testFilterMany(self):
+        traces = []
+        for n, deltat in [ (1000, 0.01) ]*5 + [ (3000, 0.01) ]*3 + [ (1000, 0.1) ]:
+            ydata = num.random.randint(-1000, 1000, size=n).astype(num.int32)
+            traces.append(trace.Trace(tmin=sometime, deltat=deltat, ydata=ydata))
+
+        for method, args in [ 
+                ('lowpass', (4, 2.)), 
+                ('highpass', (4, 0.5)), 
+                ('bandpass', (2, 0.5, 2.)), 
+                ('bandpass_fft', (0.5, 2.)) ]:
+
+            xtraces = [ tr.copy() for tr in traces ]
+            for tr in xtraces:
+                getattr(tr, method)(*args)
+            
+            ytraces = [ tr.copy() for tr in traces ]
+            trace.filter_many(ytraces, method, *args)
+
+            for xtr, ytr in zip(xtraces, ytraces):
+                assert num.all(xtr.ydata == ytr.ydata)
+
+    def testContinuousFilter(self):
+        ydata = num.random.random(10000) + 10.
+        tr = trace.Trace(tmin=sometime, deltat=0.01, ydata=ydata)
+        for corners in [ (None, 5.), (0.5, None), (0.5, 5.) ]:
+            whole = trace.ContinuousFilter(4, *corners).process(tr)
+            assert abs(whole.ydata[0] - ydata[0]) < 1e-6 or corners[0] is not None
+
+            filt = trace.ContinuousFilter(4, *corners)
+            pieces = []
+            for i in xrange(10):
+                piece = tr.chop(sometime+i*10., sometime+(i+1)*10., inplace=False)
+                pieces.append(filt.process(piece).ydata)
+
+            assert numeq(num.concatenate(pieces), whole.ydata, 1e-9)
+
+            # state is reset after a gap
+            filt.process(tr.chop(sometime, sometime+10., inplace=False))
+            later = tr.chop(sometime+20., sometime+30., inplace=False)
+            assert numeq(filt.process(later).ydata, 
+                         trace.ContinuousFilter(4, *corners).process(later).ydata,
+                         1e-9)
+
+    def testResampleRational(self):
+        deltat = 0.01
+        tr = trace.Trace(tmin=sometime, deltat=deltat, 
+                         ydata=num.sin(2.*num.pi*3.*num.arange(10000)*deltat))
+
+        for newdeltat in (1./128., 1./40.):
+            resampled = tr.copy()
+            resampled.resample_rational(newdeltat)
+            assert resampled.deltat == newdeltat
+            assert abs(resampled.tmax - tr.tmax) < newdeltat
+            t = resampled.get_xdata() - sometime
+            ok = num.logical_and(t > 1., t < t[-1] - 1.)
+            assert numeq(resampled.ydata[ok], num.sin(2.*num.pi*3.*t[ok]), 0.005)
+
+            whole = trace.ContinuousResampler(newdeltat).process(tr)
+            resampler = trace.ContinuousResampler(newdeltat)
+            pieces = []
+            for i in xrange(10):
+                piece = tr.chop(sometime+i*10., sometime+(i+1)*10., inplace=False)
+                pieces.append(resampler.process(piece))
+
+            assert abs(pieces[0].tmin - whole.tmin) < newdeltat*0.001
+            for a, b in zip(pieces[:-1], pieces[1:]):
+                assert abs(b.tmin - (a.tmax + newdeltat)) < newdeltat*0.001
+
+            assert numeq(num.concatenate([ p.ydata for p in pieces ]), 
+                         whole.ydata, 1e-9)
+
+        self.assertRaises(trace.ResamplingFailed, 
+                          tr.resample_rational, deltat/math.sqrt(2.))
+
+    def testStaLtaDetector(self):
+        deltat = 0.01
+        ydata = num.random.normal(size=60000)
+        for tonset in (100., 103., 400.):
+            i = int(tonset/deltat)
+            ydata[i:i+500] *= 20.
+
+        tr = trace.Trace(tmin=sometime, deltat=deltat, ydata=ydata)
+        whole, triggers = trace.StaLtaDetector(1., 20., 5., 2., 
+                                               tdeadtime=10.).process(tr)
+
+        assert len(triggers) == 2
+        for (t, v), tonset in zip(triggers, (100., 400.)):
+            assert tonset <= t - sometime < tonset + 1.
+            assert v > 5.
+
+        detector = trace.StaLtaDetector(1., 20., 5., 2., tdeadtime=10.)
+        pieces = []
+        piece_triggers = []
+        for i in xrange(60):
+            piece = tr.chop(sometime+i*10., sometime+(i+1)*10., inplace=False)
+            cf, trigs = detector.process(piece)
+            pieces.append(cf.ydata)
+            piece_triggers.extend(trigs)
+
+        assert numeq(num.concatenate(pieces), whole.ydata, 1e-6)
+        assert len(piece_triggers) == len(triggers)
+        for (t1, v1), (t2, v2) in zip(piece_triggers, triggers):
+            assert abs(t1 - t2) < deltat/2. and abs(v1 - v2) < 1e-6
+
+    def testFilterSOS(self):
+        # high order bandpass with corners far below Nyquist, unstable in
+        # (b, a) form
+        n = 100000
+        ydata = num.random.random(n) - 0.5
+        tr = trace.Trace(tmin=sometime, deltat=0.001, ydata=ydata)
+        tr.bandpass(6, 0.1, 0.5)
+        assert num.all(num.isfinite(tr.ydata))
+        assert num.abs(tr.ydata).max() < 1.
+
+        stats = trace.cached_coefficients.get_stats()
+        tr.bandpass(6, 0.1, 0.5)
+        assert trace.cached_coefficients.get_stats()['nhits'] == stats['nhits'] + 1
+
+    def testTransferCache(self):
+        for i in [1, 2, 7, 17, 97, 1000, 1001, 4097]:
+            n = trace.nextsmooth(i)
+            assert n >= i and n <= trace.nextpow2(i)
+            m = n
+            for f in (2, 3, 5):
+                while m % f == 0:
+                    m /= f
+            assert m == 1
+            assert all(trace.nextsmooth(k) == n for k in xrange(i, n+1))
+
+        n = 1000
+        ydata = num.random.random(n) - 0.5
+        tr = trace.Trace(tmin=sometime, deltat=0.01, ydata=ydata)
+        resp = trace.PoleZeroResponse([0j], [-1.+1j, -1.-1j], 1.0)
+        flimits = (0.05, 0.1, 10., 20.)
+
+        class Uncached(trace.FrequencyResponse):
+            def evaluate(self, freqs):
+                return resp.evaluate(freqs)
+
+        stats = trace.Trace.cached_tapered_coefs.get_stats()
+        tr1 = tr.transfer(tfade=1., freqlimits=flimits, transfer_function=resp)
+        tr2 = tr.transfer(tfade=1., freqlimits=flimits, transfer_function=resp)
+        tr3 = tr.transfer(tfade=1., freqlimits=flimits, 
+                          transfer_function=Uncached())
+
+        stats2 = trace.Trace.cached_tapered_coefs.get_stats()
+        assert stats2['nhits'] == stats['nhits'] + 1
+        assert stats2['nmisses'] == stats['nmisses'] + 1
+        assert num.all(tr1.ydata == tr2.ydata)
+        assert num.all(tr1.ydata == tr3.ydata)
+
+    def testEvalrespCacheKey(self):
+        respfile = os.path.join(sys.path[0], '..', 'examples', 
+                                'RESP.CZ.KHC..BHZ')
+
+        def make_trace(tmin):
+            return trace.Trace('CZ', 'KHC', '', 'BHZ', tmin=tmin, deltat=0.05,
+                               ydata=num.random.random(1000))
+
+        def resp(tmin):
+            return trace.InverseEvalresp(respfile, make_trace(tmin))
+
+        # two traces in the epoch 2003,300 - 2010,365
+        tr1 = make_trace(util.str_to_time('2005-01-01 00:00:00'))
+        tr2 = make_trace(util.str_to_time('2008-06-01 12:00:00'))
+        resp1 = trace.InverseEvalresp(respfile, tr1)
+        resp2 = trace.InverseEvalresp(respfile, tr2)
+        assert resp1.instant != resp2.instant
+        assert resp1.cache_key() == resp2.cache_key()
+
+        flimits = (0.01, 0.02, 5., 8.)
+        stats = trace.Trace.cached_tapered_coefs.get_stats()
+        tr1.transfer(tfade=5., freqlimits=flimits, transfer_function=resp1)
+        tr2.transfer(tfade=5., freqlimits=flimits, transfer_function=resp2)
+        stats2 = trace.Trace.cached_tapered_coefs.get_stats()
+        assert stats2['nmisses'] == stats['nmisses'] + 1
+        assert stats2['nhits'] == stats['nhits'] + 1
+        assert resp1.get_epoch() == (
+            util.str_to_time('2003-10-27 00:00:00'), 
+            util.str_to_time('2010-12-31 00:00:00'))
+
+        # previous epoch
+        resp3 = resp(util.str_to_time('2000-01-01 00:00:00'))
+        assert resp3.cache_key() != resp1.cache_key()
+
+        # outside of all epochs, only the same instant matches
+        resp4 = resp(util.str_to_time('2012-01-01 00:00:00'))
+        assert resp4.get_epoch() is None
+        assert resp4.cache_key() != resp(resp4.instant + 1.).cache_key()
+
 if __name__ == "__main__":
     util.setup_logging('test_trace', 'warning')
     unittest.main()
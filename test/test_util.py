@@ -1,5 +1,5 @@
 from pyrocko import mseed, trace, util, io
-import unittest, math, calendar, time
+import unittest, math, calendar, time, tempfile, shutil, os, threading
 from random import random
 
 class UtilTestCase( unittest.TestCase ):
@@ -35,6 +35,43 @@ class UtilTestCase( unittest.TestCase ):
         assert s1 == '2001-12-01 00:00:00.000'
         assert s2 == '2002-01-01 00:00:00.000'
 
+    def testLRUCache(self):
+        cache = util.LRUCache(3)
+        for i in xrange(3):
+            cache.put(i, str(i))
+
+        assert cache.get(0) == '0'
+        cache.put(3, '3')
+        assert 1 not in cache and 0 in cache and len(cache) == 3
+        assert cache.get(1) is None
+        stats = cache.get_stats()
+        assert (stats['nhits'], stats['nmisses'], stats['nevictions']) == (1, 1, 1)
+
+    def testEnsuredirsConcurrent(self):
+        tempdir = tempfile.mkdtemp('', 'pyrocko-test-')
+        try:
+            errors = []
+            def work(i):
+                try:
+                    util.ensuredirs(os.path.join(tempdir, 'a', 'b', 'c', 'f%i' % i))
+                except Exception, e:
+                    errors.append(e)
+
+            for irun in xrange(20):
+                shutil.rmtree(os.path.join(tempdir, 'a'), ignore_errors=True)
+                threads = [ threading.Thread(target=work, args=(i,)) for i in xrange(8) ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                assert os.path.isdir(os.path.join(tempdir, 'a', 'b', 'c'))
+
+            assert not errors
+
+        finally:
+            shutil.rmtree(tempdir)
+
 if __name__ == "__main__":
     util.setup_logging('test_util', 'warning')
     unittest.main()